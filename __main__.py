@@ -8,12 +8,12 @@ Usage:
 
 import asyncio
 
-from espagent.cli import cli_main
+from espagent.cli import cli_main, parse_args
 
 
 def main() -> None:
     """Python module execution main entry point."""
-    asyncio.run(cli_main())
+    asyncio.run(cli_main(startup_profile=parse_args().startup_profile))
 
 
 if __name__ == "__main__":
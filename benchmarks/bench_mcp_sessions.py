@@ -0,0 +1,115 @@
+"""Benchmark per-call MCP tool latency with and without persistent sessions.
+
+Usage:
+    python -m espagent.benchmarks.bench_mcp_sessions              # local stand-in
+    python -m espagent.benchmarks.bench_mcp_sessions --url http://localhost:8090/mcp --tool idf_size
+
+Without ``--url`` a FastMCP stand-in server with an ``echo`` tool is started
+on a free local port, so only session setup and transport overhead are
+measured. Both modes call the same LangChain tool wrapper; the unpooled one
+opens a new streamable-HTTP session (initialize handshake included) per call.
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import threading
+import time
+
+from mcp.types import Tool as MCPTool
+
+
+def _start_standin() -> tuple[str, object, threading.Thread]:
+    """Serve a FastMCP echo server in a thread; returns (url, server, thread)."""
+    import uvicorn
+    from mcp.server.fastmcp import FastMCP
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    app = FastMCP("standin", host="127.0.0.1", port=port, log_level="WARNING")
+
+    @app.tool()
+    def echo(text: str) -> str:
+        """Return the given text."""
+        return text
+
+    server = uvicorn.Server(
+        uvicorn.Config(app.streamable_http_app(), host="127.0.0.1", port=port, log_level="error")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}/mcp", server, thread
+
+
+async def _measure(tool, args: dict, count: int) -> list[float]:
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        await tool.ainvoke(args)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _report(label: str, samples: list[float]) -> None:
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(
+        f"{label:<10} mean={statistics.mean(samples):8.1f} ms  "
+        f"p50={statistics.median(samples):8.1f} ms  p95={p95:8.1f} ms"
+    )
+
+
+async def _run(url: str, tool_name: str, args: dict, count: int) -> None:
+    from langchain_mcp_adapters.tools import convert_mcp_tool_to_langchain_tool
+
+    from espagent.tools.mcp import MCPSessionPool, _to_langchain, discover_server
+
+    connection = {"transport": "streamable_http", "url": url, "timeout": 30}
+    _, tools = await discover_server(connection)
+    tool: MCPTool = next(t for t in tools if t.name == tool_name)
+
+    unpooled = convert_mcp_tool_to_langchain_tool(
+        None, tool, connection=connection, server_name="bench"
+    )
+    sessions = MCPSessionPool(keepalive=0)
+    [pooled] = _to_langchain("bench", connection, [tool], sessions)
+
+    print(f"url={url} tool={tool_name} count={count}")
+    try:
+        _report("unpooled", await _measure(unpooled, args, count))
+        # The first pooled call pays for the handshake once
+        await pooled.ainvoke(args)
+        _report("pooled", await _measure(pooled, args, count))
+    finally:
+        await sessions.aclose()
+
+
+def main() -> None:
+    """Run the benchmark and print latency statistics."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Real streamable-HTTP MCP server (default: stand-in)")
+    parser.add_argument("--tool", default="echo", help="Tool to call")
+    parser.add_argument("--args", default='{"text": "ping"}', help="Tool arguments as JSON")
+    parser.add_argument("--count", type=int, default=50, help="Calls per mode")
+    args = parser.parse_args()
+
+    server = thread = None
+    url = args.url
+    if url is None:
+        url, server, thread = _start_standin()
+    try:
+        asyncio.run(_run(url, args.tool, json.loads(args.args), args.count))
+    finally:
+        if server is not None:
+            server.should_exit = True
+            thread.join()
+
+
+if __name__ == "__main__":
+    main()
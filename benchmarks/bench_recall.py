@@ -0,0 +1,128 @@
+"""Benchmark recall_memory latency for large per-user memory stores.
+
+Usage:
+    python -m espagent.benchmarks.bench_recall
+    python -m espagent.benchmarks.bench_recall --sizes 10000 --database-url postgresql://...
+
+Measures query-based recall against the in-process fallback index and a
+store-side vector index (InMemoryStore, or pgvector with ``--database-url``).
+The first query of the in-process index includes embedding every memory;
+later queries only embed the query. Warm queries run with an empty
+MemoryCache, so they measure the search itself; the cached series repeats
+each query to measure cache hits.
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from langgraph.store.base import PutOp
+
+from espagent.tools.memory import memory_cache, search_memories
+from espagent.utils.embeddings import HashingEmbeddings
+
+NAMESPACE = ("bench_user", "bench_user")
+TOPICS = [
+    "UART flashing fails at {} baud on ESP32-S3",
+    "Project {} uses ESP-IDF v5.2 with custom partition table",
+    "Prefers Chinese replies and concise build logs ({})",
+    "Board rev {} has a faulty USB-serial bridge",
+    "WiFi provisioning via BLE on device {}",
+    "Heap corruption traced to task stack of {} bytes",
+]
+QUERIES = ["UART flashing baud", "partition table", "heap corruption stack", "BLE WiFi"]
+
+
+def _memories(count: int) -> list[tuple[str, dict]]:
+    rng = random.Random(0)
+    now = time.time()
+    return [
+        (
+            f"mem_{i}",
+            {
+                "info": rng.choice(TOPICS).format(rng.randint(1, 100_000)),
+                "timestamp": now - rng.uniform(0, 365) * 86400,
+            },
+        )
+        for i in range(count)
+    ]
+
+
+def _timed_search(store, query: str) -> float:
+    start = time.perf_counter()
+    search_memories(store, NAMESPACE, query, 10)
+    return (time.perf_counter() - start) * 1000
+
+
+def _time_queries(store, rounds: int) -> tuple[float, list[float], list[float]]:
+    memory_cache.clear()
+    cold = _timed_search(store, QUERIES[0])
+    uncached, cached = [], []
+    for i in range(rounds):
+        query = QUERIES[i % len(QUERIES)]
+        # Drop cached results (and the shared scan) so the search really runs
+        memory_cache.clear()
+        uncached.append(_timed_search(store, query))
+        cached.append(_timed_search(store, query))
+    return cold, uncached, cached
+
+
+def _report(label: str, size: int, cold: float, uncached: list[float], cached: list[float]) -> None:
+    print(
+        f"{label:<14} n={size:<7} cold={cold:9.1f} ms  "
+        f"warm mean={statistics.mean(uncached):8.1f} ms  p50={statistics.median(uncached):8.1f} ms  "
+        f"cached p50={statistics.median(cached):6.3f} ms"
+    )
+
+
+def _bench_in_memory(size: int, rounds: int) -> None:
+    from langgraph.store.memory import InMemoryStore
+
+    memories = _memories(size)
+    local = InMemoryStore()
+    indexed = InMemoryStore(index={"dims": 512, "embed": HashingEmbeddings(), "fields": ["info"]})
+    for store in (local, indexed):
+        for key, value in memories:
+            store.put(NAMESPACE, key, value)
+
+    _report("in-process", size, *_time_queries(local, rounds))
+    _report("store index", size, *_time_queries(indexed, rounds))
+
+
+async def _bench_pgvector(database_url: str, size: int, rounds: int) -> None:
+    from langgraph.store.postgres.aio import AsyncPostgresStore
+
+    async with AsyncPostgresStore.from_conn_string(
+        database_url, index={"dims": 512, "embed": HashingEmbeddings(), "fields": ["info"]}
+    ) as store:
+        await store.setup()
+        memories = _memories(size)
+        for i in range(0, size, 1000):
+            await store.abatch([PutOp(NAMESPACE, k, v) for k, v in memories[i : i + 1000]])
+        try:
+            # search_memories is synchronous; run it off the loop like the agent's tools
+            timings = await asyncio.to_thread(_time_queries, store, rounds)
+            _report("pgvector", size, *timings)
+        finally:
+            for i in range(0, size, 1000):
+                await store.abatch([PutOp(NAMESPACE, k, None) for k, _ in memories[i : i + 1000]])
+
+
+def main() -> None:
+    """Run the benchmark and print latency statistics."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000", help="Comma-separated store sizes")
+    parser.add_argument("--rounds", type=int, default=20, help="Warm queries per size")
+    parser.add_argument("--database-url", help="Also benchmark pgvector on this database")
+    args = parser.parse_args()
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        _bench_in_memory(size, args.rounds)
+        if args.database_url:
+            asyncio.run(_bench_pgvector(args.database_url, size, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
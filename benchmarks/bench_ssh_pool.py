@@ -0,0 +1,110 @@
+"""Benchmark per-command ssh_run latency with and without session pooling.
+
+Usage:
+    python -m espagent.benchmarks.bench_ssh_pool            # stand-in transport
+    python -m espagent.benchmarks.bench_ssh_pool --host rig1  # real host
+
+Without ``--host`` a stand-in ``ssh`` executable is put first on PATH. It
+sleeps ``--handshake`` seconds whenever it has to open a new connection and
+emulates OpenSSH control masters with a marker file, so the pool code path is
+exercised end-to-end without an sshd.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+FAKE_SSH = """#!{python}
+import os, subprocess, sys, time
+
+args = sys.argv[1:]
+options, operation = {{}}, None
+while args and args[0].startswith("-"):
+    flag = args.pop(0)
+    if flag == "-o":
+        key, _, value = args.pop(0).partition("=")
+        options[key] = value
+    elif flag == "-O":
+        operation = args.pop(0)
+host = args.pop(0)
+control = options.get("ControlPath")
+
+if operation == "check":
+    sys.exit(0 if control and os.path.exists(control) else 255)
+if operation == "exit":
+    if control and os.path.exists(control):
+        os.unlink(control)
+    sys.exit(0)
+
+if not (control and os.path.exists(control)):
+    time.sleep({handshake})
+    if options.get("ControlMaster") == "auto" and control:
+        open(control, "w").close()
+sys.exit(subprocess.call(["sh", "-c", " ".join(args)]))
+"""
+
+
+def _measure(run, count: int) -> list[float]:
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _report(label: str, samples: list[float]) -> None:
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(
+        f"{label:<10} mean={statistics.mean(samples):8.1f} ms  "
+        f"p50={statistics.median(samples):8.1f} ms  p95={p95:8.1f} ms"
+    )
+
+
+def main() -> None:
+    """Run the benchmark and print latency statistics."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", help="Real ~/.ssh/config host (default: stand-in)")
+    parser.add_argument("--count", type=int, default=20, help="Commands per mode")
+    parser.add_argument("--command", default="true", help="Remote command to run")
+    parser.add_argument(
+        "--handshake", type=float, default=0.4, help="Stand-in handshake delay in seconds"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        host = args.host
+        if host is None:
+            host = "standin"
+            fake = Path(workdir) / "ssh"
+            fake.write_text(FAKE_SSH.format(python=sys.executable, handshake=args.handshake))
+            fake.chmod(0o755)
+            os.environ["PATH"] = f"{workdir}{os.pathsep}{os.environ['PATH']}"
+
+        from espagent.tools.ssh import SSHSessionPool
+
+        pool = SSHSessionPool(control_dir=os.path.join(workdir, "ctl"))
+
+        def unpooled() -> None:
+            subprocess.run(["ssh", host, args.command], capture_output=True, check=True)
+
+        def pooled() -> None:
+            with pool.session(host):
+                subprocess.run(pool.command(host, args.command), capture_output=True, check=True)
+
+        print(f"host={host} count={args.count} command={args.command!r}")
+        try:
+            _report("unpooled", _measure(unpooled, args.count))
+            _report("pooled", _measure(pooled, args.count))
+        finally:
+            pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark token counting of long threads: full recount vs token ledger.
+
+Usage:
+    python -m espagent.benchmarks.bench_tokens
+    python -m espagent.benchmarks.bench_tokens --messages 1000 --steps 50
+
+A synthetic debugging thread (user questions, tool calls and multi-KB build
+logs) is grown by one tool round-trip per agent step. Each step counts the
+whole history the way the summarization trigger does, once with
+``count_tokens_approximately`` over all messages and once with the ledger.
+"""
+
+import argparse
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+BUILD_LOG = "".join(
+    f"[{i:>3}/512] Building C object esp-idf/freertos/CMakeFiles/__idf_freertos.dir/port.c.obj\n"
+    for i in range(40)
+)
+
+
+def _round_trip(i: int) -> list:
+    call_id = f"call_{i}"
+    return [
+        AIMessage("", id=f"ai_{i}", tool_calls=[{"name": "idf_build", "args": {}, "id": call_id}]),
+        ToolMessage(BUILD_LOG, id=f"tool_{i}", tool_call_id=call_id),
+    ]
+
+
+def _thread(size: int) -> list:
+    messages = []
+    i = 0
+    while len(messages) < size:
+        if i % 5 == 0:
+            messages.append(HumanMessage(f"构建失败了，看看第 {i} 步的日志", id=f"human_{i}"))
+        messages.extend(_round_trip(i))
+        i += 1
+    return messages[:size]
+
+
+def _run(counter, base: list, steps: int) -> tuple[float, int]:
+    messages = list(base)
+    start = time.perf_counter()
+    total = 0
+    for step in range(steps):
+        messages.extend(_round_trip(len(base) + step))
+        total = counter(messages)
+    return time.perf_counter() - start, total
+
+
+def main() -> None:
+    """Run the benchmark and print per-step counting time."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000, help="Initial thread length")
+    parser.add_argument("--steps", type=int, default=50, help="Agent steps to simulate")
+    args = parser.parse_args()
+
+    from espagent.utils.tokens import TokenLedger
+
+    base = _thread(args.messages)
+    full_seconds, full_total = _run(count_tokens_approximately, base, args.steps)
+    ledger = TokenLedger()
+    ledger.count(base)  # the thread's earlier steps were already counted
+    ledger_seconds, ledger_total = _run(ledger, base, args.steps)
+
+    print(f"messages={args.messages} steps={args.steps} tokens={full_total}")
+    for label, seconds in (("recount", full_seconds), ("ledger", ledger_seconds)):
+        print(f"{label:<8} {seconds / args.steps * 1000:8.2f} ms/step")
+    assert ledger_total == full_total, (ledger_total, full_total)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Benchmark local tool selection against the LLM tool selector.
+
+Usage:
+    python -m espagent.benchmarks.bench_tool_selector          # local only
+    python -m espagent.benchmarks.bench_tool_selector --live   # also call the LLM
+
+A catalog of ESP-IDF style tools and labelled queries is ranked by
+``LocalToolSelectorMiddleware``. Offline, the report shows selection latency,
+how often the expected tool was selected and how often the LLM fallback
+would be needed. With ``--live`` (requires ``OPENAI_API_KEY``) every query
+also goes through ``LLMToolSelectorMiddleware`` and the agreement between
+both selections is reported.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from langchain.agents.middleware import LLMToolSelectorMiddleware, ModelRequest
+from langchain_core.messages import HumanMessage
+from langchain_core.tools import StructuredTool
+
+CATALOG = {
+    "idf_build": "Build the ESP-IDF project in the given directory with idf.py build.",
+    "idf_flash": "Flash the built firmware to a connected ESP32 board over a serial port.",
+    "idf_monitor": "Open the serial monitor and capture device log output for a number of seconds.",
+    "idf_size": "Report firmware image size, per-component memory usage and free IRAM/DRAM.",
+    "idf_set_target": "Set the chip target of the project, e.g. esp32, esp32s3 or esp32c3.",
+    "idf_menuconfig_get": "Read the value of a Kconfig option from sdkconfig.",
+    "idf_menuconfig_set": "Change a Kconfig option in sdkconfig.",
+    "idf_clean": "Delete build outputs with idf.py fullclean.",
+    "idf_erase_flash": "Erase the entire flash memory of the connected chip.",
+    "idf_create_project": "Create a new ESP-IDF project from the hello_world template.",
+    "idf_partition_table": "Show the partition table layout and sizes.",
+    "ls": "List files in a directory.",
+    "read_file": "Read the contents of a file.",
+    "write_file": "Write content to a file, replacing it.",
+    "grep": "Search file contents for a regular expression.",
+    "save_memory": "Save important information to long-term memory.",
+    "recall_memory": "Recall memories relevant to a query.",
+}
+
+QUERIES = [
+    ("build the project in ~/esp/blink", "idf_build"),
+    ("flash the firmware to the board on /dev/ttyUSB0", "idf_flash"),
+    ("show me the serial log output of the device", "idf_monitor"),
+    ("how much free DRAM does the firmware leave", "idf_size"),
+    ("switch the target chip to esp32s3", "idf_set_target"),
+    ("what is CONFIG_FREERTOS_HZ set to in sdkconfig", "idf_menuconfig_get"),
+    ("enable CONFIG_ESP_WIFI_ENABLED in sdkconfig", "idf_menuconfig_set"),
+    ("do a full clean of the build directory", "idf_clean"),
+    ("erase the whole flash of the chip", "idf_erase_flash"),
+    ("create a new project called sensor_node", "idf_create_project"),
+    ("print the partition table", "idf_partition_table"),
+    ("read main/app_main.c", "read_file"),
+    ("search the sources for esp_wifi_init", "grep"),
+    ("编译工程并烧录到开发板", "idf_build"),
+    ("固件占用了多少内存", "idf_size"),
+]
+
+
+def _catalog_tools() -> list:
+    def make(name: str, description: str) -> StructuredTool:
+        def run(path: str = ".") -> str:
+            return name
+
+        return StructuredTool.from_function(run, name=name, description=description)
+
+    return [make(name, description) for name, description in CATALOG.items()]
+
+
+async def _selected(middleware, request: ModelRequest) -> list[str]:
+    captured = []
+
+    async def handler(narrowed):
+        captured.extend(tool.name for tool in narrowed.tools)
+        return None
+
+    await middleware.awrap_model_call(request, handler)
+    return captured
+
+
+def _report(label: str, samples: list[float]) -> None:
+    print(
+        f"{label:<8} mean={statistics.mean(samples):8.2f} ms  "
+        f"p50={statistics.median(samples):8.2f} ms  max={max(samples):8.2f} ms"
+    )
+
+
+async def _run(live: bool) -> None:
+    from espagent.middlewares import LocalToolSelectorMiddleware
+    from espagent.models import llm
+
+    options = {"model": llm, "max_tools": 3, "always_include": ["save_memory", "recall_memory"]}
+    local = LocalToolSelectorMiddleware(**options)
+    remote = LLMToolSelectorMiddleware(**options)
+    tools = _catalog_tools()
+
+    local_ms, llm_ms, agreement = [], [], []
+    correct = fallbacks = 0
+    for query, expected in QUERIES:
+        request = ModelRequest(model=llm, messages=[HumanMessage(query)], tools=tools)
+        start = time.perf_counter()
+        selected = local.select(request)
+        local_ms.append((time.perf_counter() - start) * 1000)
+        if selected is None:
+            fallbacks += 1
+            names = []
+        else:
+            names = [tool.name for tool in selected.tools]
+            correct += expected in names
+
+        line = f"  {query[:44]:<46} local={names or 'LLM fallback'}"
+        if live:
+            start = time.perf_counter()
+            chosen = await _selected(remote, request)
+            llm_ms.append((time.perf_counter() - start) * 1000)
+            if names:
+                overlap = set(names) & set(chosen)
+                agreement.append(len(overlap) / len(set(names) | set(chosen)))
+            line += f" llm={chosen}"
+        print(line)
+
+    confident = len(QUERIES) - fallbacks
+    print(f"\nqueries={len(QUERIES)} local={confident} llm_fallback={fallbacks}")
+    print(f"expected tool selected locally: {correct}/{confident}")
+    _report("local", local_ms)
+    if live:
+        _report("llm", llm_ms)
+        if agreement:
+            print(f"agreement (Jaccard, local selections): {statistics.mean(agreement):.2f}")
+
+
+def main() -> None:
+    """Run the benchmark and print selection latency and quality."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--live", action="store_true", help="Also run the LLM tool selector")
+    args = parser.parse_args()
+    asyncio.run(_run(args.live))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 """CLI interface for espagent interactive console."""
 
+import argparse
 import asyncio
 import logging
 import os
@@ -7,10 +8,32 @@ import pwd
 import sys
 import warnings
 
-from espagent.agent import get_agent
-from espagent.middlewares import get_middleware
-from espagent.tools import get_mcp_tools, recall_memory, save_memory
+from espagent.agent import build_agent, init_database
+from espagent.middlewares import get_middleware, model_router, tool_selector
+from espagent.models import llm_cache
+from espagent.tools import recall_memory, save_memory, ssh_run, ssh_run_many
+from espagent.tools.jobs import get_job_tools
+from espagent.tools.mcp import discover_servers, mcp_sessions
+from espagent.tools.memory import consolidate_all, memory_cache, memory_writer
+from espagent.tools.ssh import ssh_pool
+from espagent.tools.tool_cache import tool_cache
 from espagent.utils import HumanInTheLoop, UserInfo
+from espagent.utils.approval import approval_policy
+from espagent.utils.checkpoint import (
+    CHECKPOINT_KEEP_LAST,
+    CHECKPOINT_MAX_AGE_DAYS,
+    CompactPostgresSaver,
+)
+from espagent.utils.db_pool import pool_monitor
+from espagent.utils.sessions import SessionManager
+from espagent.utils.startup import StartupProfile
+from espagent.utils.streaming import close_cancelled_turn, stream_turn, turn_stats
+from espagent.utils.terminal import (
+    InputInterruptedError,
+    TerminalInput,
+    TurnCancelledError,
+    interruptible,
+)
 
 warnings.filterwarnings(
     "ignore",
@@ -35,6 +58,17 @@ async def cleanup(pool=None) -> None:
     Note:
         This function never raises exceptions - all errors are logged and suppressed.
     """
+    try:
+        # Flush buffered memory writes while the database pool is still open
+        await memory_writer.aclose()
+    except BaseException as e:
+        logger.info(f"Memory flush: {type(e).__name__} (suppressed during shutdown)")
+
+    try:
+        await pool_monitor.aclose()
+    except BaseException as e:
+        logger.info(f"Pool monitor close: {type(e).__name__} (suppressed during shutdown)")
+
     if pool is not None:
         try:
             # Use timeout to avoid blocking indefinitely during shutdown
@@ -44,11 +78,174 @@ async def cleanup(pool=None) -> None:
             # We never want to raise from cleanup as it could mask the original exception
             logger.info(f"Pool close: {type(e).__name__} (suppressed during shutdown)")
 
+    try:
+        await mcp_sessions.aclose()
+    except BaseException as e:
+        logger.info(f"MCP sessions close: {type(e).__name__} (suppressed during shutdown)")
+
+    try:
+        # Tear down multiplexed SSH masters so no authenticated sessions linger
+        await asyncio.to_thread(ssh_pool.close_all)
+    except BaseException as e:
+        logger.info(f"SSH pool close: {type(e).__name__} (suppressed during shutdown)")
+
+    logger.info(f"Memory cache stats: {memory_cache.stats()}")
+    if pool_monitor.pool is not None:
+        logger.info(f"Database pool stats: {pool_monitor.stats()}")
+    logger.info(f"Tool result cache stats: {tool_cache.stats()}")
+    logger.info(f"Model router stats: {model_router.stats()}")
+    logger.info(f"Turn stats: {turn_stats.stats()}")
+    logger.info(f"Approval stats: {approval_policy.stats()}")
+    if hasattr(tool_selector, "stats"):
+        logger.info(f"Tool selector stats: {tool_selector.stats()}")
+    if llm_cache is not None:
+        logger.info(f"LLM cache stats: {llm_cache.stats()}")
     logger.info("CLI application cleaned up")
 
 
-async def cli_main() -> None:
-    """Main CLI entry point for the interactive agent console."""
+COMMANDS = {
+    "/help": "Show this help",
+    "/exit": "Quit the console",
+    "/consolidate": "Deduplicate, merge and evict stored memories of all users",
+    "/stats": "Show model routing and cache statistics",
+    "/pool": "Show database connection pool statistics",
+    "/prune": "Drop old checkpoints: /prune [keep_last] [max_age_days]",
+    "/new": "Start a new session",
+    "/sessions": "List past sessions",
+    "/resume": "Continue a past session: /resume <number|thread id>",
+    "/archive": "Move a session to cold storage: /archive [number|thread id]",
+    "/approvals": "Show approval rules and session approvals: /approvals [clear]",
+}
+
+
+async def handle_command(line: str, agent, sessions: SessionManager) -> bool:
+    """Run a console command (a line starting with "/").
+
+    Args:
+        line: The stripped input line
+        agent: The initialized agent
+        sessions: The user's sessions
+
+    Returns:
+        False if the console should exit, True otherwise
+    """
+    command, *args = line.split()
+
+    if command == "/exit":
+        return False
+
+    if command == "/consolidate":
+        await memory_writer.flush()
+        reports = await consolidate_all(agent.store)
+        for report in reports:
+            print(f"   🧹 {report}")
+        if not reports:
+            print("   No memories stored")
+
+    elif command == "/new":
+        await memory_writer.flush()
+        print(f"   🆕 Session {sessions.new().thread_id}")
+
+    elif command == "/sessions":
+        listed = await sessions.list()
+        for i, session in enumerate(listed, 1):
+            marker = "*" if session.thread_id == sessions.thread_id else " "
+            print(f"   {marker}{i:>3}. {session}")
+        if not listed:
+            print("   No sessions yet")
+
+    elif command == "/resume":
+        session = await sessions.resume(args[0]) if args else None
+        if session is None:
+            print("❌ Unknown session, see /sessions")
+        else:
+            print(f"   ⏯️  Resumed {session}")
+
+    elif command == "/archive":
+        session = await sessions.archive(args[0] if args else None)
+        if session is None:
+            print("❌ Nothing to archive, see /sessions")
+        else:
+            print(f"   🗄️  Archived {session.thread_id}, now in {sessions.thread_id}")
+
+    elif command == "/approvals":
+        if args[:1] == ["clear"]:
+            cleared = approval_policy.clear_grants(sessions.thread_id)
+            print(f"   🛡️  Cleared {cleared} session approvals")
+            return True
+        for rule in approval_policy.rules:
+            print(f"   📜 {rule}")
+        for grant in approval_policy.grants(sessions.thread_id):
+            print(f"   ✅ {grant} (this session)")
+        if not approval_policy.rules and not approval_policy.grants(sessions.thread_id):
+            print("   No approval rules or session approvals, every gated call is asked")
+
+    elif command == "/prune":
+        # Every langgraph saver has a (different) prune, only ours applies retention
+        if not isinstance(agent.checkpointer, CompactPostgresSaver):
+            print("❌ The configured persistence backend does not support /prune")
+            return True
+        try:
+            limits = [float(arg) for arg in args[:2]]
+        except ValueError:
+            print("❌ Usage: /prune [keep_last] [max_age_days]")
+            return True
+        defaults = [CHECKPOINT_KEEP_LAST, CHECKPOINT_MAX_AGE_DAYS]
+        keep_last, max_age_days = [*limits, *defaults[len(limits) :]]
+        report = await agent.checkpointer.apply_retention(int(keep_last), max_age_days)
+        print(f"   🗑️  {report}")
+
+    elif command == "/stats":
+        print(f"   ⏱️  Turns: {turn_stats.stats()}")
+        print(f"   🛡️  Approvals: {approval_policy.stats()}")
+        print(f"   🧭 Model router: {model_router.stats()}")
+        if hasattr(tool_selector, "stats"):
+            print(f"   🧰 Tool selector: {tool_selector.stats()}")
+        if llm_cache is not None:
+            print(f"   💾 LLM cache: {llm_cache.stats()}")
+        print(f"   📦 Tool result cache: {tool_cache.stats()}")
+        print(f"   🧠 Memory cache: {memory_cache.stats()}")
+
+    elif command == "/pool":
+        if pool_monitor.pool is None:
+            print("   The configured persistence backend has no connection pool")
+        else:
+            for name, value in pool_monitor.stats().items():
+                print(f"   🔗 {name:<18} {value}")
+
+    elif command == "/help":
+        for name, description in COMMANDS.items():
+            print(f"   {name:<14} {description}")
+
+    else:
+        print(f"❌ Unknown command {command}, type /help for a list")
+
+    return True
+
+
+async def run_turn(agent, hitl: HumanInTheLoop, line: str, thread_config: dict) -> None:
+    """Send one user message and handle the approvals it needs.
+
+    Args:
+        agent: The initialized agent
+        hitl: Approval handler
+        line: The user's message
+        thread_config: Thread configuration
+    """
+    payload = {"messages": [{"role": "user", "content": line}]}
+    result = await stream_turn(agent, payload, thread_config)
+    print(f"   ⏱️  {result}")
+    # Interrupts come from the stream, no state load needed to find them
+    await hitl.handle_interrupts(agent, result.interrupts, thread_config)
+
+
+async def cli_main(startup_profile: bool = False) -> None:
+    """Main CLI entry point for the interactive agent console.
+
+    Args:
+        startup_profile: Print how long each startup phase took
+    """
+    profile = StartupProfile()
     current_user = pwd.getpwuid(os.getuid()).pw_name
 
     userinfo = UserInfo(
@@ -58,58 +255,78 @@ async def cli_main() -> None:
 
     thread_config = {
         "configurable": {
-            "thread_id": current_user,
+            "thread_id": None,
             "user_id": current_user,
             "user_info": userinfo,
         },
     }
 
-    all_mcp_tools = await get_mcp_tools()
+    # Database setup and MCP discovery wait on the network, building the
+    # middleware (and importing deepagents) is CPU work, so all three overlap
+    database, discovery, middlewares = await asyncio.gather(
+        profile.timed("database", init_database()),
+        profile.timed("mcp discovery", discover_servers()),
+        profile.timed("middleware", asyncio.to_thread(get_middleware)),
+    )
+    for result in discovery:
+        print(f"   {'❌' if result.source == 'failed' else '🔌'} MCP {result}")
+    all_mcp_tools = [tool for result in discovery for tool in result.tools]
 
     # Unpack MCP tools list using spread operator to avoid nested list structure
-    tools = [save_memory, recall_memory, *all_mcp_tools]
-    middlewares = get_middleware()
-    agent, pool = await get_agent(tools=tools, middlewares=middlewares)
-    hitl = HumanInTheLoop()
+    tools = [
+        save_memory,
+        recall_memory,
+        ssh_run,
+        ssh_run_many,
+        *get_job_tools(),
+        *all_mcp_tools,
+    ]
+    with profile.phase("agent"):
+        agent = build_agent(tools=tools, middlewares=middlewares, database=database)
+    pool = database.pool
+    logger.info(f"Startup took {profile.total:.2f}s")
+    if startup_profile:
+        print(profile.report())
+    # Share cached tool results through the database
+    tool_cache.attach(agent.store)
+    # A new thread per launch; earlier conversations only carry over through
+    # long-term memory unless resumed explicitly
+    sessions = SessionManager(agent.store, agent.checkpointer, current_user)
+    print(f"   🆕 Session {sessions.thread_id} (/sessions, /resume to continue an earlier one)")
+    # Input is awaited, so pool checks and MCP keepalives run while the user types
+    terminal = TerminalInput()
+    hitl = HumanInTheLoop(terminal, approval_policy)
 
     try:
         while True:
             try:
-                print("User > ", end="", flush=True)
-                line = sys.stdin.readline()
-
-                # EOF reached (stdin closed)
+                line = (await terminal.prompt("User > ", history=True)).strip()
                 if not line:
-                    break
+                    continue
 
-                line = line.strip()
-                if not line:
+                if line.startswith("/"):
+                    if not await handle_command(line, agent, sessions):
+                        break
                     continue
 
-                payload = {"messages": [{"role": "user", "content": line}]}
-                async for chunk in agent.astream(
-                    payload,
-                    config=thread_config,
-                    stream_mode="values",
-                ):
-                    last_msg = chunk["messages"][-1]
-                    if last_msg.type == "ai" and last_msg.content:
-                        print(f"🤖 Agent: {last_msg.content}", end="", flush=True)
-                    elif last_msg.type == "tool" and last_msg.content:
-                        print(f"🤖 Tool: {last_msg.content}", end="", flush=True)
-                    if hasattr(last_msg, "tool_calls") and last_msg.tool_calls:
-                        for tool_call in last_msg.tool_calls:
-                            print(f"   🔧 [Calling tool]: {tool_call['name']}")
-
-                snapshot = await agent.aget_state(config=thread_config)
-                await hitl.handle_interrupt(agent, snapshot, thread_config)
+                thread_config["configurable"]["thread_id"] = sessions.thread_id
+                await sessions.record_turn(line)
+                try:
+                    # Ctrl+C cancels the turn, not the console
+                    await interruptible(run_turn(agent, hitl, line, thread_config))
+                except TurnCancelledError:
+                    print("\n   ⛔ Turn cancelled")
+                    await close_cancelled_turn(agent, thread_config)
+                # Persist the memories saved during this turn in one batch
+                await memory_writer.flush()
                 sys.stdout.write("\n")
             # except asyncio.CancelledError:
             #     print("\nbye")
             #     break
-            except KeyboardInterrupt:
+            except (KeyboardInterrupt, InputInterruptedError):
                 break
 
+            # EOF reached (stdin closed)
             except EOFError:
                 break
     finally:
@@ -118,10 +335,24 @@ async def cli_main() -> None:
         await cleanup(pool)
 
 
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parse the console's command line options."""
+    parser = argparse.ArgumentParser(prog="espagent", description="ESP-IDF agent console")
+    parser.add_argument(
+        "--startup-profile",
+        action="store_true",
+        help="print a per-phase timing breakdown of the startup",
+    )
+    return parser.parse_args(argv)
+
+
 def main() -> None:
     """Entry point for espagent console command."""
     import os
 
+    args = parse_args()
+    # Tool cache globs refer to the user's project, i.e. where the console was started
+    tool_cache.project_dir = tool_cache.project_dir or os.getcwd()
     # Change to project directory (this file's directory)
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
-    asyncio.run(cli_main())
+    asyncio.run(cli_main(startup_profile=args.startup_profile))
@@ -1,53 +1,323 @@
 """Middleware configurations for the espagent."""
 
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import Counter
 from collections.abc import Callable
+from dataclasses import dataclass
 from pathlib import Path
 
-from deepagents import FilesystemMiddleware
-from deepagents.backends import FilesystemBackend
 from langchain.agents.middleware import (
+    AgentMiddleware,
     HumanInTheLoopMiddleware,
     LLMToolSelectorMiddleware,
     ModelRequest,
     ModelResponse,
     SummarizationMiddleware,
     ToolRetryMiddleware,
-    wrap_model_call,
 )
+from langchain_core.messages import AnyMessage
+from langgraph.prebuilt.tool_node import ToolCallRequest
 
-from espagent.models import large_model, llm
+from espagent.models import large_model, llm, small_model
+from espagent.utils.approval import approval_policy
+from espagent.utils.embeddings import get_embeddings
+from espagent.utils.tokens import TokenLedger, token_ledger
+from espagent.utils.tool_index import ToolIndex
 
+logger = logging.getLogger(__name__)
 
-@wrap_model_call
-async def dynamic_model_router(
-    request: ModelRequest, handler: Callable[[ModelRequest], ModelResponse]
-) -> ModelResponse:
-    """根据对话上下文动态切换模型.
+ROUTER_SMALL_MAX_TOKENS = int(os.getenv("ESPAGENT_ROUTER_SMALL_MAX_TOKENS", "6000"))
+ROUTER_MAX_TOOL_DEPTH = int(os.getenv("ESPAGENT_ROUTER_MAX_TOOL_DEPTH", "4"))
+
+# 需要人工审批的工具
+INTERRUPT_ON = {
+    "write_file": {
+        "allowed_decisions": ["approve", "edit", "reject"],
+        "description": "需要人工批准才能写入文件",
+    },
+    "read_file": {
+        "allowed_decisions": ["approve", "edit", "reject"],
+        "description": "需要人工批准才能读取文件",
+    },
+    "ssh_run": {
+        "allowed_decisions": ["approve", "edit", "reject"],
+        "description": "需要人工批准才能执行SSH命令",
+    },
+    "ssh_run_many": {
+        "allowed_decisions": ["approve", "edit", "reject"],
+        "description": "需要人工批准才能在多台主机上执行SSH命令",
+    },
+    "ssh_job_start": {
+        "allowed_decisions": ["approve", "edit", "reject"],
+        "description": "需要人工批准才能启动后台SSH任务",
+    },
+    "ssh_job_cancel": {
+        "allowed_decisions": ["approve", "reject"],
+        "description": "需要人工批准才能取消后台SSH任务",
+    },
+}
+
+TOOL_CONCURRENCY = int(os.getenv("ESPAGENT_TOOL_CONCURRENCY", "8"))
+
+TOOL_SELECTOR = os.getenv("ESPAGENT_TOOL_SELECTOR", "local")  # "local" or "llm"
+TOOL_SELECTOR_MIN_SCORE = float(os.getenv("ESPAGENT_TOOL_SELECTOR_MIN_SCORE", "1.5"))
+TOOL_SELECTOR_EMBEDDINGS = os.getenv("ESPAGENT_TOOL_SELECTOR_EMBEDDINGS", "0") == "1"
+
+
+@dataclass
+class RoutingPolicy:
+    """何时从小模型升级到大模型.
+
+    Attributes:
+        small_max_tokens: Context size (tokens) the small model handles
+        max_tool_depth: Tool-calling steps in the current turn before escalating
+        escalate_on_tool_error: Escalate when the latest tool result is an error
+        keywords: Phrases in the user's message that always need the large model
+    """
+
+    small_max_tokens: int = ROUTER_SMALL_MAX_TOKENS
+    max_tool_depth: int = ROUTER_MAX_TOOL_DEPTH
+    escalate_on_tool_error: bool = True
+    keywords: tuple[str, ...] = ("复杂分析",)
+
+
+def _tool_depth(messages: list[AnyMessage]) -> int:
+    """Number of tool-calling AI steps since the last user message."""
+    depth = 0
+    for message in reversed(messages):
+        if message.type == "human":
+            break
+        if message.type == "ai" and getattr(message, "tool_calls", None):
+            depth += 1
+    return depth
+
+
+class TokenBudgetRouter(AgentMiddleware):
+    """根据上下文 token 数和工具调用深度选择模型.
+
+    Cheap turns go to ``small`` and only escalate to ``large`` when the
+    policy says so. Context size comes from the shared token ledger, so each
+    call only counts the messages added since the previous one.
 
     Args:
-        request: The model request containing state and context.
-        handler: The next handler in the middleware chain.
+        small: Model for ordinary turns
+        large: Model for long contexts and deep tool chains
+        policy: Escalation policy
+        ledger: Per-message token counts (default: the shared ``token_ledger``)
+    """
 
-    Returns:
-        The model response after potential model switching.
+    def __init__(
+        self,
+        small=small_model,
+        large=large_model,
+        policy: RoutingPolicy | None = None,
+        ledger: TokenLedger | None = None,
+    ):
+        super().__init__()
+        self.small = small
+        self.large = large
+        self.policy = policy or RoutingPolicy()
+        self.ledger = ledger or token_ledger
+        self._calls: Counter = Counter()
+        self._seconds: Counter = Counter()
+        self._tokens: Counter = Counter()
+        self._reasons: Counter = Counter()
+
+    def route(self, messages: list[AnyMessage]) -> tuple[str, str, int]:
+        """Decide which model handles the next call.
+
+        Returns:
+            A tuple of ("small" | "large", reason, context tokens)
+        """
+        policy = self.policy
+        tokens = self.ledger.count(messages)
+        if tokens > policy.small_max_tokens:
+            return "large", "context", tokens
+        if _tool_depth(messages) >= policy.max_tool_depth:
+            return "large", "tool_depth", tokens
+        last = messages[-1] if messages else None
+        if policy.escalate_on_tool_error and last is not None and last.type == "tool":
+            if getattr(last, "status", None) == "error":
+                return "large", "tool_error", tokens
+        user = next((m for m in reversed(messages) if m.type == "human"), None)
+        if user is not None and any(k in user.text for k in policy.keywords):
+            return "large", "keyword", tokens
+        return "small", "default", tokens
+
+    async def awrap_model_call(
+        self, request: ModelRequest, handler: Callable[[ModelRequest], ModelResponse]
+    ) -> ModelResponse:
+        """Route the request, then record the decision and its latency."""
+        tier, reason, tokens = self.route(request.messages)
+        model = self.small if tier == "small" else self.large
+        logger.debug(f"Model router: {tier} ({reason}, ~{tokens} tokens)")
+
+        start = time.perf_counter()
+        try:
+            return await handler(request.override(model=model))
+        finally:
+            self._calls[tier] += 1
+            self._seconds[tier] += time.perf_counter() - start
+            self._tokens[tier] += tokens
+            self._reasons[reason] += 1
+
+    def stats(self) -> dict:
+        """Calls, input tokens and mean latency per model, plus escalation reasons."""
+        calls = sum(self._calls.values())
+        return {
+            "calls": calls,
+            "small_share": round(self._calls["small"] / calls, 3) if calls else 0.0,
+            "models": {
+                tier: {
+                    "calls": self._calls[tier],
+                    "input_tokens": self._tokens[tier],
+                    "mean_seconds": round(self._seconds[tier] / self._calls[tier], 3),
+                }
+                for tier in ("small", "large")
+                if self._calls[tier]
+            },
+            "reasons": dict(self._reasons),
+        }
+
+
+model_router = TokenBudgetRouter()
+
+
+class ToolConcurrencyMiddleware(AgentMiddleware):
+    """限制并发执行的工具调用数.
+
+    Tool calls of one model step run as parallel tasks. This bounds them to
+    ``limit`` at a time and runs the ``serialized`` tools (those with side
+    effects, gated by human approval) one after another, in the order their
+    calls start. A serialized call queues for its turn before it takes a
+    slot, so waiting ones never hold slots read-only calls could use.
+    Results keep the order of the model's tool calls.
+
+    Args:
+        limit: Maximum number of tool calls running at once
+        serialized: Names of tools that must never overlap
     """
-    state = request.state
-    messages = state.get("messages", [])
 
-    # 场景 A: 如果对话轮数超过 5 轮，切换到大模型处理复杂上下文
-    if len(messages) > 5:
-        print(f"--- [Middleware] 检测到长对话 ({len(messages)} msgs)，切换 ---")
-        request = request.override(model=large_model)
+    def __init__(self, limit: int = TOOL_CONCURRENCY, serialized: set[str] | None = None):
+        super().__init__()
+        self.limit = limit
+        self.serialized = serialized or set()
+        self._slots = asyncio.Semaphore(limit)
+        self._exclusive = asyncio.Lock()
+        self._thread_slots = threading.BoundedSemaphore(limit)
+        self._thread_exclusive = threading.Lock()
+
+    async def awrap_tool_call(self, request: ToolCallRequest, handler):
+        """Run the tool call within the concurrency limits."""
+        if request.tool_call["name"] not in self.serialized:
+            async with self._slots:
+                return await handler(request)
+        async with self._exclusive, self._slots:
+            return await handler(request)
+
+    def wrap_tool_call(self, request: ToolCallRequest, handler):
+        """Run the tool call within the concurrency limits (sync agents)."""
+        if request.tool_call["name"] not in self.serialized:
+            with self._thread_slots:
+                return handler(request)
+        with self._thread_exclusive, self._thread_slots:
+            return handler(request)
+
+
+class LocalToolSelectorMiddleware(LLMToolSelectorMiddleware):
+    """本地工具选择，置信度低时才调用 LLM.
+
+    Tools are ranked against the last user message with a BM25 index over
+    tool names, descriptions and arguments (plus local embeddings when
+    enabled), built once per tool set. The extra LLM round-trip of
+    ``LLMToolSelectorMiddleware`` only happens when the best tool scores
+    below ``min_score``.
+
+    Args:
+        min_score: Lowest top score accepted without asking the LLM
+        embeddings: Optional local embedding model blended into the ranking
+        **kwargs: Passed to ``LLMToolSelectorMiddleware`` (model, max_tools,
+            always_include, system_prompt)
+    """
+
+    def __init__(
+        self, *, min_score: float = TOOL_SELECTOR_MIN_SCORE, embeddings=None, **kwargs
+    ) -> None:
+        super().__init__(**kwargs)
+        self.min_score = min_score
+        self.embeddings = embeddings
+        self._indexes: dict[tuple[str, ...], ToolIndex] = {}
+        self._selections: Counter = Counter()
+
+    def _index(self, tools: list) -> ToolIndex:
+        key = tuple(tool.name for tool in tools)
+        index = self._indexes.get(key)
+        if index is None:
+            index = self._indexes[key] = ToolIndex(tools, self.embeddings)
+        return index
+
+    def select(self, request: ModelRequest) -> ModelRequest | None:
+        """Narrow the request's tools locally.
+
+        Returns:
+            The request with the selected tools, or None if the ranking is
+            not confident enough and the LLM should decide
+        """
+        selection = self._prepare_selection_request(request)
+        if selection is None:
+            return request
+        ranked = self._index(selection.available_tools).rank(selection.last_user_message.text)
+        if not ranked or ranked[0][1] < self.min_score:
+            self._selections["llm_fallback"] += 1
+            logger.debug(f"Tool selector: low confidence {ranked[:3]}, asking the LLM")
+            return None
 
-    # 场景 B: 如果用户输入包含特定关键词 (仅作演示，实际可用分类器)
-    elif messages and "复杂分析" in messages[-1].content:
-        print("--- [Middleware] 检测到复杂任务，切换 ---")
-        request = request.override(model=large_model)
+        self._selections["local"] += 1
+        names = [name for name, _ in ranked[: self.max_tools]]
+        logger.debug(f"Tool selector: {names}")
+        return self._process_selection_response(
+            {"tools": names}, selection.available_tools, selection.valid_tool_names, request
+        )
 
-    else:
-        print("--- [Middleware] 使用默认小模型 ---")
+    def wrap_model_call(self, request: ModelRequest, handler):
+        """Select tools locally, falling back to the LLM selector."""
+        selected = self.select(request)
+        if selected is None:
+            return super().wrap_model_call(request, handler)
+        return handler(selected)
 
-    return await handler(request)
+    async def awrap_model_call(self, request: ModelRequest, handler):
+        """Select tools locally, falling back to the LLM selector."""
+        selected = self.select(request)
+        if selected is None:
+            return await super().awrap_model_call(request, handler)
+        return await handler(selected)
+
+    def stats(self) -> dict:
+        """Number of local selections and LLM fallbacks."""
+        return dict(self._selections)
+
+
+def _tool_selector() -> LLMToolSelectorMiddleware:
+    """创建 ESPAGENT_TOOL_SELECTOR 选择的工具选择中间件."""
+    options = {
+        "model": llm,
+        "max_tools": 3,  # 最多选择3个工具
+        "always_include": ["save_memory", "recall_memory"],  # 始终包含记忆工具
+        "system_prompt": "分析用户查询，选择最相关的工具。优先选择直接相关的工具。",
+    }
+    if TOOL_SELECTOR == "llm":
+        return LLMToolSelectorMiddleware(**options)
+    # 本地 BM25 排序，低置信度时回退到 LLM 选择
+    embeddings = get_embeddings()[0] if TOOL_SELECTOR_EMBEDDINGS else None
+    return LocalToolSelectorMiddleware(embeddings=embeddings, **options)
+
+
+tool_selector = _tool_selector()
 
 
 def get_middleware() -> list:
@@ -56,26 +326,22 @@ def get_middleware() -> list:
     Returns:
         List of middleware instances.
     """
+    # deepagents 依赖较重（含 anthropic SDK），延迟到这里导入，CLI 在线程中与数据库初始化并行执行
+    from deepagents import FilesystemMiddleware
+    from deepagents.backends import FilesystemBackend
+
+    # 审批策略的允许规则命中时不中断；拒绝规则和会话内批准由 HumanInTheLoop 自动应答
     hitl_middleware = HumanInTheLoopMiddleware(
-        interrupt_on={
-            "write_file": {
-                "allowed_decisions": ["approve", "edit", "reject"],
-                "description": "需要人工批准才能写入文件",
-            },
-            "read_file": {
-                "allowed_decisions": ["approve", "edit", "reject"],
-                "description": "需要人工批准才能读取文件",
-            },
-            "ssh_run": {
-                "allowed_decisions": ["approve", "edit", "reject"],
-                "description": "需要人工批准才能执行SSH命令",
-            },
-        },
+        interrupt_on=approval_policy.interrupt_on(INTERRUPT_ON)
     )
 
+    # 只读工具并发执行，需要审批的工具逐个执行
+    concurrency_middleware = ToolConcurrencyMiddleware(serialized=set(INTERRUPT_ON))
+
     summarization_middleware = SummarizationMiddleware(
         model=llm,
         trigger=("tokens", 10000),  # 历史消息 token 数量超过 10000 时触发压缩
+        token_counter=token_ledger,  # 按消息 ID 缓存 token 数，只统计新增消息
         keep=("messages", 20),  # 保留最近 20 条消息
         summary_prompt="请将以下对话历史进行摘要，保留关键决策点和技术细节：\n\n{messages}\n\n摘要:",
     )
@@ -89,13 +355,6 @@ def get_middleware() -> list:
         jitter=True,
     )
 
-    tool_selector_middleware = LLMToolSelectorMiddleware(
-        model=llm,
-        max_tools=3,  # 最多选择3个工具
-        always_include=["save_memory", "recall_memory"],  # 始终包含记忆工具
-        system_prompt="分析用户查询，选择最相关的工具。优先选择直接相关的工具。",
-    )
-
     filesystem_middleware = FilesystemMiddleware(
         backend=FilesystemBackend(
             root_dir=Path.cwd(),
@@ -104,10 +363,11 @@ def get_middleware() -> list:
     )
 
     middlewares = [
-        dynamic_model_router,
+        model_router,
         summarization_middleware,
         filesystem_middleware,
-        tool_selector_middleware,
+        tool_selector,
+        concurrency_middleware,
         retry_middleware,
         hitl_middleware,
     ]
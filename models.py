@@ -2,16 +2,23 @@
 
 from langchain_openai import ChatOpenAI
 
+from espagent.utils.llm_cache import get_llm_cache
+
+# Opt-in response cache (ESPAGENT_LLM_CACHE); safe because all models run at temperature 0
+llm_cache = get_llm_cache()
+
 llm = ChatOpenAI(
     base_url="https://open.bigmodel.cn/api/coding/paas/v4",
     model="glm-4.6",
     temperature=0,
+    cache=llm_cache,
 )
 
 small_model = ChatOpenAI(
     base_url="https://open.bigmodel.cn/api/coding/paas/v4",
     model="glm-4.5",
     temperature=0,
+    cache=llm_cache,
 )
 
 large_model = llm
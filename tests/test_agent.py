@@ -0,0 +1,97 @@
+"""Tests for espagent.agent module - database startup."""
+
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+
+from espagent import agent
+
+
+class TestInitDatabase:
+    """Test migrations only run when the recorded schema version changed."""
+
+    async def _init(self, stored: dict):
+        record = AsyncMock()
+        with (
+            patch.object(agent, "open_pool", AsyncMock()),
+            patch.object(agent, "_memory_index_config", AsyncMock(return_value=None)),
+            patch.object(agent, "_stored_schema", AsyncMock(return_value=stored)),
+            patch.object(agent, "_record_schema", record),
+            patch.object(agent.CompactPostgresSaver, "setup", AsyncMock()) as saver_setup,
+            patch.object(agent.AsyncPostgresStore, "setup", AsyncMock()) as store_setup,
+        ):
+            await agent.init_database()
+        return saver_setup, store_setup, record
+
+    @pytest.mark.asyncio
+    async def test_fresh_database_runs_setup_and_records_versions(self):
+        saver_setup, store_setup, record = await self._init({})
+
+        saver_setup.assert_awaited_once()
+        store_setup.assert_awaited_once()
+        assert set(record.await_args.args[1]) == {"checkpointer", "store"}
+
+    @pytest.mark.asyncio
+    async def test_matching_versions_skip_setup(self):
+        _, _, record = await self._init({})
+        recorded = record.await_args.args[1]
+
+        saver_setup, store_setup, record = await self._init(recorded)
+
+        saver_setup.assert_not_awaited()
+        store_setup.assert_not_awaited()
+        record.assert_not_awaited()
+
+
+class _ScriptedModel(GenericFakeChatModel):
+    """Fake chat model that accepts tools, for running a real agent loop."""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+class TestEmbeddedPersistence:
+    """Test the agent and the memory tools run on the embedded backends."""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("backend", ["memory", "sqlite"])
+    async def test_memories_and_checkpoints_round_trip(self, backend, tmp_path):
+        if backend == "sqlite":
+            pytest.importorskip("langgraph.checkpoint.sqlite")
+        from langchain.agents import create_agent
+
+        from espagent.tools import recall_memory, save_memory
+        from espagent.tools.memory import memory_writer
+        from espagent.utils import TaskState, UserInfo
+
+        calls = [
+            ("save_memory", {"info": "the board is an ESP32-S3 on /dev/ttyUSB0"}),
+            ("recall_memory", {"query": "which board"}),
+        ]
+        script = []
+        for i, (name, args) in enumerate(calls):
+            script += [AIMessage("", tool_calls=[{"name": name, "args": args, "id": f"c{i}"}])]
+            script += [AIMessage("ok")]
+
+        with patch.object(agent, "SQLITE_PATH", tmp_path / "espagent.sqlite"):
+            database = await agent.init_database(backend)
+        runner = create_agent(
+            model=_ScriptedModel(messages=iter(script)),
+            tools=[save_memory, recall_memory],
+            state_schema=TaskState,
+            store=database.store,
+            checkpointer=database.checkpointer,
+        )
+        config = {"configurable": {"thread_id": "t"}}
+        user = {"user_id": "esp", "user_info": UserInfo(user_name="esp", additional_info="")}
+
+        await runner.ainvoke({"messages": [HumanMessage("remember my board")], **user}, config)
+        await memory_writer.flush()
+        result = await runner.ainvoke({"messages": [HumanMessage("which board?")]}, config)
+
+        assert "ESP32-S3" in result["messages"][-2].content
+        assert len((await runner.aget_state(config)).values["messages"]) == 8
+        if database.pool is not None:
+            await database.pool.close(timeout=5.0)
@@ -1,7 +1,7 @@
 """Tests for espagent.cli cleanup - validates exception suppression."""
 
 import asyncio
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
@@ -77,3 +77,171 @@ class TestCleanup:
 
         # Should suppress KeyboardInterrupt
         await cleanup(mock_pool)
+
+    @pytest.mark.asyncio
+    async def test_cleanup_flushes_memories_before_closing_pool(self):
+        """Test buffered memory writes are persisted on shutdown.
+
+        The write-behind queue needs the database, so it must be
+        flushed before the pool is closed or the memories are lost.
+        """
+        order = []
+        mock_pool = AsyncMock()
+        mock_pool.close = AsyncMock(side_effect=lambda **_: order.append("pool"))
+        writer = MagicMock(aclose=AsyncMock(side_effect=lambda: order.append("memory")))
+
+        with patch("espagent.cli.memory_writer", writer):
+            await cleanup(mock_pool)
+
+        assert order == ["memory", "pool"]
+
+
+class TestStartup:
+    """Test the startup options and timing breakdown."""
+
+    def test_startup_profile_flag(self):
+        from espagent.cli import parse_args
+
+        assert parse_args(["--startup-profile"]).startup_profile
+        assert not parse_args([]).startup_profile
+
+    @pytest.mark.asyncio
+    async def test_concurrent_phases_are_reported_with_their_overlap(self):
+        from espagent.utils.startup import StartupProfile
+
+        profile = StartupProfile()
+        await asyncio.gather(
+            profile.timed("database", asyncio.sleep(0.1)),
+            profile.timed("mcp discovery", asyncio.sleep(0.1)),
+        )
+
+        assert 0.1 <= profile.total < 0.18
+        report = profile.report()
+        assert "database" in report and "mcp discovery" in report
+
+
+class TestTerminalInput:
+    """Test console input never blocks the event loop and Ctrl+C only cancels the turn."""
+
+    @pytest.fixture
+    def stdin(self):
+        import os
+
+        read_fd, write_fd = os.pipe()
+        with open(read_fd) as reader, open(write_fd, "w") as writer:
+            with patch("sys.stdin", reader):
+                yield writer
+
+    @pytest.mark.asyncio
+    async def test_loop_keeps_running_while_waiting_for_a_line(self, stdin, capsys):
+        from espagent.utils.terminal import TerminalInput
+
+        terminal = TerminalInput(history_file=None)
+        ticks = 0
+
+        async def background():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        async def type_line():
+            await asyncio.sleep(0.1)
+            stdin.write("  hello\n")
+            stdin.flush()
+
+        ticker = asyncio.create_task(background())
+        typing = asyncio.create_task(type_line())
+        assert await terminal.prompt("User > ") == "  hello"
+        ticker.cancel()
+        await typing
+
+        assert ticks >= 5
+        assert capsys.readouterr().out == "User > "
+
+        stdin.close()
+        with pytest.raises(EOFError):
+            await terminal.prompt("User > ")
+
+    @pytest.mark.asyncio
+    async def test_ctrl_c_at_prompt_keeps_the_next_line(self, stdin):
+        import os
+        import signal
+
+        from espagent.utils.terminal import InputInterruptedError, TerminalInput
+
+        terminal = TerminalInput(history_file=None)
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, os.kill, os.getpid(), signal.SIGINT)
+
+        with pytest.raises(InputInterruptedError):
+            await terminal.prompt("> ")
+
+        stdin.write("y\n")
+        stdin.flush()
+        assert await terminal.prompt("> ") == "y"
+
+    @pytest.mark.asyncio
+    async def test_ctrl_c_cancels_only_the_running_turn(self):
+        import os
+        import signal
+
+        from espagent.utils.terminal import TurnCancelledError, interruptible
+
+        previous = signal.getsignal(signal.SIGINT)
+        cancelled = asyncio.Event()
+
+        async def turn():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        asyncio.get_running_loop().call_later(0.05, os.kill, os.getpid(), signal.SIGINT)
+        with pytest.raises(TurnCancelledError):
+            await interruptible(turn())
+
+        assert cancelled.is_set()
+        assert signal.getsignal(signal.SIGINT) is previous
+        assert await interruptible(asyncio.sleep(0, result="next turn")) == "next turn"
+
+
+class TestConsoleTools:
+    """Test the tools the console gives the agent."""
+
+    @pytest.mark.asyncio
+    async def test_gated_remote_tools_are_registered(self):
+        from espagent import cli
+        from espagent.middlewares import INTERRUPT_ON
+
+        build_agent = MagicMock()
+        with (
+            patch.object(cli, "init_database", AsyncMock(return_value=MagicMock(pool=None))),
+            patch.object(cli, "discover_servers", AsyncMock(return_value=[])),
+            patch.object(cli, "get_middleware", MagicMock(return_value=[])),
+            patch.object(cli, "build_agent", build_agent),
+            patch.object(cli.TerminalInput, "prompt", AsyncMock(side_effect=EOFError)),
+            patch.object(cli, "cleanup", AsyncMock()),
+        ):
+            await cli.cli_main()
+
+        names = {tool.name for tool in build_agent.call_args.kwargs["tools"]}
+        assert {"ssh_job_start", "ssh_job_status", "ssh_job_output", "ssh_job_cancel"} <= names
+        # Every gated tool is available, the filesystem ones come from middleware
+        assert set(INTERRUPT_ON) - {"read_file", "write_file"} <= names
+
+
+class TestCommands:
+    """Test console commands."""
+
+    @pytest.mark.asyncio
+    async def test_prune_is_unsupported_without_postgres(self, capsys):
+        from langgraph.checkpoint.memory import InMemorySaver
+
+        from espagent import cli
+
+        agent = MagicMock(checkpointer=InMemorySaver())
+
+        assert await cli.handle_command("/prune 10", agent, MagicMock())
+        assert "does not support /prune" in capsys.readouterr().out
@@ -0,0 +1,227 @@
+"""Tests for espagent.middlewares module - meaningful validation only."""
+
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from langchain.agents.middleware import LLMToolSelectorMiddleware, ModelRequest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.tools import StructuredTool
+
+from espagent.middlewares import LocalToolSelectorMiddleware, RoutingPolicy, TokenBudgetRouter
+from espagent.utils.tokens import TokenLedger
+
+
+def _tool_step(i: int, status: str = "success") -> list:
+    call_id = f"call_{i}"
+    return [
+        AIMessage("", id=f"ai_{i}", tool_calls=[{"name": "idf_size", "args": {}, "id": call_id}]),
+        ToolMessage("ok", id=f"tool_{i}", tool_call_id=call_id, status=status),
+    ]
+
+
+class TestTokenBudgetRouter:
+    """Test routing sends cheap turns to the small model and escalates only when needed."""
+
+    def _router(self, ledger=None, **policy):
+        return TokenBudgetRouter(
+            small="small", large="large", policy=RoutingPolicy(**policy), ledger=ledger
+        )
+
+    def test_short_turn_uses_small_model(self):
+        """Test a long but cheap conversation no longer escalates by message count."""
+        history = []
+        for i in range(10):
+            history += [HumanMessage("查看芯片型号", id=f"h{i}"), AIMessage("ESP32", id=f"a{i}")]
+
+        assert self._router().route(history)[:2] == ("small", "default")
+
+    def test_escalation_reasons(self):
+        router = self._router(small_max_tokens=500, max_tool_depth=3)
+        question = HumanMessage("flash the board", id="q")
+
+        long_context = [HumanMessage("x " * 2000, id="big")]
+        deep_chain = [question, *_tool_step(1), *_tool_step(2), *_tool_step(3)]
+        failed_tool = [question, *_tool_step(1, status="error")]
+        keyword = [HumanMessage("请做复杂分析", id="k")]
+
+        assert router.route(long_context)[1] == "context"
+        assert router.route(deep_chain)[1] == "tool_depth"
+        assert router.route(failed_tool)[1] == "tool_error"
+        assert router.route(keyword)[1] == "keyword"
+
+    def test_token_counts_are_cached_per_message(self):
+        """Test each message is counted once, so routing cost does not grow per call."""
+        counter = MagicMock(return_value=3)
+        router = self._router(ledger=TokenLedger(counter))
+        history = [HumanMessage(f"message {i}", id=f"m{i}") for i in range(50)]
+
+        router.route(history)
+        router.route([*history, HumanMessage("one more", id="new")])
+
+        assert counter.call_count == 51
+
+    @pytest.mark.asyncio
+    async def test_model_call_is_overridden_and_recorded(self):
+        router = self._router()
+        request = MagicMock(messages=[HumanMessage("hi", id="h")])
+        handler = AsyncMock(return_value="response")
+
+        assert await router.awrap_model_call(request, handler) == "response"
+
+        request.override.assert_called_once_with(model="small")
+        stats = router.stats()
+        assert stats["calls"] == 1
+        assert stats["small_share"] == 1.0
+        assert stats["reasons"] == {"default": 1}
+
+
+def _catalog(**descriptions) -> list:
+    def make(name, description):
+        return StructuredTool.from_function(lambda: name, name=name, description=description)
+
+    return [make(name, description) for name, description in descriptions.items()]
+
+
+class TestLocalToolSelector:
+    """Test tools are selected without an extra LLM round-trip when the ranking is clear."""
+
+    TOOLS = _catalog(
+        idf_build="Build the ESP-IDF project with idf.py build.",
+        idf_flash="Flash the built firmware to a connected ESP32 board.",
+        idf_size="Report firmware image size and free IRAM/DRAM.",
+        read_file="Read the contents of a file.",
+        save_memory="Save important information to long-term memory.",
+        recall_memory="Recall memories relevant to a query.",
+    )
+
+    def _selector(self):
+        # Without a selector model the LLM fallback uses the request's model
+        return LocalToolSelectorMiddleware(
+            max_tools=1, always_include=["save_memory", "recall_memory"]
+        )
+
+    def _request(self, text, model=None):
+        return ModelRequest(
+            model=model or MagicMock(), messages=[HumanMessage(text)], tools=self.TOOLS
+        )
+
+    @pytest.mark.asyncio
+    async def test_confident_ranking_skips_llm(self):
+        model = MagicMock()
+        selector = self._selector()
+        handler = AsyncMock()
+
+        request = self._request("flash the firmware to the board", model)
+        await selector.awrap_model_call(request, handler)
+
+        selected = handler.await_args.args[0].tools
+        assert [tool.name for tool in selected] == ["idf_flash", "save_memory", "recall_memory"]
+        model.with_structured_output.assert_not_called()
+        assert selector.stats() == {"local": 1}
+
+    @pytest.mark.asyncio
+    async def test_low_confidence_falls_back_to_llm_selector(self):
+        """Test queries that match no tool vocabulary are left to the LLM."""
+        selector = self._selector()
+        fallback = AsyncMock(return_value="llm selection")
+
+        with patch.object(LLMToolSelectorMiddleware, "awrap_model_call", fallback):
+            result = await selector.awrap_model_call(
+                self._request("固件占用了多少内存"), AsyncMock()
+            )
+
+        assert result == "llm selection"
+        assert selector.stats() == {"llm_fallback": 1}
+
+
+class _ScriptedModel(GenericFakeChatModel):
+    """Fake chat model that accepts tools, for running a real agent loop."""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+class TestToolConcurrency:
+    """Test tool calls of one step run concurrently, except approval-gated ones."""
+
+    @staticmethod
+    def _agent(tools, concurrency):
+        from langchain.agents import create_agent
+
+        calls = [
+            {"name": tool.name, "args": {"n": i}, "id": f"c{i}"} for i, tool in enumerate(tools)
+        ]
+        model = _ScriptedModel(messages=iter([AIMessage("", tool_calls=calls), AIMessage("done")]))
+        return create_agent(model=model, tools=[tools[0]], middleware=[concurrency])
+
+    @staticmethod
+    def _probe(name, active, peaks):
+        async def run(n: int) -> str:
+            active[name] += 1
+            peaks[name] = max(peaks[name], active[name])
+            await asyncio.sleep(0.1)
+            active[name] -= 1
+            return f"{name} {n}"
+
+        return StructuredTool.from_function(coroutine=run, name=name, description=name)
+
+    @pytest.mark.asyncio
+    async def test_read_only_calls_overlap_and_keep_order(self):
+        from collections import Counter
+
+        from espagent.middlewares import ToolConcurrencyMiddleware
+
+        active, peaks = Counter(), Counter()
+        probe = self._probe("idf_size", active, peaks)
+        agent = self._agent([probe] * 4, ToolConcurrencyMiddleware(limit=3))
+
+        start = time.monotonic()
+        result = await agent.ainvoke({"messages": [HumanMessage("sizes")]})
+
+        assert time.monotonic() - start < 0.35
+        assert peaks["idf_size"] == 3
+        tool_results = [m.content for m in result["messages"] if m.type == "tool"]
+        assert tool_results == [f"idf_size {i}" for i in range(4)]
+
+    @pytest.mark.asyncio
+    async def test_serialized_tools_never_overlap(self):
+        from collections import Counter
+
+        from espagent.middlewares import ToolConcurrencyMiddleware
+
+        active, peaks = Counter(), Counter()
+        write = self._probe("write_file", active, peaks)
+        agent = self._agent([write] * 3, ToolConcurrencyMiddleware(serialized={"write_file"}))
+
+        await agent.ainvoke({"messages": [HumanMessage("write")]})
+
+        assert peaks["write_file"] == 1
+
+    @pytest.mark.asyncio
+    async def test_queued_serialized_calls_do_not_hold_slots(self):
+        from unittest.mock import MagicMock
+
+        from espagent.middlewares import ToolConcurrencyMiddleware
+
+        concurrency = ToolConcurrencyMiddleware(limit=2, serialized={"write_file"})
+        start = time.monotonic()
+        finished = {}
+
+        async def handler(request):
+            await asyncio.sleep(0.1)
+            finished[request.tool_call["id"]] = time.monotonic() - start
+
+        calls = [("write_file", "w1"), ("write_file", "w2"), ("write_file", "w3"), ("ls", "r")]
+        await asyncio.gather(
+            *(
+                concurrency.awrap_tool_call(MagicMock(tool_call={"name": name, "id": id_}), handler)
+                for name, id_ in calls
+            )
+        )
+
+        # The read runs next to the first write instead of after the queued writes
+        assert finished["r"] < 0.15
+        assert finished["w3"] > 0.25
@@ -1,58 +1,432 @@
 """Tests for espagent.tools module - meaningful validation only."""
 
-from subprocess import CalledProcessError
-from unittest.mock import MagicMock, patch
+import asyncio
+import subprocess
+import time
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
-from espagent.tools import ssh_run
-from espagent.tools.memory import recall_memory, save_memory
+from espagent.tools import ssh_job_cancel, ssh_job_output, ssh_job_start, ssh_job_status, ssh_run
+from espagent.tools.memory import (
+    _MISSING,
+    MemoryCache,
+    MemoryWriter,
+    consolidate_memories,
+    memory_writer,
+    recall_memory,
+    save_memory,
+    search_memories,
+)
+from espagent.tools.ssh import (
+    BoundedOutput,
+    RemoteResult,
+    SSHSessionPool,
+    configured_hosts,
+    resolve_hosts,
+    run_many,
+    run_remote,
+    summarize_results,
+)
+from espagent.utils.embeddings import HashingEmbeddings
+
+
+class _LocalPool(SSHSessionPool):
+    """Session pool that runs commands locally in their own process group.
+
+    Mirrors sshd, which starts every remote command in a new session.
+    """
+
+    def command(self, host, command):
+        return ["setsid", "sh", "-c", command]
 
 
 class TestSSHTool:
     """Test SSH tool - validates actual subprocess behavior."""
 
-    def test_ssh_calls_subprocess_with_correct_args(self):
-        """Test ssh_run calls subprocess.run with SSH command structure.
+    @pytest.mark.asyncio
+    async def test_ssh_calls_subprocess_with_correct_args(self):
+        """Test ssh_run spawns ssh with the host and command last.
 
-        This validates the command is built correctly: ['ssh', host, command]
+        This validates the command is built correctly: ['ssh', *options, host, command]
         If wrong, SSH would fail with usage error.
         """
-        mock_result = MagicMock()
-        mock_result.stdout = "output"
-
-        with patch("subprocess.run", return_value=mock_result) as mock_run:
-            ssh_run.func("myhost", "ls -la")
+        with patch("asyncio.create_subprocess_exec", side_effect=OSError("no ssh")) as mock_exec:
+            await ssh_run.coroutine("myhost", "ls -la")
 
         # Verify exact command structure
-        mock_run.assert_called_once()
-        call_args = mock_run.call_args
-        assert call_args[0][0] == ["ssh", "myhost", "ls -la"]
-        # Verify critical flags
-        assert call_args[1]["capture_output"] is True
-        assert call_args[1]["text"] is True
-        assert call_args[1]["check"] is True
-
-    def test_ssh_returns_error_message_on_failure(self):
+        mock_exec.assert_called_once()
+        argv = mock_exec.call_args[0]
+        assert argv[0] == "ssh"
+        assert argv[-2] == "myhost"
+        assert argv[-1].endswith("; ls -la")
+        # Output must be piped for streaming, stdin must not be inherited
+        assert mock_exec.call_args[1]["stdout"] == subprocess.PIPE
+        assert mock_exec.call_args[1]["stdin"] == subprocess.DEVNULL
+
+    @pytest.mark.asyncio
+    async def test_ssh_returns_error_message_on_failure(self):
         """Test ssh_run returns error message instead of raising.
 
         When SSH fails (connection refused, command not found, etc),
         the tool should return a descriptive error message, not crash.
         """
-        error = CalledProcessError(255, "ssh", stderr="Connection refused")
+        failure = RemoteResult("host", "ls", 255, "", "Connection refused", 0.1)
 
-        with patch("subprocess.run", side_effect=error):
-            result = ssh_run.func("host", "ls")
+        with patch("espagent.tools.ssh.run_remote", AsyncMock(return_value=failure)):
+            result = await ssh_run.coroutine("host", "ls")
 
         # Should return error message, not raise
         assert "SSH command execution failed" in result
         assert "Connection refused" in result
 
 
+class TestRunRemote:
+    """Test async remote execution - validates streaming, timeouts and capture."""
+
+    @pytest.mark.asyncio
+    async def test_streams_output_incrementally(self, tmp_path):
+        """Test output reaches the callback line by line with the stream name."""
+        seen = []
+
+        result = await run_remote(
+            "rig1",
+            "echo one; echo two >&2; echo three",
+            pool=_LocalPool(control_dir=str(tmp_path)),
+            on_output=lambda stream, line: seen.append((stream, line)),
+        )
+
+        assert result.ok
+        assert result.stdout == "one\nthree\n"
+        assert ("stderr", "two\n") in seen
+        # The process-group marker is internal and never shown
+        assert all("pgid" not in line for _, line in seen)
+
+    @pytest.mark.asyncio
+    async def test_timeout_terminates_remote_process_group(self, tmp_path):
+        """Test a timed-out command is killed, including its children.
+
+        Killing only the local ssh client would leave a build running
+        on the remote host.
+        """
+        marker = tmp_path / "survived"
+        pool = _LocalPool(control_dir=str(tmp_path))
+
+        result = await run_remote(
+            "rig1", f"(sleep 1; touch {marker}) & wait", pool=pool, timeout=0.3
+        )
+        await asyncio.sleep(1.2)
+
+        assert result.timed_out
+        assert result.exit_code is None
+        assert not marker.exists()
+        assert pool.stats()["rig1"]["active"] == 0
+
+    @pytest.mark.asyncio
+    async def test_output_capture_is_bounded(self, tmp_path):
+        """Test only head and tail of large output are kept for the model."""
+        result = await run_remote(
+            "rig1",
+            "seq 1 100000",
+            pool=_LocalPool(control_dir=str(tmp_path)),
+            head_limit=10,
+            tail_limit=10,
+        )
+
+        assert result.stdout.startswith("1\n2\n3\n4\n5")
+        assert result.stdout.endswith("100000\n")
+        assert "characters omitted" in result.stdout
+        assert len(result.stdout) < 100
+
+
+class TestSSHFanOut:
+    """Test multi-host execution - validates host resolution and aggregation."""
+
+    def test_host_patterns_expand_from_ssh_config(self, tmp_path):
+        """Test host-group patterns select concrete hosts from ~/.ssh/config.
+
+        Wildcard Host blocks (e.g. 'Host *') are defaults, not hosts, and
+        must never be targeted.
+        """
+        (tmp_path / "conf.d").mkdir()
+        (tmp_path / "conf.d" / "lab").write_text("Host rig-03\n  HostName 10.0.0.3\n")
+        config = tmp_path / "config"
+        config.write_text(
+            "Include conf.d/*\n"
+            "Host rig-01 rig-02\n  User esp\n"
+            "Host=buildbox\n"
+            "Host *\n  ServerAliveInterval 30\n"
+        )
+
+        assert configured_hosts(str(config)) == ["rig-03", "rig-01", "rig-02", "buildbox"]
+        assert resolve_hosts(["rig-*", "extra", "rig-01"], str(config)) == [
+            "rig-03",
+            "rig-01",
+            "rig-02",
+            "extra",
+        ]
+
+    @pytest.mark.asyncio
+    async def test_concurrency_limit_is_respected(self):
+        """Test no more than `concurrency` hosts run at the same time."""
+        running = 0
+        peak = 0
+
+        async def fake_run_remote(host, command, **kwargs):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return RemoteResult(host, command, 0, host, "", 0.01)
+
+        with patch("espagent.tools.ssh.run_remote", fake_run_remote):
+            results = await run_many([f"rig{i}" for i in range(10)], "id", concurrency=3)
+
+        assert peak == 3
+        # Results keep the requested host order
+        assert [r.stdout for r in results] == [f"rig{i}" for i in range(10)]
+
+    def test_identical_outputs_are_grouped(self):
+        """Test hosts with the same outcome collapse into one entry.
+
+        One entry per distinct result keeps a 30-host report small.
+        """
+        results = [
+            RemoteResult("rig1", "id", 0, "ESP32-S3\n", "", 1.0),
+            RemoteResult("rig2", "id", 0, "ESP32-S3\n", "", 1.0),
+            RemoteResult("rig3", "id", 2, "", "No serial port\n", 1.0),
+            RemoteResult("rig4", "id", None, "", "", 5.0, timed_out=True),
+        ]
+
+        report = summarize_results(results)
+
+        assert report.startswith("4 hosts: 2 succeeded, 2 failed")
+        assert report.count("ESP32-S3") == 1
+        assert "[2 host(s), exit 0] rig1, rig2" in report
+        assert "[1 host(s), exit 2] rig3\nNo serial port" in report
+        assert "[1 host(s), timed out] rig4" in report
+
+
+class TestSSHJobs:
+    """Test background jobs - runs real detached jobs through a local pool."""
+
+    @pytest.fixture
+    def job_runtime(self, tmp_path, monkeypatch):
+        from langgraph.store.memory import InMemoryStore
+
+        pool = _LocalPool(control_dir=str(tmp_path / "ctl"))
+
+        async def local_run_remote(host, command, **kwargs):
+            return await run_remote(host, command, pool=pool, **kwargs)
+
+        monkeypatch.setattr("espagent.tools.jobs.run_remote", local_run_remote)
+        monkeypatch.setattr("espagent.tools.jobs.JOB_ROOT", str(tmp_path / "jobs"))
+        runtime = MagicMock()
+        runtime.state = {"user_id": "alice"}
+        runtime.store = InMemoryStore()
+        return runtime
+
+    @staticmethod
+    def _job_id(started: str) -> str:
+        return started.split()[2]
+
+    async def _wait_finished(self, job_id, runtime):
+        for _ in range(50):
+            status = await ssh_job_status.coroutine(job_id, runtime=runtime)
+            if "[running]" not in status:
+                return status
+            await asyncio.sleep(0.1)
+        raise AssertionError("job did not finish")
+
+    @pytest.mark.asyncio
+    async def test_job_output_is_fetched_incrementally(self, job_runtime):
+        """Test a finished job reports its exit code and output by offset.
+
+        Returning only new bytes since the last offset keeps polling cheap.
+        """
+        started = await ssh_job_start.coroutine(
+            "rig1", "echo building; echo done; exit 3", runtime=job_runtime
+        )
+        job_id = self._job_id(started)
+
+        status = await self._wait_finished(job_id, job_runtime)
+        assert "[failed]" in status
+        assert "exit 3" in status
+
+        first = await ssh_job_output.coroutine(job_id, limit=9, runtime=job_runtime)
+        assert first.startswith("building\n")
+        assert "next_offset=9 of 14 bytes" in first
+
+        rest = await ssh_job_output.coroutine(job_id, offset=9, runtime=job_runtime)
+        assert rest.startswith("done\n")
+        assert "next_offset=14" in rest
+
+    @pytest.mark.asyncio
+    async def test_job_metadata_persists_in_store(self, job_runtime):
+        """Test jobs are recorded in the store so a restarted CLI finds them."""
+        started = await ssh_job_start.coroutine("rig1", "true", runtime=job_runtime)
+        job_id = self._job_id(started)
+
+        item = job_runtime.store.get(("ssh_jobs", "alice"), job_id)
+        assert item.value["host"] == "rig1"
+        assert item.value["command"] == "true"
+        await self._wait_finished(job_id, job_runtime)
+
+    @pytest.mark.asyncio
+    async def test_pid_is_found_among_login_banner_output(self, job_runtime, monkeypatch):
+        """Test a MOTD printed on stdout does not break starting a job."""
+        from espagent.tools import jobs
+
+        start = jobs._start_script
+        monkeypatch.setattr(
+            jobs,
+            "_start_script",
+            lambda job_dir, command: f"echo Welcome; {start(job_dir, command)}",
+        )
+        started = await ssh_job_start.coroutine("rig1", "true", runtime=job_runtime)
+        assert started.startswith("Started job")
+        await self._wait_finished(self._job_id(started), job_runtime)
+
+        monkeypatch.setattr(jobs, "_start_script", lambda job_dir, command: "echo Welcome")
+        failed = await ssh_job_start.coroutine("rig1", "true", runtime=job_runtime)
+        assert failed.startswith("Failed to start job on rig1: could not read the job's pid")
+
+    @pytest.mark.asyncio
+    async def test_output_ignores_login_banner_output(self, job_runtime, monkeypatch):
+        """Test rc-file output around the log payload never ends up in the log."""
+        from espagent.tools import jobs
+
+        started = await ssh_job_start.coroutine("rig1", "echo building", runtime=job_runtime)
+        job_id = self._job_id(started)
+        await self._wait_finished(job_id, job_runtime)
+
+        output = jobs._output_script
+        monkeypatch.setattr(
+            jobs,
+            "_output_script",
+            lambda *args: f"echo Welcome; {output(*args)}; echo bye",
+        )
+        result = await ssh_job_output.coroutine(job_id, runtime=job_runtime)
+        assert result.startswith("building\n\n--- job")
+
+        monkeypatch.setattr(jobs, "_output_script", lambda *args: "echo Welcome")
+        failed = await ssh_job_output.coroutine(job_id, runtime=job_runtime)
+        assert failed.endswith("malformed response")
+
+    @pytest.mark.asyncio
+    async def test_cancel_stops_running_job(self, job_runtime):
+        """Test cancelling kills the job's whole process group."""
+        started = await ssh_job_start.coroutine("rig1", "sleep 30", runtime=job_runtime)
+        job_id = self._job_id(started)
+
+        result = await ssh_job_cancel.coroutine(job_id, runtime=job_runtime)
+        assert result.startswith("Cancelled job")
+
+        record = job_runtime.store.get(("ssh_jobs", "alice"), job_id).value
+        assert record["status"] == "cancelled"
+        await asyncio.sleep(0.2)
+        # Zombies are fine: containers often lack an init that reaps them
+        stat = Path(f"/proc/{record['pid']}/stat")
+        assert not stat.exists() or stat.read_text().rsplit(")", 1)[1].split()[0] == "Z"
+
+
+class TestBoundedOutput:
+    """Test head + tail buffer - validates nothing beyond the limits is kept."""
+
+    def test_keeps_everything_below_limits(self):
+        buffer = BoundedOutput(head_limit=5, tail_limit=5)
+        buffer.write("abc")
+        buffer.write("defg")
+
+        assert buffer.getvalue() == "abcdefg"
+        assert buffer.omitted == 0
+
+    def test_drops_middle_of_long_stream(self):
+        buffer = BoundedOutput(head_limit=3, tail_limit=3)
+        for char in "abcdefghij":
+            buffer.write(char)
+
+        assert buffer.omitted == 4
+        assert buffer.getvalue() == "abc\n... [4 characters omitted] ...\nhij"
+
+
+class TestSSHSessionPool:
+    """Test SSH session pool - validates connection reuse bookkeeping."""
+
+    def test_command_multiplexes_over_per_host_control_socket(self, tmp_path):
+        """Test every command for a host targets the same control master.
+
+        Reusing one ControlPath per host is what lets OpenSSH skip the
+        handshake; distinct hosts must never share a master.
+        """
+        pool = SSHSessionPool(control_dir=str(tmp_path))
+
+        first = pool.command("rig1", "ls")
+        second = pool.command("rig1", "pwd")
+
+        assert "ControlMaster=auto" in first
+        assert f"ControlPath={pool.control_path('rig1')}" in first
+        assert first[:-1] == second[:-1]
+        assert pool.control_path("rig1") != pool.control_path("rig2")
+
+    def test_session_cap_blocks_extra_channels(self, tmp_path):
+        """Test max_sessions limits concurrent channels per host.
+
+        OpenSSH rejects channels beyond the server's MaxSessions, so the
+        pool must queue them instead.
+        """
+        pool = SSHSessionPool(control_dir=str(tmp_path), max_sessions=1)
+        pool.acquire("rig1")
+
+        session = pool._hosts["rig1"]
+        assert session.semaphore.acquire(blocking=False) is False
+
+        pool.release("rig1")
+        assert pool.stats()["rig1"]["active"] == 0
+
+    def test_idle_masters_are_evicted(self, tmp_path):
+        """Test masters unused past idle_timeout are closed.
+
+        Leaking masters keeps authenticated connections open forever.
+        """
+        pool = SSHSessionPool(control_dir=str(tmp_path), idle_timeout=0)
+        with pool.session("rig1"):
+            pass
+        pool._hosts["rig1"].last_used -= 1
+        socket = pool.control_path("rig1")
+        socket.touch()
+
+        with patch("subprocess.run") as mock_run:
+            pool.evict_idle()
+
+        assert "rig1" not in pool.stats()
+        assert mock_run.call_args[0][0][-2:] == ["exit", "rig1"]
+        assert not socket.exists()
+
+    def test_stale_master_is_discarded_on_health_check(self, tmp_path):
+        """Test a failed health check removes the dead control socket."""
+        pool = SSHSessionPool(control_dir=str(tmp_path))
+        socket = pool.control_path("rig1")
+        socket.touch()
+
+        with patch("subprocess.run", return_value=MagicMock(returncode=255)):
+            assert pool.check("rig1") is False
+
+        assert not socket.exists()
+
+
 class TestMemoryTools:
     """Test memory tools - validates data flow to store."""
 
-    def test_save_memory_extracts_user_info_from_state(self):
+    @pytest.fixture(autouse=True)
+    async def _drain_writer(self):
+        yield
+        await memory_writer.aclose()
+
+    @pytest.mark.asyncio
+    async def test_save_memory_extracts_user_info_from_state(self):
         """Test save_memory correctly extracts user_id and user_name from state.
 
         The namespace (user_id, user_name) isolates memories per user.
@@ -64,17 +438,18 @@ class TestMemoryTools:
             "user_info": MagicMock(user_name="alice_user"),
             "task_info": "debug task",
         }
-        mock_runtime.store = MagicMock()
+        mock_runtime.store = MagicMock(abatch=AsyncMock())
 
-        save_memory.func("test info", runtime=mock_runtime)
+        await save_memory.coroutine("test info", runtime=mock_runtime)
+        await memory_writer.flush()
 
-        # Verify store.put was called with correct namespace
-        mock_runtime.store.put.assert_called_once()
-        call_args = mock_runtime.store.put.call_args
-        namespace = call_args[0][0]
-        assert namespace == ("alice", "alice_user")
+        # Verify the batched put carries the correct namespace
+        mock_runtime.store.abatch.assert_called_once()
+        (op,) = mock_runtime.store.abatch.call_args[0][0]
+        assert op.namespace == ("alice", "alice_user")
 
-    def test_save_memory_handles_missing_user_info(self):
+    @pytest.mark.asyncio
+    async def test_save_memory_handles_missing_user_info(self):
         """Test save_memory handles missing user_info gracefully.
 
         When user_info is None, should use 'unknown_user' fallback
@@ -85,17 +460,67 @@ class TestMemoryTools:
             "user_id": "bob",
             "user_info": None,
         }
-        mock_runtime.store = MagicMock()
+        mock_runtime.store = MagicMock(abatch=AsyncMock())
 
-        result = save_memory.func("test info", runtime=mock_runtime)
+        result = await save_memory.coroutine("test info", runtime=mock_runtime)
+        await memory_writer.flush()
 
         # Should not crash, and use fallback
         assert "unknown_user" in result
-        mock_runtime.store.put.assert_called_once()
-        namespace = mock_runtime.store.put.call_args[0][0]
-        assert namespace == ("bob", "unknown_user")
+        (op,) = mock_runtime.store.abatch.call_args[0][0]
+        assert op.namespace == ("bob", "unknown_user")
+
+    @pytest.mark.asyncio
+    async def test_save_memory_without_store_reports_error(self):
+        """Test nothing is queued (and nothing claimed saved) without a store."""
+        mock_runtime = MagicMock()
+        mock_runtime.state = {"user_id": "bob", "user_info": None}
+        mock_runtime.store = None
+
+        with patch.object(memory_writer, "enqueue") as enqueue:
+            result = await save_memory.coroutine("test info", runtime=mock_runtime)
 
-    def test_recall_memory_searches_with_correct_namespace(self):
+        assert result == "Error: Store not configured, cannot save memory"
+        enqueue.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_saves_in_same_second_get_distinct_ids(self):
+        """Test rapid saves never overwrite each other.
+
+        Second-resolution IDs made two saves in the same second collide.
+        """
+        mock_runtime = MagicMock()
+        mock_runtime.state = {"user_id": "eve", "user_info": None}
+        mock_runtime.store = MagicMock(abatch=AsyncMock())
+
+        for i in range(20):
+            await save_memory.coroutine(f"fact {i}", runtime=mock_runtime)
+        await memory_writer.flush()
+
+        # All saves of the turn go out as a single batch
+        mock_runtime.store.abatch.assert_called_once()
+        ops = mock_runtime.store.abatch.call_args[0][0]
+        assert len({op.key for op in ops}) == 20
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_keeps_writes_for_retry(self):
+        """Test a store error does not drop buffered memories."""
+        from langgraph.store.memory import InMemoryStore
+
+        store = InMemoryStore()
+        writer = MemoryWriter(flush_delay=60)
+        writer.enqueue(store, ("u", "u"), "k", {"info": "x"})
+
+        with patch.object(InMemoryStore, "abatch", AsyncMock(side_effect=RuntimeError("db down"))):
+            await writer.flush()
+        assert writer.pending_count() == 1
+
+        await writer.aclose()
+        assert writer.pending_count() == 0
+        assert store.get(("u", "u"), "k").value == {"info": "x"}
+
+    @pytest.mark.asyncio
+    async def test_recall_memory_searches_with_correct_namespace(self):
         """Test recall_memory searches with correct namespace prefix.
 
         The search namespace must match the save namespace for
@@ -111,7 +536,7 @@ class TestMemoryTools:
         mock_runtime.store = MagicMock()
         mock_runtime.store.search.return_value = []
 
-        recall_memory.func(runtime=mock_runtime, limit=5)
+        await recall_memory.coroutine(runtime=mock_runtime, limit=5)
 
         # Verify search was called with correct namespace
         mock_runtime.store.search.assert_called_once()
@@ -121,6 +546,295 @@ class TestMemoryTools:
         # Verify limit is passed (as keyword argument)
         assert call_args[1]["limit"] == 5
 
+    @pytest.mark.asyncio
+    async def test_recall_sees_memories_saved_in_same_turn(self):
+        """Test buffered saves are flushed before a recall reads the store."""
+        from langgraph.store.memory import InMemoryStore
+
+        from espagent.utils import UserInfo
+
+        runtime = MagicMock()
+        runtime.state = {
+            "user_id": "fay",
+            "user_info": UserInfo(user_name="fay", additional_info=""),
+        }
+        runtime.store = InMemoryStore()
+
+        await save_memory.coroutine("Board is ESP32-C6", runtime=runtime)
+        result = await recall_memory.coroutine(runtime=runtime)
+
+        assert "ESP32-C6" in result
+
+
+class TestMemorySearch:
+    """Test query-based memory recall - validates ranking, not just plumbing."""
+
+    @staticmethod
+    def _runtime(store):
+        from espagent.utils import UserInfo
+
+        runtime = MagicMock()
+        runtime.state = {
+            "user_id": "dana",
+            "user_info": UserInfo(user_name="dana", additional_info=""),
+        }
+        runtime.store = store
+        return runtime
+
+    @staticmethod
+    def _fill(store, memories):
+        for key, (info, age_days) in memories.items():
+            store.put(
+                ("dana", "dana"),
+                key,
+                {"info": info, "timestamp": time.time() - age_days * 86400},
+            )
+
+    @pytest.mark.asyncio
+    async def test_recall_ranks_by_query_without_vector_index(self):
+        """Test the in-process fallback returns the most relevant memory first.
+
+        Without ranking, recall returns arbitrary memories and wastes tokens.
+        """
+        from langgraph.store.memory import InMemoryStore
+
+        store = InMemoryStore()
+        self._fill(
+            store,
+            {
+                "a": ("Uses ESP32-S3 DevKitC board", 1),
+                "b": ("Prefers Chinese replies", 1),
+                "c": ("Flashing over UART fails at 921600 baud", 1),
+            },
+        )
+
+        result = await recall_memory.coroutine(
+            "UART flashing baud", 1, runtime=self._runtime(store)
+        )
+
+        assert "Found 1 memories" in result
+        assert "921600" in result
+
+    @pytest.mark.asyncio
+    async def test_recall_uses_store_vector_index_when_configured(self):
+        """Test stores with a vector index (e.g. pgvector) do the search."""
+        from langgraph.store.memory import InMemoryStore
+
+        store = InMemoryStore(index={"dims": 512, "embed": HashingEmbeddings(), "fields": ["info"]})
+        self._fill(store, {"a": ("Board is ESP32-C3", 1), "b": ("Works on BLE mesh", 1)})
+
+        result = await recall_memory.coroutine("ESP32-C3 board", 1, runtime=self._runtime(store))
+
+        assert "ESP32-C3" in result
+        assert "BLE" not in result
+
+    def test_recency_breaks_ties_between_similar_memories(self):
+        """Test newer memories win when similarity is equal."""
+        from langgraph.store.memory import InMemoryStore
+
+        store = InMemoryStore()
+        self._fill(
+            store,
+            {"old": ("Project uses IDF v4.4", 200), "new": ("Project uses IDF v5.2", 0)},
+        )
+
+        items = search_memories(store, ("dana", "dana"), "Project uses IDF", 2)
+
+        assert [item.key for item in items] == ["new", "old"]
+
+    def test_local_index_is_safe_across_worker_threads(self):
+        """Test concurrent searches of a changing namespace keep the index consistent."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        from langgraph.store.memory import InMemoryStore
+
+        from espagent.tools.memory import LocalMemoryIndex
+
+        store = InMemoryStore()
+        self._fill(store, {f"m{i}": (f"UART baud {i} on board {i % 7}", 1) for i in range(300)})
+        items = store.search(("dana", "dana"), limit=300)
+        index = LocalMemoryIndex(HashingEmbeddings())
+
+        def search(round_: int):
+            # Every other search sees half of the memories deleted
+            snapshot = items[::2] if round_ % 2 else items
+            return snapshot, index.score(("dana", "dana"), snapshot, "UART baud board")
+
+        with ThreadPoolExecutor(8) as pool:
+            for snapshot, scored in pool.map(search, range(64)):
+                keys = {item.key for item in snapshot}
+                assert scored and all(item.key in keys for _, item in scored)
+
+        final = index.score(("dana", "dana"), items, "UART baud board")
+        assert len(final) == len(items)
+
+
+class TestMemoryCache:
+    """Test recall cache - validates hits, precise invalidation and bounds."""
+
+    @staticmethod
+    def _store_with(namespace, info):
+        from langgraph.store.memory import InMemoryStore
+
+        store = InMemoryStore()
+        store.put(namespace, "k", {"info": info, "timestamp": time.time()})
+        return store
+
+    def test_repeated_recall_is_served_from_cache(self):
+        """Test the second identical lookup does not hit the store."""
+        cache = MemoryCache()
+        store = self._store_with(("u", "u"), "Board is ESP32")
+
+        with patch("espagent.tools.memory.memory_cache", cache):
+            first = search_memories(store, ("u", "u"), None, 5)
+            with patch.object(type(store), "search", side_effect=AssertionError("store hit")):
+                second = search_memories(store, ("u", "u"), None, 5)
+
+        assert second == first
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    @pytest.mark.asyncio
+    async def test_write_invalidates_only_that_namespace(self):
+        """Test a flush drops the written namespace and keeps the others.
+
+        Stale entries would hide new memories; over-eager invalidation
+        would make the cache useless for other users.
+        """
+        cache = MemoryCache()
+        store = self._store_with(("alice", "alice"), "a")
+        store.put(("bob", "bob"), "k", {"info": "b", "timestamp": time.time()})
+        writer = MemoryWriter()
+
+        with patch("espagent.tools.memory.memory_cache", cache):
+            search_memories(store, ("alice", "alice"), None, 5)
+            search_memories(store, ("bob", "bob"), None, 5)
+            writer.enqueue(store, ("alice", "alice"), "k2", {"info": "a2"})
+            await writer.aclose()
+
+            alice = search_memories(store, ("alice", "alice"), None, 5)
+            search_memories(store, ("bob", "bob"), None, 5)
+
+        assert {item.value["info"] for item in alice} == {"a", "a2"}
+        assert cache.stats()["hits"] == 1  # bob only
+
+    def test_size_cap_evicts_least_recently_used(self):
+        cache = MemoryCache(max_entries=2)
+        store = object.__new__(type("FakeStore", (), {}))
+
+        cache.put(store, ("u",), "a", 1)
+        cache.put(store, ("u",), "b", 2)
+        cache.get(store, ("u",), "a")
+        cache.put(store, ("u",), "c", 3)
+
+        assert cache.get(store, ("u",), "a") == 1
+        assert cache.get(store, ("u",), "b") is _MISSING
+        assert cache.stats()["entries"] == 2
+
+    def test_entries_expire_after_ttl(self):
+        cache = MemoryCache(ttl=0)
+        store = object.__new__(type("FakeStore", (), {}))
+
+        cache.put(store, ("u",), "a", 1)
+
+        assert cache.get(store, ("u",), "a") is _MISSING
+
+
+class TestMemoryConsolidation:
+    """Test memory consolidation - validates dedupe, merge and quota."""
+
+    NS = ("gus", "gus")
+
+    @staticmethod
+    def _store(memories):
+        from langgraph.store.memory import InMemoryStore
+
+        store = InMemoryStore()
+        for key, (info, age_days) in memories.items():
+            store.put(
+                TestMemoryConsolidation.NS,
+                key,
+                {"info": info, "timestamp": time.time() - age_days * 86400},
+            )
+        return store
+
+    def _infos(self, store):
+        return {item.key: item.value for item in store.search(self.NS, limit=100)}
+
+    @pytest.mark.asyncio
+    async def test_near_identical_memories_keep_newest(self):
+        """Test restated facts collapse into the newest memory with a revision count."""
+        store = self._store(
+            {
+                "old": ("User works on ESP32-S3 camera project", 10),
+                "new": ("User works on ESP32-S3 camera project.", 1),
+                "other": ("Prefers replies in Chinese", 5),
+            }
+        )
+
+        report = await consolidate_memories(store, self.NS)
+
+        memories = self._infos(store)
+        assert set(memories) == {"new", "other"}
+        assert memories["new"]["revisions"] == 2
+        assert report.duplicates == 1
+
+    @pytest.mark.asyncio
+    async def test_updated_fact_is_merged_into_newer_version(self):
+        """Test a changed value of the same fact supersedes the old one."""
+        store = self._store(
+            {
+                "v1": ("Project target chip is ESP32 with IDF version 4.4 and 4MB flash", 30),
+                "v2": ("Project target chip is ESP32 with IDF version 5.2 and 4MB flash", 1),
+            }
+        )
+
+        report = await consolidate_memories(store, self.NS, merge_similarity=0.6)
+
+        memories = self._infos(store)
+        assert list(memories) == ["v2"]
+        assert memories["v2"]["first_saved"] < memories["v2"]["timestamp"]
+        assert report.merged == 1
+
+    @pytest.mark.asyncio
+    async def test_quota_evicts_oldest_memories(self):
+        store = self._store({f"m{i}": (f"distinct fact number {i} zone{i}", i) for i in range(5)})
+
+        report = await consolidate_memories(store, self.NS, quota=3)
+
+        assert set(self._infos(store)) == {"m0", "m1", "m2"}
+        assert report.evicted == 2
+
+    @pytest.mark.asyncio
+    async def test_incremental_run_only_touches_new_memories(self):
+        """Test on-save consolidation leaves unrelated existing pairs alone.
+
+        Only the new memory's neighbours may change, so a save stays cheap
+        and predictable.
+        """
+        store = self._store(
+            {
+                "a1": ("Serial port is /dev/ttyUSB0", 3),
+                "a2": ("Serial port is /dev/ttyUSB0", 2),
+                "b": ("Board uses 40MHz crystal", 1),
+                "b_new": ("Board uses 40MHz crystal", 0),
+            }
+        )
+
+        await consolidate_memories(store, self.NS, new_keys={"b_new"})
+
+        assert set(self._infos(store)) == {"a1", "a2", "b_new"}
+
+    @pytest.mark.asyncio
+    async def test_non_memory_items_are_never_evicted(self):
+        """Test items without 'info' (e.g. job records) are ignored."""
+        store = self._store({"m": ("a fact", 1)})
+        store.put(self.NS, "job", {"status": "running"})
+
+        await consolidate_memories(store, self.NS, quota=0)
+
+        assert set(self._infos(store)) == {"job"}
+
 
 class TestMCPIntegration:
     """Test MCP tool integration - validates interface."""
@@ -144,3 +858,480 @@ class TestMCPIntegration:
         except Exception as e:
             # Connection errors are acceptable, but should return empty list
             pytest.skip(f"MCP server not available: {e}")
+
+    @staticmethod
+    def _mcp_tool(name="idf_size", description="Report firmware size"):
+        from mcp.types import Tool as MCPTool
+
+        return MCPTool(
+            name=name,
+            description=description,
+            inputSchema={"type": "object", "properties": {"target": {"type": "string"}}},
+        )
+
+    @pytest.mark.asyncio
+    async def test_cached_schemas_are_used_without_waiting_for_server(self, tmp_path):
+        """Test startup uses cached tool schemas and revalidates in the background.
+
+        A slow MCP server must not delay the prompt when schemas are known.
+        """
+        from espagent.tools import mcp
+
+        cache = mcp.MCPToolCache(tmp_path / "tools.json")
+        cache.save("http://localhost:8090/mcp", "idf@1.0", [self._mcp_tool()])
+        started = asyncio.Event()
+
+        async def slow_discover(connection):
+            started.set()
+            await asyncio.sleep(0.1)
+            return "idf@1.0", [self._mcp_tool()]
+
+        with patch.object(mcp, "discover_server", slow_discover):
+            tools = await mcp.get_mcp_tools(cache)
+            assert not started.is_set()
+            assert [tool.name for tool in tools] == ["idf_size"]
+            assert "target" in tools[0].args
+            await asyncio.gather(*mcp._background_tasks)
+
+        assert started.is_set()
+
+    @pytest.mark.asyncio
+    async def test_revalidation_refreshes_changed_schemas(self, tmp_path):
+        """Test a new server version replaces the cached schemas for next start."""
+        from espagent.tools import mcp
+
+        cache = mcp.MCPToolCache(tmp_path / "tools.json")
+        cache.save("http://localhost:8090/mcp", "idf@1.0", [self._mcp_tool()])
+        new_tools = [self._mcp_tool(), self._mcp_tool("idf_flash", "Flash firmware")]
+
+        with patch.object(mcp, "discover_server", AsyncMock(return_value=("idf@2.0", new_tools))):
+            await mcp.get_mcp_tools(cache)
+            await asyncio.gather(*mcp._background_tasks)
+
+        entry = cache.load("http://localhost:8090/mcp")
+        assert entry["version"] == "idf@2.0"
+        assert [tool["name"] for tool in entry["tools"]] == ["idf_size", "idf_flash"]
+
+    @pytest.mark.asyncio
+    async def test_first_start_discovers_live_and_fills_cache(self, tmp_path):
+        from espagent.tools import mcp
+
+        cache = mcp.MCPToolCache(tmp_path / "tools.json")
+
+        with patch.object(
+            mcp, "discover_server", AsyncMock(return_value=("idf@1.0", [self._mcp_tool()]))
+        ):
+            tools = await mcp.get_mcp_tools(cache)
+
+        assert [tool.name for tool in tools] == ["idf_size"]
+        assert cache.load("http://localhost:8090/mcp")["version"] == "idf@1.0"
+
+    @pytest.mark.asyncio
+    async def test_failing_server_does_not_drop_healthy_servers(self, tmp_path):
+        """Test servers are discovered concurrently and failures stay isolated.
+
+        One unreachable or hanging server must neither remove the tools of
+        the others nor hold startup beyond its own discovery timeout.
+        """
+        from espagent.tools import mcp
+
+        servers = {
+            "idf": {"transport": "streamable_http", "url": "http://idf/mcp"},
+            "farm": {"transport": "streamable_http", "url": "http://farm/mcp"},
+            "logs": {
+                "transport": "streamable_http",
+                "url": "http://logs/mcp",
+                "discovery_timeout": 0.05,
+            },
+        }
+
+        async def discover(connection):
+            if connection["url"] == "http://farm/mcp":
+                raise ConnectionError("refused")
+            if connection["url"] == "http://logs/mcp":
+                await asyncio.sleep(10)
+            await asyncio.sleep(0.05)
+            return "idf@1.0", [self._mcp_tool()]
+
+        cache = mcp.MCPToolCache(tmp_path / "tools.json")
+        with patch.object(mcp, "discover_server", discover):
+            start = time.monotonic()
+            results = await mcp.discover_servers(servers, cache)
+
+        assert time.monotonic() - start < 1.0
+        assert [(r.name, r.source) for r in results] == [
+            ("idf", "live"),
+            ("farm", "failed"),
+            ("logs", "failed"),
+        ]
+        assert [tool.name for tool in results[0].tools] == ["idf_size"]
+        assert "timed out" in str(results[2])
+
+    def test_servers_are_loaded_from_config_file(self, tmp_path):
+        from espagent.tools import mcp
+
+        config = tmp_path / "mcp_servers.json"
+        config.write_text(
+            '{"servers": {"farm": {"transport": "streamable_http", "url": "http://farm/mcp"},'
+            ' "logs": {"transport": "stdio", "command": "log-mcp", "enabled": false}}}'
+        )
+
+        assert list(mcp.load_mcp_servers(config)) == ["farm"]
+        assert mcp.load_mcp_servers(tmp_path / "missing.json") == mcp.MCP_SERVERS
+
+
+class _FakeMCPSession:
+    """Stand-in for an initialized MCP ClientSession."""
+
+    def __init__(self, fail_with=None):
+        from mcp.types import CallToolResult, TextContent
+
+        self.fail_with = fail_with
+        self.calls = 0
+        self.result = CallToolResult(content=[TextContent(type="text", text="ok")])
+        self.send_ping = AsyncMock()
+
+    async def initialize(self):
+        return None
+
+    async def call_tool(self, name, args):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.fail_with is not None:
+            error, self.fail_with = self.fail_with, None
+            raise error
+        return self.result
+
+
+class TestMCPSessionPool:
+    """Test MCP tool calls reuse long-lived sessions instead of reconnecting."""
+
+    CONNECTION = {"transport": "streamable_http", "url": "http://localhost:8090/mcp"}
+
+    @staticmethod
+    def _create_session(sessions):
+        """Patch target for create_session handing out the given sessions in order."""
+        from contextlib import asynccontextmanager
+
+        opened = []
+
+        @asynccontextmanager
+        async def create_session(connection):
+            session = sessions[len(opened)] if len(opened) < len(sessions) else _FakeMCPSession()
+            opened.append(session)
+            yield session
+
+        return create_session, opened
+
+    @pytest.mark.asyncio
+    async def test_tool_calls_share_one_session(self):
+        """Test sequential calls through the LangChain tool do not redo the handshake."""
+        from espagent.tools import mcp
+
+        pool = mcp.MCPSessionPool(keepalive=0)
+        create_session, opened = self._create_session([])
+        tool = TestMCPIntegration._mcp_tool()
+
+        with patch.object(mcp, "create_session", create_session):
+            [lc_tool] = mcp._to_langchain("espagent", self.CONNECTION, [tool], pool)
+            for _ in range(3):
+                [content] = await lc_tool.ainvoke({"target": "esp32"})
+                assert content["text"] == "ok"
+            await pool.aclose()
+
+        assert len(opened) == 1
+        assert opened[0].calls == 3
+
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_are_bounded_by_pool_size(self):
+        from espagent.tools import mcp
+
+        pool = mcp.MCPSessionPool(size=2, keepalive=0)
+        pool.register("espagent", self.CONNECTION)
+        create_session, opened = self._create_session([])
+
+        with patch.object(mcp, "create_session", create_session):
+            await asyncio.gather(*(pool.call_tool("espagent", "idf_size", {}) for _ in range(6)))
+            await pool.aclose()
+
+        assert len(opened) == 2
+        assert sum(session.calls for session in opened) == 6
+
+    @pytest.mark.asyncio
+    async def test_terminated_session_is_replaced_and_call_retried(self):
+        """Test a server restart costs one reconnect instead of a failed tool call.
+
+        The transport reports "Session terminated" when the server rejects an
+        unknown session, so the call never ran and is safe to retry.
+        """
+        from mcp.shared.exceptions import McpError
+        from mcp.types import ErrorData
+
+        from espagent.tools import mcp
+
+        pool = mcp.MCPSessionPool(keepalive=0)
+        pool.register("espagent", self.CONNECTION)
+        expired = McpError(ErrorData(code=32600, message="Session terminated"))
+        create_session, opened = self._create_session([_FakeMCPSession(fail_with=expired)])
+
+        with patch.object(mcp, "create_session", create_session):
+            result = await pool.call_tool("espagent", "idf_size", {})
+            await pool.aclose()
+
+        assert result.content[0].text == "ok"
+        assert len(opened) == 2
+        assert pool.stats()["reconnects"] == 1
+
+    @pytest.mark.asyncio
+    async def test_call_that_may_have_run_is_not_retried(self):
+        """Test a dropped connection after sending is a tool error, never a second run.
+
+        Only failures to connect are retried; after a read timeout the server
+        may have flashed or erased the board already.
+        """
+        import httpx
+
+        from espagent.tools import mcp
+
+        pool = mcp.MCPSessionPool(keepalive=0)
+        pool.register("espagent", self.CONNECTION)
+        timed_out = _FakeMCPSession(fail_with=httpx.ReadTimeout("timed out"))
+        refused = _FakeMCPSession(fail_with=httpx.ConnectError("refused"))
+        create_session, opened = self._create_session([timed_out, refused, _FakeMCPSession()])
+
+        with patch.object(mcp, "create_session", create_session):
+            flashed = await pool.call_tool("espagent", "idf_flash", {})
+            sized = await pool.call_tool("espagent", "idf_size", {})
+            await pool.aclose()
+
+        assert flashed.isError
+        assert "not retried" in flashed.content[0].text
+        assert timed_out.calls == 1
+        assert sized.content[0].text == "ok"
+        assert len(opened) == 3
+        assert pool.stats()["reconnects"] == 1
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("code", ["closed", "timeout"])
+    async def test_unanswered_mcp_errors_are_tool_errors(self, code):
+        """Test a closed session or request timeout is reported, not raised into retries."""
+        import httpx
+        from mcp.shared.exceptions import McpError
+        from mcp.types import CONNECTION_CLOSED, ErrorData
+
+        from espagent.tools import mcp
+
+        pool = mcp.MCPSessionPool(keepalive=0)
+        pool.register("espagent", self.CONNECTION)
+        error_code = CONNECTION_CLOSED if code == "closed" else httpx.codes.REQUEST_TIMEOUT
+        failing = _FakeMCPSession(fail_with=McpError(ErrorData(code=error_code, message=code)))
+        create_session, opened = self._create_session([failing])
+
+        with patch.object(mcp, "create_session", create_session):
+            result = await pool.call_tool("espagent", "idf_flash", {})
+            await pool.aclose()
+
+        assert result.isError
+        assert "not retried" in result.content[0].text
+        assert failing.calls == 1
+        assert pool.stats()["reconnects"] == 0
+
+    @pytest.mark.asyncio
+    async def test_tool_error_is_not_retried_and_keeps_session(self):
+        """Test errors reported by the server are surfaced once, not re-run."""
+        from mcp.shared.exceptions import McpError
+        from mcp.types import ErrorData
+
+        from espagent.tools import mcp
+
+        pool = mcp.MCPSessionPool(keepalive=0)
+        pool.register("espagent", self.CONNECTION)
+        failing = _FakeMCPSession(fail_with=McpError(ErrorData(code=-32602, message="bad args")))
+        create_session, opened = self._create_session([failing])
+
+        with patch.object(mcp, "create_session", create_session):
+            with pytest.raises(McpError):
+                await pool.call_tool("espagent", "idf_flash", {})
+            await pool.call_tool("espagent", "idf_size", {})
+            await pool.aclose()
+
+        assert len(opened) == 1
+        assert failing.calls == 2
+
+    @pytest.mark.asyncio
+    async def test_keepalive_drops_unresponsive_sessions(self):
+        from espagent.tools import mcp
+
+        pool = mcp.MCPSessionPool(keepalive=0.01)
+        pool.register("espagent", self.CONNECTION)
+        dead = _FakeMCPSession()
+        dead.send_ping.side_effect = ConnectionError("gone")
+        create_session, opened = self._create_session([dead])
+
+        with patch.object(mcp, "create_session", create_session):
+            await pool.call_tool("espagent", "idf_size", {})
+            await asyncio.sleep(0.02)
+            await pool.ping_idle()
+            assert pool.stats()["idle"] == {"espagent": 0}
+            await pool.call_tool("espagent", "idf_size", {})
+            await pool.aclose()
+
+        assert len(opened) == 2
+
+
+class TestToolResultCache:
+    """Test idempotent MCP tool results are reused until project files change."""
+
+    @staticmethod
+    def _request(name="idf_size", args=None):
+        from langchain_mcp_adapters.interceptors import MCPToolCallRequest
+
+        return MCPToolCallRequest(name=name, args=args or {}, server_name="espagent")
+
+    @staticmethod
+    def _handler(text="Total image size: 180 KB", is_error=False):
+        from mcp.types import CallToolResult, TextContent
+
+        return AsyncMock(
+            return_value=CallToolResult(
+                content=[TextContent(type="text", text=text)], isError=is_error
+            )
+        )
+
+    def _cache(self, tmp_path, store=None):
+        from espagent.tools.tool_cache import ToolResultCache
+
+        cache = ToolResultCache(project_dir=str(tmp_path))
+        cache.configure("espagent", {"idf_size": ["sdkconfig", "build/*.map"]})
+        cache.attach(store)
+        return cache
+
+    @pytest.mark.asyncio
+    async def test_repeated_call_is_served_from_cache(self, tmp_path):
+        (tmp_path / "sdkconfig").write_text("CONFIG_IDF_TARGET=esp32\n")
+        cache = self._cache(tmp_path)
+        handler = self._handler()
+
+        first = await cache.intercept(self._request(), handler)
+        second = await cache.intercept(self._request(), handler)
+
+        assert handler.await_count == 1
+        assert second.content[0].text == first.content[0].text
+        assert cache.stats()["local_hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_project_file_change_invalidates_result(self, tmp_path):
+        """Test editing a tracked file, or adding a matching one, forces a fresh call."""
+        sdkconfig = tmp_path / "sdkconfig"
+        sdkconfig.write_text("CONFIG_IDF_TARGET=esp32\n")
+        cache = self._cache(tmp_path)
+        handler = self._handler()
+
+        await cache.intercept(self._request(), handler)
+        sdkconfig.write_text("CONFIG_IDF_TARGET=esp32s3\n")
+        await cache.intercept(self._request(), handler)
+        (tmp_path / "build").mkdir()
+        (tmp_path / "build" / "app.map").write_text("map")
+        await cache.intercept(self._request(), handler)
+        await cache.intercept(self._request(args={"target": "esp32"}), handler)
+
+        assert handler.await_count == 4
+        assert cache.stats()["misses"] == 4
+
+    @pytest.mark.asyncio
+    async def test_shared_tier_serves_other_sessions(self, tmp_path):
+        from langgraph.store.memory import InMemoryStore
+
+        (tmp_path / "sdkconfig").write_text("CONFIG_IDF_TARGET=esp32\n")
+        store = InMemoryStore()
+        handler = self._handler()
+        await self._cache(tmp_path, store).intercept(self._request(), handler)
+
+        other = self._cache(tmp_path, store)
+        result = await other.intercept(self._request(), handler)
+
+        assert handler.await_count == 1
+        assert result.content[0].text == "Total image size: 180 KB"
+        assert other.stats()["shared_hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_expired_shared_results_are_deleted(self, tmp_path):
+        """Test expired results leave the store, also those no key points to anymore."""
+        from langgraph.store.memory import InMemoryStore
+
+        from espagent.tools.tool_cache import _background_tasks
+
+        (tmp_path / "sdkconfig").write_text("CONFIG_IDF_TARGET=esp32\n")
+        store = InMemoryStore()
+        cache = self._cache(tmp_path, store)
+        namespace = (cache.NAMESPACE, "espagent")
+        old = {"created_at": time.time() - cache.ttl - 1, "result": {"content": []}}
+        key = cache.key("espagent", "idf_size", {})
+        store.put(namespace, key, old, index=False)
+        # Results of project files that have changed since
+        for i in range(3):
+            store.put(namespace, f"stale{i}", old, index=False)
+
+        # A failed call stores nothing, so only the read removed the entry
+        await cache.intercept(self._request(), self._handler(is_error=True))
+        assert store.get(namespace, key) is None
+
+        # The first successful write sweeps the rest in the background
+        await cache.intercept(self._request(), self._handler())
+        await asyncio.gather(*_background_tasks)
+
+        assert [item.key for item in store.search(namespace)] == [key]
+        assert cache.stats()["expired"] == 4
+
+    @pytest.mark.asyncio
+    async def test_uncached_tools_and_errors_always_reach_server(self, tmp_path):
+        cache = self._cache(tmp_path)
+        flash = self._handler("flashed")
+        failing = self._handler("build failed", is_error=True)
+
+        for _ in range(2):
+            await cache.intercept(self._request("idf_flash"), flash)
+            await cache.intercept(self._request(), failing)
+
+        assert flash.await_count == 2
+        assert failing.await_count == 2
+        assert cache.stats()["size"] == 0
+
+    @pytest.mark.asyncio
+    async def test_calls_are_not_cached_outside_the_project(self, tmp_path, monkeypatch):
+        """Test globs matching nothing (cwd is not the project) disable caching.
+
+        Nothing could invalidate such an entry, so stale build results would be
+        served until the TTL expires.
+        """
+        from espagent.tools.tool_cache import ToolResultCache
+
+        (tmp_path / "project").mkdir()
+        (tmp_path / "project" / "sdkconfig").write_text("CONFIG_IDF_TARGET=esp32\n")
+        (tmp_path / "elsewhere").mkdir()
+        monkeypatch.chdir(tmp_path / "elsewhere")
+        cache = ToolResultCache(project_dir=None)
+        cache.configure("espagent", {"idf_size": ["sdkconfig"]})
+        handler = self._handler()
+
+        await cache.intercept(self._request(), handler)
+        await cache.intercept(self._request(), handler)
+
+        assert handler.await_count == 2
+        assert cache.stats()["uncacheable"] == 2
+        assert cache.stats()["size"] == 0
+
+    def test_console_resolves_globs_against_launch_directory(self, tmp_path, monkeypatch):
+        from espagent import cli
+        from espagent.tools.tool_cache import tool_cache
+
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(tool_cache, "project_dir", None)
+        monkeypatch.setattr(cli, "parse_args", MagicMock())
+        monkeypatch.setattr(cli.asyncio, "run", MagicMock())
+        monkeypatch.setattr(cli, "cli_main", MagicMock())
+        monkeypatch.setattr(cli.os, "chdir", MagicMock())
+
+        cli.main()
+
+        assert tool_cache.project_dir == str(tmp_path)
@@ -1,9 +1,12 @@
 """Tests for espagent.utils module - meaningful validation only."""
 
+import os
+
 import pytest
 from pydantic import ValidationError
 
 from espagent.utils import SSHState, UserInfo
+from espagent.utils.embeddings import HashingEmbeddings
 
 
 class TestUserInfo:
@@ -40,3 +43,727 @@ class TestSSHState:
         ssh = SSHState(host="localhost", user="testuser", passwd=12345, port=22, command="ls -la")
         assert ssh.host == "localhost"
         assert ssh.port == 22
+
+
+class TestHashingEmbeddings:
+    """Test offline embeddings - validates determinism and similarity."""
+
+    def test_embeddings_are_deterministic_and_normalized(self):
+        """Test the same text always maps to the same unit vector.
+
+        Tests and stored pgvector indexes rely on reproducible vectors.
+        """
+        vector = HashingEmbeddings(dims=64).embed_query("ESP32 UART flashing")
+
+        assert vector == HashingEmbeddings(dims=64).embed_query("ESP32 UART flashing")
+        assert len(vector) == 64
+        assert sum(v * v for v in vector) == pytest.approx(1.0)
+
+    def test_shared_terms_score_higher(self):
+        """Test related texts (including Chinese) are closer than unrelated ones."""
+        embeddings = HashingEmbeddings()
+
+        def similarity(a, b):
+            return sum(x * y for x, y in zip(*embeddings.embed_documents([a, b]), strict=True))
+
+        assert similarity("串口调试 UART", "UART 串口") > similarity("串口调试 UART", "WiFi 配网")
+
+
+class TestTokenLedger:
+    """Test incremental token counting matches a full recount."""
+
+    def test_ledger_matches_full_count_and_counts_each_message_once(self):
+        from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+        from langchain_core.messages.utils import count_tokens_approximately
+
+        from espagent.utils.tokens import TokenLedger
+
+        messages = [
+            HumanMessage("编译 hello_world 并烧录", id="h"),
+            AIMessage("", id="a", tool_calls=[{"name": "idf_build", "args": {}, "id": "c1"}]),
+            ToolMessage("[100%] Built target app\n" * 200, id="t", tool_call_id="c1"),
+        ]
+        ledger = TokenLedger()
+
+        assert ledger.count(messages) == count_tokens_approximately(messages)
+        ledger.count([*messages, AIMessage("完成", id="done")])
+
+        assert ledger.stats() == {"messages": 4, "hits": 3, "misses": 4}
+
+    def test_message_edited_in_place_is_recounted(self):
+        from langchain_core.messages import AIMessage
+        from langchain_core.messages.utils import count_tokens_approximately
+
+        from espagent.utils.tokens import TokenLedger
+
+        call = {"name": "write_file", "args": {"content": "x"}, "id": "c1"}
+        message = AIMessage("", id="a", tool_calls=[call])
+        ledger = TokenLedger()
+        ledger.count([message])
+
+        # An approval edit replaces the args but keeps the message ID
+        edited = message.model_copy(
+            update={"tool_calls": [{**call, "args": {"content": "y" * 4000}}]}
+        )
+
+        assert ledger.count([edited]) == count_tokens_approximately([edited])
+        assert ledger.count([edited]) > ledger.count([message])
+
+
+class TestSQLiteLLMCache:
+    """Test identical temperature-0 requests are answered from disk."""
+
+    def _model(self, cache, *replies):
+        from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+        from langchain_core.messages import AIMessage
+
+        return GenericFakeChatModel(messages=iter(AIMessage(r) for r in replies), cache=cache)
+
+    def test_repeated_prompt_is_served_from_cache_across_instances(self, tmp_path):
+        """Test a hit skips the model and survives a restart (new cache instance)."""
+        from espagent.utils.llm_cache import SQLiteLLMCache
+
+        cache = SQLiteLLMCache(tmp_path / "llm.sqlite")
+        model = self._model(cache, "first", "second")
+
+        assert model.invoke("size of hello_world?").content == "first"
+        assert model.invoke("size of hello_world?").content == "first"
+        assert model.invoke("another question").content == "second"
+        assert cache.stats()["hits"] == 1
+
+        reopened = SQLiteLLMCache(tmp_path / "llm.sqlite")
+        assert self._model(reopened).invoke("size of hello_world?").content == "first"
+        assert reopened.stats()["entries"] == 2
+
+    def test_least_recently_used_entries_are_evicted(self, tmp_path):
+        from langchain_core.outputs import Generation
+
+        from espagent.utils.llm_cache import SQLiteLLMCache
+
+        cache = SQLiteLLMCache(tmp_path / "llm.sqlite", max_entries=3)
+        for i in range(3):
+            cache.update(f"prompt {i}", "model", [Generation(text=str(i))])
+        cache.lookup("prompt 0", "model")  # keep the oldest entry warm
+        cache.update("prompt 3", "model", [Generation(text="3")])
+
+        assert cache.lookup("prompt 0", "model") is not None
+        assert cache.lookup("prompt 1", "model") is None
+        assert cache.stats()["entries"] <= 3
+
+
+class TestCompactCheckpoints:
+    """Test checkpoint payloads shrink without changing what is loaded back."""
+
+    def test_compressed_serializer_round_trip_and_reads_old_rows(self):
+        from langchain_core.messages import ToolMessage
+        from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+        from espagent.utils.checkpoint import compressed_serializer
+
+        serde = compressed_serializer()
+        messages = [ToolMessage("I (123) wifi: connected\n" * 500, tool_call_id="c1")]
+
+        type_, data = serde.dumps_typed(messages)
+        assert type_.endswith(("+zstd", "+zlib"))
+        assert len(data) < len(JsonPlusSerializer().dumps_typed(messages)[1]) / 10
+        assert serde.loads_typed((type_, data)) == messages
+        # Rows written by the plain AsyncPostgresSaver still load
+        assert serde.loads_typed(JsonPlusSerializer().dumps_typed(messages)) == messages
+
+    def test_large_tool_outputs_are_offloaded_once_and_restored(self):
+        from langchain_core.messages import AIMessage, ToolMessage
+
+        from espagent.utils.checkpoint import collect_refs, offload_messages, restore_messages
+
+        log = ToolMessage("E (42) boot: flash read err\n" * 300, id="t1", tool_call_id="c1")
+        history = [AIMessage("", id="a1"), log, ToolMessage("ok", id="t2", tool_call_id="c2")]
+
+        first, blobs = offload_messages(history, min_chars=1000)
+        # The next checkpoint carries the same output again under the same digest
+        _, again = offload_messages([*history, AIMessage("done", id="a2")], min_chars=1000)
+
+        assert len(first[1].content) < 100
+        assert first[0] is history[0] and first[2] is history[2]
+        assert blobs.keys() == again.keys() == collect_refs(first)
+        assert restore_messages(first, blobs) == history
+
+    def test_langgraph_prune_contract_is_kept(self):
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+
+        from espagent.utils.checkpoint import CompactPostgresSaver
+
+        assert CompactPostgresSaver.prune is AsyncPostgresSaver.prune
+        assert CompactPostgresSaver.aprune is AsyncPostgresSaver.aprune
+
+    @pytest.mark.asyncio
+    async def test_checkpoint_is_written_with_references(self):
+        """Test aput stores outputs separately and hands placeholders to Postgres."""
+        from unittest.mock import AsyncMock, MagicMock, patch
+
+        from langchain_core.messages import ToolMessage
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+
+        from espagent.utils.checkpoint import BLOB_KEY, CompactPostgresSaver
+
+        saver = CompactPostgresSaver(MagicMock(), blob_min_chars=100)
+        saver._store = AsyncMock()
+        output = ToolMessage("x" * 500, id="t", tool_call_id="c")
+        checkpoint = {"channel_values": {"messages": [output], "user_id": "esp"}}
+
+        with patch.object(AsyncPostgresSaver, "aput", AsyncMock()) as base_put:
+            await saver.aput({}, checkpoint, {}, {"messages": "2"})
+
+        [stored] = base_put.await_args.args[1]["channel_values"]["messages"]
+        blobs, refs = saver._store.await_args.args
+        assert blobs == {stored.additional_kwargs[BLOB_KEY]: "x" * 500}
+        assert refs == set(blobs)
+        assert checkpoint["channel_values"]["messages"] == [output]
+
+    @pytest.mark.asyncio
+    @pytest.mark.skipif(
+        not os.getenv("ESPAGENT_TEST_DATABASE_URL"),
+        reason="set ESPAGENT_TEST_DATABASE_URL to a scratch Postgres database",
+    )
+    async def test_prune_archive_and_restore_on_postgres(self):
+        """Test retention and cold storage SQL against a real database.
+
+        A column added to the hot table after a thread was archived (as a
+        langgraph migration would) must not break restoring it.
+        """
+        import uuid
+
+        from langchain_core.messages import HumanMessage, ToolMessage
+        from langgraph.graph import START, MessagesState, StateGraph
+        from psycopg import AsyncConnection
+        from psycopg.rows import dict_row
+
+        from espagent.utils.checkpoint import THREAD_TABLES, CompactPostgresSaver
+
+        def run_tool(state: MessagesState) -> dict:
+            return {"messages": [ToolMessage("I (42) wifi: connected\n" * 400, tool_call_id="c")]}
+
+        conn = await AsyncConnection.connect(
+            os.environ["ESPAGENT_TEST_DATABASE_URL"],
+            autocommit=True,
+            prepare_threshold=0,
+            row_factory=dict_row,
+        )
+        saver = CompactPostgresSaver(conn, blob_min_chars=1000)
+        await saver.setup()
+        builder = StateGraph(MessagesState)
+        builder.add_node("tool", run_tool)
+        builder.add_edge(START, "tool")
+        graph = builder.compile(checkpointer=saver)
+        thread_id = f"test-{uuid.uuid4()}"
+        config = {"configurable": {"thread_id": thread_id}}
+        try:
+            for i in range(3):
+                await graph.ainvoke({"messages": [HumanMessage(f"run {i}")]}, config)
+
+            report = await saver.apply_retention(keep_last=2, max_age_days=0)
+            assert report.checkpoints > 0
+            assert len([c async for c in saver.alist(config)]) == 2
+
+            assert await saver.archive_thread(thread_id) == 2
+            assert (await graph.aget_state(config)).values == {}
+            await conn.execute(
+                "ALTER TABLE checkpoints ADD COLUMN espagent_test TEXT NOT NULL DEFAULT 'x'"
+            )
+            assert await saver.restore_thread(thread_id) == 2
+
+            messages = (await graph.aget_state(config)).values["messages"]
+            assert len(messages) == 6
+            assert messages[-1].content == "I (42) wifi: connected\n" * 400
+
+            # Setting up again gives the archive the new column
+            await saver.setup()
+            async with conn.cursor() as cur:
+                assert "espagent_test" in await saver._columns(cur, "checkpoints_archive")
+        finally:
+            for table in (*THREAD_TABLES, *(f"{t}_archive" for t in THREAD_TABLES)):
+                await conn.execute(f"DELETE FROM {table} WHERE thread_id = %s", (thread_id,))
+            for table in ("checkpoints", "checkpoints_archive"):
+                await conn.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS espagent_test")
+            await conn.close()
+
+
+class TestSessionManager:
+    """Test each launch gets its own thread and past sessions can be resumed."""
+
+    def _manager(self):
+        from unittest.mock import AsyncMock, MagicMock
+
+        from langgraph.store.memory import InMemoryStore
+
+        from espagent.utils.sessions import SessionManager
+
+        checkpointer = MagicMock(archive_thread=AsyncMock(), restore_thread=AsyncMock())
+        return SessionManager(InMemoryStore(), checkpointer, "esp")
+
+    @pytest.mark.asyncio
+    async def test_sessions_are_listed_after_their_first_turn(self):
+        sessions = self._manager()
+        first = sessions.thread_id
+        assert await sessions.list() == []
+
+        await sessions.record_turn("flash   the blink example\n to the board")
+        sessions.new()
+        await sessions.record_turn("check heap usage")
+
+        listed = await sessions.list()
+        assert [session.title for session in listed] == [
+            "check heap usage",
+            "flash the blink example to the board",
+        ]
+        assert sessions.thread_id != first
+        assert (await sessions.resume("2")).thread_id == first
+        assert sessions.thread_id == first
+
+    @pytest.mark.asyncio
+    async def test_archive_moves_thread_to_cold_storage_and_resume_restores_it(self):
+        sessions = self._manager()
+        archived_id = sessions.thread_id
+        await sessions.record_turn("debug the i2c driver")
+
+        archived = await sessions.archive()
+
+        sessions.checkpointer.archive_thread.assert_awaited_once_with(archived_id)
+        assert archived.archived
+        assert sessions.thread_id != archived_id
+
+        await sessions.resume(archived_id[:-2])
+        sessions.checkpointer.restore_thread.assert_awaited_once_with(archived_id)
+        assert not (await sessions.list())[0].archived
+
+
+class TestPoolMonitor:
+    """Test pool statistics and background health checks."""
+
+    def _pool(self, **stats):
+        from unittest.mock import AsyncMock, MagicMock
+
+        pool = MagicMock(check=AsyncMock())
+        pool.get_stats.return_value = {"pool_size": 2, "pool_available": 1, **stats}
+        return pool
+
+    def test_stats_report_checkouts_and_average_wait(self):
+        from espagent.utils.db_pool import PoolMonitor
+
+        monitor = PoolMonitor(interval=0)
+        monitor.attach(self._pool(requests_num=4, requests_wait_ms=10, connections_errors=1))
+
+        stats = monitor.stats()
+        assert stats["checkouts"] == 4
+        assert stats["wait_ms_avg"] == 2.5
+        assert stats["errors"] == 1
+        assert stats["size"] == 2
+
+    @pytest.mark.asyncio
+    async def test_idle_connections_are_checked_periodically(self):
+        import asyncio
+
+        from espagent.utils.db_pool import PoolMonitor
+
+        pool = self._pool()
+        monitor = PoolMonitor(interval=0.02)
+        monitor.attach(pool)
+        await asyncio.sleep(0.07)
+        await monitor.aclose()
+
+        assert pool.check.await_count >= 2
+        assert monitor.stats()["checks"] == pool.check.await_count
+
+    @pytest.mark.asyncio
+    async def test_pool_is_warmed_up_with_prepared_statements(self):
+        from unittest.mock import AsyncMock, patch
+
+        from espagent.utils import db_pool
+
+        pool = self._pool()
+        pool.open = AsyncMock()
+        pool.wait = AsyncMock(side_effect=db_pool.PoolTimeout())
+        with (
+            patch.object(db_pool, "AsyncConnectionPool", return_value=pool) as factory,
+            patch.object(db_pool, "pool_monitor", db_pool.PoolMonitor(interval=0)),
+        ):
+            # A warm-up timeout is logged, not raised
+            assert await db_pool.open_pool("postgresql://db", min_size=3) is pool
+
+        options = factory.call_args.kwargs
+        assert options["min_size"] == 3
+        assert options["kwargs"]["prepare_threshold"] == 0
+        pool.wait.assert_awaited_once()
+
+
+def _streaming_agent(replies, tools, middleware=()):
+    """Agent over a fake model that streams word by word, tool calls in one chunk."""
+    import json
+
+    from langchain.agents import create_agent
+    from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+    from langchain_core.messages import AIMessageChunk
+    from langchain_core.outputs import ChatGenerationChunk
+    from langgraph.checkpoint.memory import InMemorySaver
+
+    class ScriptedModel(GenericFakeChatModel):
+        def bind_tools(self, tools, **kwargs):
+            return self
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            message = self._generate(messages).generations[0].message
+            chunks = [AIMessageChunk(content=word) for word in message.text.split(" ")[:1]]
+            chunks += [AIMessageChunk(content=f" {word}") for word in message.text.split()[1:]]
+            chunks += [
+                AIMessageChunk(
+                    content="",
+                    tool_call_chunks=[
+                        {**call, "args": json.dumps(call["args"]), "index": i}
+                        for i, call in enumerate(message.tool_calls)
+                    ],
+                )
+            ]
+            for chunk in chunks:
+                yield ChatGenerationChunk(message=chunk)
+
+    return create_agent(
+        model=ScriptedModel(messages=iter(replies)),
+        tools=tools,
+        middleware=list(middleware),
+        checkpointer=InMemorySaver(),
+    )
+
+
+class TestStreamTurn:
+    """Test answers are printed token by token and interrupts come from the stream."""
+
+    def _agent(self, *replies, interrupt_on=None):
+        from langchain.agents.middleware import HumanInTheLoopMiddleware
+        from langchain_core.tools import tool
+
+        @tool
+        def idf_size() -> str:
+            """Report the firmware size."""
+            return "Total image size: 182 KB"
+
+        middleware = [HumanInTheLoopMiddleware(interrupt_on=interrupt_on)] if interrupt_on else []
+        return _streaming_agent(replies, [idf_size], middleware)
+
+    @pytest.mark.asyncio
+    async def test_tokens_and_tool_events_are_printed_as_they_arrive(self):
+        import io
+
+        from langchain_core.messages import AIMessage
+
+        from espagent.utils.streaming import stream_turn
+
+        call = {"name": "idf_size", "args": {}, "id": "c1"}
+        agent = self._agent(
+            AIMessage("", tool_calls=[call]), AIMessage("The image is 182 KB in total")
+        )
+        out = io.StringIO()
+
+        result = await stream_turn(
+            agent, {"messages": [("user", "size?")]}, {"configurable": {"thread_id": "t"}}, out
+        )
+
+        printed = out.getvalue()
+        assert "[Calling tool]: idf_size" in printed
+        assert "[Tool finished]: idf_size" in printed
+        assert "🤖 Agent: The image is 182 KB in total" in printed
+        assert result.first_token is not None and result.first_token <= result.duration
+        assert result.interrupts == []
+
+    @pytest.mark.asyncio
+    async def test_cached_answer_is_printed_once(self):
+        """Test an LLM cache hit (one complete message, no chunks) is printed and timed."""
+        import io
+
+        from langchain_core.caches import InMemoryCache
+        from langchain_core.globals import get_llm_cache, set_llm_cache
+        from langchain_core.messages import AIMessage
+
+        from espagent.utils.streaming import stream_turn
+
+        # One reply: the second turn is answered from the cache
+        agent = _streaming_agent([AIMessage("hello world")], [])
+        previous = get_llm_cache()
+        set_llm_cache(InMemoryCache())
+        try:
+            for thread_id in ("t1", "t2"):
+                out = io.StringIO()
+                result = await stream_turn(
+                    agent,
+                    {"messages": [("user", "hi")]},
+                    {"configurable": {"thread_id": thread_id}},
+                    out,
+                )
+                assert out.getvalue() == "🤖 Agent: hello world\n"
+                assert result.first_token is not None
+        finally:
+            set_llm_cache(previous)
+
+    @pytest.mark.asyncio
+    async def test_tool_selector_output_is_not_printed_as_the_answer(self):
+        import io
+
+        from langchain_core.messages import AIMessage
+        from langchain_core.tools import tool
+
+        from espagent.middlewares import LocalToolSelectorMiddleware
+        from espagent.utils.streaming import stream_turn
+
+        @tool
+        def idf_size() -> str:
+            """Report firmware image size and free IRAM/DRAM."""
+            return "182 KB"
+
+        @tool
+        def idf_flash() -> str:
+            """Flash the built firmware to a connected ESP32 board."""
+            return "flashed"
+
+        selection = AIMessage(
+            '{"tools": ["idf_size"]}',
+            tool_calls=[
+                {"name": "ToolSelectionResponse", "args": {"tools": ["idf_size"]}, "id": "s1"}
+            ],
+        )
+        # No tool matches the query locally, so the LLM fallback runs in the model node
+        agent = _streaming_agent(
+            [selection, AIMessage("hello world")],
+            [idf_size, idf_flash],
+            [LocalToolSelectorMiddleware(max_tools=1)],
+        )
+        out = io.StringIO()
+
+        result = await stream_turn(
+            agent,
+            {"messages": [("user", "固件占用了多少内存")]},
+            {"configurable": {"thread_id": "t"}},
+            out,
+        )
+
+        assert "tools" not in out.getvalue()
+        assert "🤖 Agent: hello world" in out.getvalue()
+        assert result.first_token is not None
+
+    @pytest.mark.asyncio
+    async def test_interrupt_is_reported_and_resumed_without_state_load(self):
+        import io
+        from unittest.mock import AsyncMock, MagicMock, patch
+
+        from langchain_core.messages import AIMessage
+
+        from espagent.utils import HumanInTheLoop
+        from espagent.utils.approval import ApprovalPolicy
+        from espagent.utils.streaming import stream_turn
+
+        call = {"name": "idf_size", "args": {}, "id": "c1"}
+        agent = self._agent(
+            AIMessage("", tool_calls=[call]),
+            AIMessage("done"),
+            interrupt_on={"idf_size": True},
+        )
+        config = {"configurable": {"thread_id": "t"}}
+
+        result = await stream_turn(agent, {"messages": [("user", "size?")]}, config, io.StringIO())
+        [interrupt] = result.interrupts
+        assert interrupt.value["action_requests"][0]["name"] == "idf_size"
+
+        terminal = MagicMock(prompt=AsyncMock(return_value="y"))
+        policy = ApprovalPolicy(audit_path=None)
+        with patch.object(agent, "aget_state") as load:
+            assert await HumanInTheLoop(terminal, policy).handle_interrupts(
+                agent, result.interrupts, config
+            )
+        load.assert_not_called()
+
+        messages = (await agent.aget_state(config)).values["messages"]
+        assert messages[-2].content == "Total image size: 182 KB"
+
+    @pytest.mark.asyncio
+    async def test_only_allowed_decisions_are_offered(self, capsys):
+        import io
+        from unittest.mock import AsyncMock, MagicMock
+
+        from langchain_core.messages import AIMessage
+
+        from espagent.utils import HumanInTheLoop
+        from espagent.utils.approval import ApprovalPolicy
+        from espagent.utils.streaming import stream_turn
+
+        call = {"name": "idf_size", "args": {}, "id": "c1"}
+        agent = self._agent(
+            AIMessage("", tool_calls=[call]),
+            AIMessage("done"),
+            interrupt_on={"idf_size": {"allowed_decisions": ["approve", "reject"]}},
+        )
+        config = {"configurable": {"thread_id": "t"}}
+        result = await stream_turn(agent, {"messages": [("user", "size?")]}, config, io.StringIO())
+
+        # Edit is neither offered nor accepted
+        terminal = MagicMock(prompt=AsyncMock(side_effect=["e", "y"]))
+        policy = ApprovalPolicy(audit_path=None)
+        await HumanInTheLoop(terminal, policy).handle_interrupts(agent, result.interrupts, config)
+
+        prompts = [c.args[0] for c in terminal.prompt.await_args_list]
+        assert len(prompts) == 2
+        assert "(e)dit" not in prompts[0]
+        assert "Invalid input" in capsys.readouterr().out
+        messages = (await agent.aget_state(config)).values["messages"]
+        assert messages[-2].content == "Total image size: 182 KB"
+
+    @pytest.mark.asyncio
+    async def test_cancelled_turn_leaves_no_unanswered_tool_calls(self):
+        import io
+
+        from langchain_core.messages import AIMessage
+
+        from espagent.utils.streaming import close_cancelled_turn, stream_turn
+
+        call = {"name": "idf_size", "args": {}, "id": "c1"}
+        agent = self._agent(
+            AIMessage("", tool_calls=[call]), AIMessage("ok"), interrupt_on={"idf_size": True}
+        )
+        config = {"configurable": {"thread_id": "t"}}
+        # The turn is dropped while its approval is pending
+        await stream_turn(agent, {"messages": [("user", "size?")]}, config, io.StringIO())
+
+        assert await close_cancelled_turn(agent, config) == 1
+        assert await close_cancelled_turn(agent, config) == 0
+
+        result = await stream_turn(agent, {"messages": [("user", "hi")]}, config, io.StringIO())
+        messages = (await agent.aget_state(config)).values["messages"]
+        assert [m.type for m in messages] == ["human", "ai", "tool", "human", "ai"]
+        assert messages[2].status == "error"
+        assert result.interrupts == []
+
+
+class TestApprovalPolicy:
+    """Test rule and session approvals answer gated calls without the user."""
+
+    RULES = [
+        {"tool": "read_file", "action": "allow", "paths": ["main/*"]},
+        {"tool": "ssh_run", "action": "allow", "hosts": ["devkit-*"], "commands": ["idf.py *"]},
+        {"tool": "ssh_run", "action": "deny", "commands": ["*rm -rf*"], "reason": "destructive"},
+    ]
+
+    def _policy(self, tmp_path):
+        import json
+
+        from espagent.utils.approval import ApprovalPolicy, load_rules
+
+        path = tmp_path / "policy.json"
+        # The rule with an unknown action is skipped
+        path.write_text(json.dumps({"rules": [*self.RULES, {"tool": "x", "action": "maybe"}]}))
+        return ApprovalPolicy(load_rules(path), audit_path=tmp_path / "audit.jsonl")
+
+    def test_rules(self, tmp_path):
+        policy = self._policy(tmp_path)
+        assert len(policy.rules) == 3
+
+        def action(name, **args):
+            rule = policy.evaluate(name, args)
+            return rule.action if rule else None
+
+        assert action("read_file", file_path="/main/app.c") == "allow"
+        assert action("read_file", file_path="/secrets/key.pem") is None
+        # Allow rules never match path escapes or chained commands
+        assert action("read_file", file_path="/main/../../etc/passwd") is None
+        assert action("ssh_run", host="devkit-1", command="idf.py size") == "allow"
+        assert action("ssh_run", host="devkit-1", command="idf.py size; reboot") is None
+        assert action("ssh_run", host="prod", command="idf.py size") is None
+        # Deny wins over allow
+        assert action("ssh_run", host="devkit-1", command="idf.py fullclean && rm -rf /") == "deny"
+
+    def test_fan_out_calls_are_scoped_to_their_hosts(self, tmp_path):
+        policy = self._policy(tmp_path)
+        rigs = {"name": "ssh_run_many", "args": {"hosts": ["rig-2", "rig-1"], "command": "uptime"}}
+        prod = {"name": "ssh_run_many", "args": {"hosts": ["prod-1"], "command": "uptime"}}
+
+        policy.grant(rigs, "t")
+
+        assert policy.grants("t") == ["ssh_run_many of 'uptime' on rig-1, rig-2"]
+        assert policy.decide(prod, "t") is None
+        reordered = {
+            "name": "ssh_run_many",
+            "args": {"hosts": ["rig-1", "rig-2"], "command": "uptime"},
+        }
+        assert policy.decide(reordered, "t") == {"type": "approve"}
+
+        # Allow rules need every host to match, deny rules any of them
+        mixed = {"hosts": ["devkit-1", "prod-1"], "command": "idf.py size"}
+        assert policy.evaluate("ssh_run", mixed) is None
+        deny = policy.evaluate("ssh_run", {"hosts": ["devkit-1", "prod-1"], "command": "rm -rf /"})
+        assert deny.action == "deny"
+
+    @pytest.mark.asyncio
+    async def test_gated_calls_are_decided_by_rules_batch_and_session(self, tmp_path):
+        import io
+        import json
+        from unittest.mock import AsyncMock, MagicMock
+
+        from langchain.agents.middleware import HumanInTheLoopMiddleware
+        from langchain_core.messages import AIMessage
+        from langchain_core.tools import tool
+
+        from espagent.utils import HumanInTheLoop
+        from espagent.utils.streaming import stream_turn
+
+        @tool
+        def read_file(file_path: str) -> str:
+            """Read a file."""
+            return f"contents of {file_path}"
+
+        @tool
+        def ssh_run(host: str, command: str) -> str:
+            """Run a command over SSH."""
+            return "ran"
+
+        calls = [
+            {"name": "read_file", "args": {"file_path": "/main/app.c"}, "id": "c1"},
+            {"name": "read_file", "args": {"file_path": "/docs/a.md"}, "id": "c2"},
+            {"name": "read_file", "args": {"file_path": "/docs/b.md"}, "id": "c3"},
+            {"name": "ssh_run", "args": {"host": "devkit-1", "command": "rm -rf /"}, "id": "c4"},
+        ]
+        policy = self._policy(tmp_path)
+        gated = {"allowed_decisions": ["approve", "edit", "reject"]}
+        middleware = HumanInTheLoopMiddleware(
+            interrupt_on=policy.interrupt_on({"read_file": gated, "ssh_run": gated})
+        )
+        agent = _streaming_agent(
+            [AIMessage("", tool_calls=calls), AIMessage("done")], [read_file, ssh_run], [middleware]
+        )
+        config = {"configurable": {"thread_id": "t"}}
+
+        result = await stream_turn(agent, {"messages": [("user", "look")]}, config, io.StringIO())
+        [interrupt] = result.interrupts
+        # The allowed read never reaches the user
+        assert [r["args"] for r in interrupt.value["action_requests"]] == [
+            call["args"] for call in calls[1:]
+        ]
+
+        # Both pending reads are approved for the session in one prompt
+        terminal = MagicMock(prompt=AsyncMock(return_value="s"))
+        await HumanInTheLoop(terminal, policy).handle_interrupts(agent, result.interrupts, config)
+        terminal.prompt.assert_awaited_once()
+
+        messages = (await agent.aget_state(config)).values["messages"]
+        results = {m.tool_call_id: m for m in messages if m.type == "tool"}
+        assert results["c1"].content == "contents of /main/app.c"
+        assert results["c3"].content == "contents of /docs/b.md"
+        assert "destructive" in results["c4"].content
+
+        later = {"name": "read_file", "args": {"file_path": "/docs/c.md"}}
+        assert policy.decide(later, "t") == {"type": "approve"}
+        assert policy.decide(later, "other thread") is None
+
+        audit = [json.loads(line) for line in (tmp_path / "audit.jsonl").read_text().splitlines()]
+        sources = sorted((entry["source"], entry["decision"]) for entry in audit)
+        assert sources == [
+            ("rule", "approve"),
+            ("rule", "reject"),
+            ("session", "approve"),
+            ("user", "approve"),
+            ("user", "approve"),
+        ]
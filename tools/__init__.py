@@ -1,12 +1,18 @@
 """Tools module for espagent."""
 
+from .jobs import ssh_job_cancel, ssh_job_output, ssh_job_start, ssh_job_status
 from .mcp import get_mcp_tools
 from .memory import recall_memory, save_memory
-from .ssh import ssh_run
+from .ssh import ssh_run, ssh_run_many
 
 __all__ = [
     "get_mcp_tools",
     "recall_memory",
     "save_memory",
+    "ssh_job_cancel",
+    "ssh_job_output",
+    "ssh_job_start",
+    "ssh_job_status",
     "ssh_run",
+    "ssh_run_many",
 ]
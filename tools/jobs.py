@@ -0,0 +1,308 @@
+"""Background jobs for long-running remote commands.
+
+A job runs detached on the remote host (``nohup setsid``) and writes its
+combined output and exit code to ``~/.espagent/jobs/<job_id>/``. Only job
+metadata is kept locally, in the LangGraph store, so jobs keep running and
+stay reachable across CLI restarts.
+"""
+
+import base64
+import binascii
+import logging
+import re
+import shlex
+import time
+import uuid
+
+from langchain.tools import ToolRuntime, tool
+
+from espagent.tools.ssh import run_remote
+
+logger = logging.getLogger(__name__)
+
+JOB_ROOT = ".espagent/jobs"
+JOB_CONTROL_TIMEOUT = 30.0
+JOB_OUTPUT_LIMIT = 8000
+# Printed by the start script; login banners or MOTDs may surround it on stdout
+_PID_MARKER = "ESPAGENT_JOB_PID="
+_PID_LINE = re.compile(rf"^{_PID_MARKER}(\d+)$", re.MULTILINE)
+# Lines around the base64 payload of ssh_job_output, for the same reason
+_OUTPUT_BEGIN = "ESPAGENT_JOB_OUTPUT_BEGIN"
+_OUTPUT_END = "ESPAGENT_JOB_OUTPUT_END"
+_OUTPUT_PAYLOAD = re.compile(rf"^{_OUTPUT_BEGIN}\n(.*?)^{_OUTPUT_END}$", re.MULTILINE | re.DOTALL)
+
+
+def _job_namespace(runtime: ToolRuntime) -> tuple[str, str]:
+    """Jobs are isolated per user, like memories."""
+    user_id = runtime.state.get("user_id", "unknown_user")
+    return ("ssh_jobs", user_id)
+
+
+def _start_script(job_dir: str, command: str) -> str:
+    """Build the remote shell snippet that launches a detached job.
+
+    The exit code is written through a temp file so readers never see a
+    partially written value; ``setsid`` makes the job's pid its process group.
+    """
+    body = (
+        f"sh -c {shlex.quote(command)}; "
+        f"echo $? > {job_dir}/exit.tmp && mv {job_dir}/exit.tmp {job_dir}/exit"
+    )
+    return (
+        f"mkdir -p {job_dir} && "
+        f"nohup setsid sh -c {shlex.quote(body)} > {job_dir}/out.log 2>&1 < /dev/null & "
+        f'echo "{_PID_MARKER}$!"'
+    )
+
+
+def _output_script(job_dir: str, offset: int, limit: int) -> str:
+    """Build the remote snippet printing up to ``limit`` log bytes from ``offset``.
+
+    base64 keeps byte offsets exact even if a chunk splits a UTF-8 sequence.
+    """
+    return (
+        f"echo {_OUTPUT_BEGIN}; "
+        f"tail -c +{offset + 1} {job_dir}/out.log | head -c {limit} | base64; "
+        f"echo {_OUTPUT_END}"
+    )
+
+
+def _status_script(job_dir: str, pid: int) -> str:
+    """Build the remote snippet printing ``<state> <exit_code> <output_bytes>``."""
+    return (
+        f"if [ -f {job_dir}/exit ]; then state=exited; code=$(cat {job_dir}/exit); "
+        f"elif kill -0 {pid} 2>/dev/null; then state=running; code=-; "
+        "else state=lost; code=-; fi; "
+        f'echo "$state $code $(wc -c < {job_dir}/out.log 2>/dev/null || echo 0)"'
+    )
+
+
+async def _refresh(record: dict) -> dict:
+    """Update a job record with its current remote state."""
+    if record["status"] not in ("running", "unknown"):
+        return record
+    result = await run_remote(
+        record["host"],
+        _status_script(record["remote_dir"], record["pid"]),
+        timeout=JOB_CONTROL_TIMEOUT,
+    )
+    if not result.ok:
+        # Host unreachable right now; the job itself may still be fine
+        record["status"] = "unknown"
+        return record
+
+    try:
+        state, code, size = result.stdout.split()
+        record["output_bytes"] = int(size)
+    except ValueError:
+        logger.warning(f"Unexpected job status for {record['job_id']}: {result.stdout!r}")
+        record["status"] = "unknown"
+        return record
+    if state == "exited":
+        record["status"] = "succeeded" if code == "0" else "failed"
+        record["exit_code"] = int(code)
+        record["finished_at"] = record.get("finished_at") or time.time()
+    elif state == "lost":
+        record["status"] = "lost"
+    else:
+        record["status"] = "running"
+    return record
+
+
+def _describe(record: dict) -> str:
+    """Format one job record for the model."""
+    elapsed = (record.get("finished_at") or time.time()) - record["started_at"]
+    line = (
+        f"- {record['job_id']} [{record['status']}] on {record['host']}: "
+        f"{record['command']} ({elapsed:.0f}s, {record.get('output_bytes', 0)} bytes output"
+    )
+    if record.get("exit_code") is not None:
+        line += f", exit {record['exit_code']}"
+    return line + ")"
+
+
+@tool
+async def ssh_job_start(host: str, command: str, runtime: ToolRuntime = None) -> str:
+    """Start a long-running command on a remote host as a background job.
+
+    The command keeps running on the host after this tool returns, so builds
+    and flash-and-monitor runs do not block the conversation. Use
+    ssh_job_status / ssh_job_output to follow it and ssh_job_cancel to stop it.
+
+    Args:
+        host: The Host name from SSH configuration
+        command: The command to execute
+
+    Returns:
+        The job ID, or an error message if the job could not be started
+    """
+    store = runtime.store
+    if store is None:
+        return "Error: Store not configured, cannot track background jobs"
+
+    job_id = uuid.uuid4().hex[:12]
+    job_dir = f"{JOB_ROOT}/{job_id}"
+    result = await run_remote(host, _start_script(job_dir, command), timeout=JOB_CONTROL_TIMEOUT)
+    if not result.ok:
+        return f"Failed to start job on {host}: {result.stderr.strip()}"
+    match = _PID_LINE.search(result.stdout)
+    if match is None:
+        logger.warning(f"No job pid in start output on {host}: {result.stdout!r}")
+        return (
+            f"Failed to start job on {host}: could not read the job's pid, "
+            f"it may still be running with output in ~/{job_dir}"
+        )
+
+    record = {
+        "job_id": job_id,
+        "host": host,
+        "command": command,
+        "pid": int(match.group(1)),
+        "remote_dir": job_dir,
+        "status": "running",
+        "exit_code": None,
+        "output_bytes": 0,
+        "started_at": time.time(),
+        "finished_at": None,
+    }
+    await store.aput(_job_namespace(runtime), job_id, record)
+    return f"Started job {job_id} on {host}: {command}"
+
+
+@tool
+async def ssh_job_status(job_id: str | None = None, runtime: ToolRuntime = None) -> str:
+    """Show the status of background jobs.
+
+    Args:
+        job_id: Job to inspect; all jobs of the user are listed when omitted
+
+    Returns:
+        One line per job with state, runtime, output size and exit code
+    """
+    store = runtime.store
+    if store is None:
+        return "Error: Store not configured, cannot track background jobs"
+
+    namespace = _job_namespace(runtime)
+    if job_id is not None:
+        item = await store.aget(namespace, job_id)
+        if item is None:
+            return f"No job with ID '{job_id}'"
+        records = [item.value]
+    else:
+        records = [item.value for item in await store.asearch(namespace, limit=50)]
+        if not records:
+            return "No background jobs"
+
+    lines = []
+    for record in sorted(records, key=lambda r: r["started_at"], reverse=True):
+        previous = record["status"]
+        record = await _refresh(record)
+        if record["status"] != previous:
+            await store.aput(namespace, record["job_id"], record)
+        lines.append(_describe(record))
+    return "\n".join(lines)
+
+
+@tool
+async def ssh_job_output(
+    job_id: str,
+    offset: int = 0,
+    limit: int = JOB_OUTPUT_LIMIT,
+    runtime: ToolRuntime = None,
+) -> str:
+    """Fetch output of a background job produced since a byte offset.
+
+    Args:
+        job_id: Job to read from
+        offset: Byte offset to start from; pass the returned next_offset to
+            read only new output
+        limit: Maximum number of bytes to return
+
+    Returns:
+        The output chunk followed by the offset to continue from
+    """
+    store = runtime.store
+    if store is None:
+        return "Error: Store not configured, cannot track background jobs"
+
+    namespace = _job_namespace(runtime)
+    item = await store.aget(namespace, job_id)
+    if item is None:
+        return f"No job with ID '{job_id}'"
+    record = item.value
+
+    script = _output_script(record["remote_dir"], max(offset, 0), limit)
+    # base64 needs 4/3 of the bytes; the rest is room for markers and banners
+    result = await run_remote(
+        record["host"],
+        script,
+        timeout=JOB_CONTROL_TIMEOUT,
+        tail_limit=0,
+        head_limit=limit * 2 + 4096,
+    )
+    if not result.ok:
+        return f"Failed to read output of job {job_id}: {result.stderr.strip()}"
+    # Only the text between the marker lines is ours; banners may surround it
+    payload = _OUTPUT_PAYLOAD.search(result.stdout)
+    if payload is None:
+        return f"Failed to read output of job {job_id}: malformed response"
+    try:
+        chunk = base64.b64decode("".join(payload.group(1).split()), validate=True)
+    except binascii.Error:
+        return f"Failed to read output of job {job_id}: malformed response"
+
+    previous = record["status"]
+    record = await _refresh(record)
+    if record["status"] != previous:
+        await store.aput(namespace, job_id, record)
+    next_offset = max(offset, 0) + len(chunk)
+    text = chunk.decode("utf-8", errors="replace")
+    return (
+        f"{text}\n--- job {job_id} [{record['status']}] next_offset={next_offset} "
+        f"of {record.get('output_bytes', next_offset)} bytes"
+    )
+
+
+@tool
+async def ssh_job_cancel(job_id: str, runtime: ToolRuntime = None) -> str:
+    """Cancel a running background job, terminating its whole process group.
+
+    Args:
+        job_id: Job to cancel
+
+    Returns:
+        Confirmation or error message
+    """
+    store = runtime.store
+    if store is None:
+        return "Error: Store not configured, cannot track background jobs"
+
+    namespace = _job_namespace(runtime)
+    item = await store.aget(namespace, job_id)
+    if item is None:
+        return f"No job with ID '{job_id}'"
+    record = await _refresh(item.value)
+    if record["status"] != "running":
+        await store.aput(namespace, job_id, record)
+        return f"Job {job_id} is not running ({record['status']})"
+
+    result = await run_remote(
+        record["host"], f"kill -TERM -{record['pid']}", timeout=JOB_CONTROL_TIMEOUT
+    )
+    if not result.ok:
+        return f"Failed to cancel job {job_id}: {result.stderr.strip()}"
+
+    record["status"] = "cancelled"
+    record["finished_at"] = time.time()
+    await store.aput(namespace, job_id, record)
+    return f"Cancelled job {job_id} on {record['host']}"
+
+
+def get_job_tools() -> list:
+    """Get all background job tools.
+
+    Returns:
+        List of job tools
+    """
+    return [ssh_job_start, ssh_job_status, ssh_job_output, ssh_job_cancel]
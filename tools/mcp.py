@@ -1,35 +1,584 @@
 """MCP (Model Context Protocol) tool integration."""
 
+import asyncio
+import hashlib
+import json
 import logging
+import os
+import time
+from contextlib import suppress
+from dataclasses import dataclass, field
+from pathlib import Path
 
-from langchain_mcp_adapters.client import MultiServerMCPClient
+import anyio
+import httpx
+from langchain_core.tools import BaseTool
+from langchain_mcp_adapters.interceptors import MCPToolCallRequest
+from langchain_mcp_adapters.sessions import Connection, create_session
+from langchain_mcp_adapters.tools import convert_mcp_tool_to_langchain_tool
+from mcp import ClientSession
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED, CallToolResult, TextContent
+from mcp.types import Tool as MCPTool
+
+from espagent.tools.tool_cache import tool_cache
 
 logger = logging.getLogger(__name__)
 
+# Built-in servers, used when no configuration file exists
+MCP_SERVERS: dict[str, Connection] = {
+    # "ucagent": {
+    #     "transport": "streamable_http",
+    #     "url": "http://localhost:5000/mcp",
+    #     "timeout": 30,
+    # },
+    "espagent": {
+        "transport": "streamable_http",
+        "url": "http://localhost:8090/mcp",
+        "timeout": 30,
+    },
+}
+
+MCP_CONFIG_PATH = Path(
+    os.getenv("ESPAGENT_MCP_CONFIG", os.path.expanduser("~/.config/espagent/mcp_servers.json"))
+)
+MCP_DISCOVERY_TIMEOUT = float(os.getenv("ESPAGENT_MCP_DISCOVERY_TIMEOUT", "10"))
+
+MCP_CACHE_PATH = Path(
+    os.getenv("ESPAGENT_MCP_CACHE", os.path.expanduser("~/.cache/espagent/mcp_tools.json"))
+)
+
+MCP_POOL_SIZE = int(os.getenv("ESPAGENT_MCP_POOL_SIZE", "4"))
+MCP_KEEPALIVE = float(os.getenv("ESPAGENT_MCP_KEEPALIVE", "30"))
+MCP_CONNECT_TIMEOUT = 30.0
+
+# Failures that mean the request never reached the server, so retrying is safe
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+# Failures that leave the session unusable; apart from the ones above the
+# request may already have run on the server (read timeouts, dropped streams)
+_CONNECTION_ERRORS = (
+    ConnectionError,
+    httpx.TransportError,
+    anyio.ClosedResourceError,
+    anyio.BrokenResourceError,
+    anyio.EndOfStream,
+)
+# MCP errors raised after the request was sent: the session dropped or the
+# client stopped waiting, while the server may have run the tool
+_UNANSWERED_CODES = (CONNECTION_CLOSED, httpx.codes.REQUEST_TIMEOUT)
+
+# Keeps background revalidation tasks alive until they finish
+_background_tasks: set[asyncio.Task] = set()
 
-async def get_mcp_tools() -> list:
-    """Get all MCP tools from configured servers.
+
+def load_mcp_servers(path: Path = MCP_CONFIG_PATH) -> dict[str, Connection]:
+    """Load the MCP server map from a JSON configuration file.
+
+    The file maps server names to connection configs in the same shape as
+    ``MCP_SERVERS``, either at the top level or under a ``"servers"`` key.
+    A connection may set ``"discovery_timeout"`` (seconds) to override
+    ``ESPAGENT_MCP_DISCOVERY_TIMEOUT``, ``"enabled": false`` to skip it, and
+    ``"cache_tools"`` to opt idempotent tools into the result cache, mapping
+    each tool name to the project file globs its result depends on.
+
+    Args:
+        path: Configuration file
 
     Returns:
-        List of available MCP tools, or empty list if connection fails.
+        Server name to connection mapping; the built-in ``MCP_SERVERS`` if
+        the file does not exist or is invalid
     """
     try:
-        client = MultiServerMCPClient(
-            {
-                # "ucagent": {
-                #     "transport": "streamable_http",
-                #     "url": "http://localhost:5000/mcp",
-                #     "timeout": 30,
-                # },
-                "espagent": {
-                    "transport": "streamable_http",
-                    "url": "http://localhost:8090/mcp",
-                    "timeout": 30,
-                },
-            }
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return dict(MCP_SERVERS)
+    except (OSError, ValueError) as e:
+        logger.warning(f"! Invalid MCP configuration {path}: {e}, using built-in servers")
+        return dict(MCP_SERVERS)
+
+    servers = data.get("servers", data) if isinstance(data, dict) else None
+    if not isinstance(servers, dict):
+        logger.warning(f"! Invalid MCP configuration {path}: expected an object of servers")
+        return dict(MCP_SERVERS)
+    return {
+        name: connection
+        for name, connection in servers.items()
+        if isinstance(connection, dict) and connection.get("enabled", True)
+    }
+
+
+def _server_key(connection: Connection) -> str:
+    """Identify a server by its URL (or command line for stdio servers)."""
+    if "url" in connection:
+        return connection["url"]
+    return " ".join([connection.get("command", ""), *connection.get("args", [])])
+
+
+class MCPToolCache:
+    """On-disk cache of MCP tool schemas, keyed by server URL.
+
+    Each entry records the server's reported name/version and a hash of the
+    tool schemas, so revalidation can tell whether anything changed.
+
+    Args:
+        path: JSON file holding the cache
+    """
+
+    def __init__(self, path: Path = MCP_CACHE_PATH) -> None:
+        self.path = path
+
+    def _read(self) -> dict:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def load(self, server_key: str) -> dict | None:
+        """Return the cached entry of a server, or None."""
+        return self._read().get(server_key)
+
+    def save(self, server_key: str, version: str, tools: list[MCPTool]) -> dict:
+        """Store the tool schemas of a server.
+
+        Returns:
+            The stored entry
+        """
+        dumped = [tool.model_dump(mode="json", exclude_none=True) for tool in tools]
+        entry = {
+            "version": version,
+            "hash": schema_hash(dumped),
+            "tools": dumped,
+            "updated_at": time.time(),
+        }
+        data = self._read()
+        data[server_key] = entry
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Write atomically so a concurrent CLI never reads a partial file
+        tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self.path)
+        return entry
+
+
+def schema_hash(tools: list[dict]) -> str:
+    """Stable hash of a list of dumped tool schemas."""
+    return hashlib.sha256(json.dumps(tools, sort_keys=True).encode()).hexdigest()
+
+
+async def discover_server(connection: Connection) -> tuple[str, list[MCPTool]]:
+    """Connect to an MCP server and list its tools.
+
+    Args:
+        connection: Connection config of the server
+
+    Returns:
+        A tuple of (server version, tools), where the version is
+        "<name>@<version>" as reported during initialization
+    """
+    async with create_session(connection) as session:
+        init = await session.initialize()
+        tools: list[MCPTool] = []
+        cursor = None
+        while True:
+            page = await session.list_tools(cursor=cursor)
+            tools.extend(page.tools)
+            cursor = page.nextCursor
+            if not cursor:
+                break
+    return f"{init.serverInfo.name}@{init.serverInfo.version}", tools
+
+
+def _may_have_run(error: BaseException) -> bool:
+    """Whether a call failed without an answer after it may have reached the server."""
+    if _is_stale(error):
+        return False
+    if isinstance(error, McpError):
+        return error.error.code in _UNANSWERED_CODES
+    return isinstance(error, _CONNECTION_ERRORS)
+
+
+def _is_stale(error: BaseException) -> bool:
+    """Whether a call failed before the server ran it, so retrying is safe."""
+    if isinstance(error, McpError):
+        # Reported by the transport when the server no longer knows the session,
+        # e.g. after a restart
+        return error.error.message == "Session terminated"
+    return isinstance(error, _NOT_SENT_ERRORS)
+
+
+class _PooledSession:
+    """One initialized MCP session kept open by a background task.
+
+    The transport's context managers must be entered and exited in the same
+    task, so a dedicated task owns them and waits until the session is closed
+    or the connection drops.
+    """
+
+    def __init__(self, connection: Connection) -> None:
+        self.connection = connection
+        self.session: ClientSession | None = None
+        self.last_used = time.monotonic()
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._error: BaseException | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        """Connect and initialize; raises if the server is unreachable."""
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._ready.wait(), MCP_CONNECT_TIMEOUT)
+        except BaseException:
+            await self.close()
+            raise
+        if self.session is None:
+            raise self._error or ConnectionError("MCP session closed during setup")
+
+    async def _run(self) -> None:
+        try:
+            async with create_session(self.connection) as session:
+                await session.initialize()
+                self.session = session
+                self._ready.set()
+                await self._closing.wait()
+        except Exception as e:
+            self._error = e
+            if self._ready.is_set():
+                logger.info(f"MCP session dropped: {e}")
+        finally:
+            self.session = None
+            self._ready.set()
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    async def close(self) -> None:
+        self._closing.set()
+        if self._task is not None and not self._task.done():
+            try:
+                await asyncio.wait_for(self._task, 5.0)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                self._task.cancel()
+
+
+class MCPSessionPool:
+    """Long-lived MCP sessions shared by all tool calls of a server.
+
+    Without a session, every tool call would open a new connection and
+    repeat the initialize handshake. The pool keeps up to ``size`` sessions
+    per server, which also bounds the number of concurrent calls to it.
+    Idle sessions are pinged every ``keepalive`` seconds and replaced when
+    they stop answering; a call that fails because the connection dropped
+    is retried once on a fresh session.
+
+    Args:
+        size: Maximum number of sessions (and concurrent calls) per server
+        keepalive: Seconds between pings of idle sessions, 0 to disable
+    """
+
+    def __init__(self, size: int = MCP_POOL_SIZE, keepalive: float = MCP_KEEPALIVE) -> None:
+        self.size = size
+        self.keepalive = keepalive
+        self._connections: dict[str, Connection] = {}
+        self._idle: dict[str, list[_PooledSession]] = {}
+        self._limits: dict[str, asyncio.Semaphore] = {}
+        self._keepalive_task: asyncio.Task | None = None
+        self._opened = 0
+        self._reconnects = 0
+
+    def register(self, server_name: str, connection: Connection) -> None:
+        """Make a server's connection known to the pool."""
+        self._connections[server_name] = connection
+        self._idle.setdefault(server_name, [])
+        self._limits.setdefault(server_name, asyncio.Semaphore(self.size))
+
+    async def _acquire(self, server_name: str) -> _PooledSession:
+        await self._limits[server_name].acquire()
+        idle = self._idle[server_name]
+        while idle:
+            pooled = idle.pop()
+            if pooled.alive:
+                return pooled
+            await pooled.close()
+        pooled = _PooledSession(self._connections[server_name])
+        try:
+            await pooled.start()
+        except BaseException:
+            self._limits[server_name].release()
+            raise
+        self._opened += 1
+        self._ensure_keepalive()
+        return pooled
+
+    def _release(self, server_name: str, pooled: _PooledSession, broken: bool = False) -> None:
+        if broken or not pooled.alive:
+            self._spawn_close(pooled)
+        else:
+            pooled.last_used = time.monotonic()
+            self._idle[server_name].append(pooled)
+        self._limits[server_name].release()
+
+    @staticmethod
+    def _spawn_close(pooled: _PooledSession) -> None:
+        task = asyncio.create_task(pooled.close())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    async def _call_once(self, server_name: str, name: str, args: dict) -> CallToolResult:
+        pooled = await self._acquire(server_name)
+        try:
+            result = await pooled.session.call_tool(name, args)
+        except BaseException as e:
+            # Tool and protocol errors leave the session usable; dropped ones do not
+            closed = isinstance(e, McpError) and e.error.code == CONNECTION_CLOSED
+            broken = closed or isinstance(e, _CONNECTION_ERRORS) or _is_stale(e) or not pooled.alive
+            self._release(server_name, pooled, broken=broken)
+            raise
+        self._release(server_name, pooled)
+        return result
+
+    async def call_tool(self, server_name: str, name: str, args: dict) -> CallToolResult:
+        """Call a tool on a pooled session of ``server_name``.
+
+        A call is retried once on a new session only if it failed before
+        reaching the server. If the connection dropped or the call timed out
+        after the request may have been sent, the call is reported as a tool
+        error instead, so a non-idempotent tool (flash, erase) never runs twice.
+
+        Raises:
+            KeyError: If the server was never registered
+        """
+        try:
+            return await self._call_once(server_name, name, args)
+        except Exception as e:
+            if _may_have_run(e):
+                logger.warning(f"MCP call {name} on '{server_name}' interrupted: {e!r}")
+                return CallToolResult(
+                    content=[
+                        TextContent(
+                            type="text",
+                            text=(
+                                f"Connection to MCP server '{server_name}' failed during the "
+                                f"call ({e!r}). The tool may or may not have run; it was not "
+                                "retried. Check its effect before calling it again."
+                            ),
+                        )
+                    ],
+                    isError=True,
+                )
+            if not _is_stale(e):
+                raise
+            self._reconnects += 1
+            logger.info(f"MCP session to '{server_name}' lost ({e!r}), reconnecting")
+        return await self._call_once(server_name, name, args)
+
+    async def intercept(self, request: MCPToolCallRequest, handler) -> CallToolResult:
+        """Tool call interceptor routing calls through the pool."""
+        if request.server_name not in self._connections:
+            return await handler(request)
+        return await self.call_tool(request.server_name, request.name, request.args)
+
+    def _ensure_keepalive(self) -> None:
+        if self.keepalive > 0 and (self._keepalive_task is None or self._keepalive_task.done()):
+            self._keepalive_task = asyncio.create_task(self._keepalive_loop())
+
+    async def _keepalive_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.keepalive)
+            await self.ping_idle()
+
+    async def ping_idle(self) -> None:
+        """Ping idle sessions and drop the ones that do not answer."""
+        for server_name, idle in self._idle.items():
+            for pooled in list(idle):
+                if time.monotonic() - pooled.last_used < self.keepalive:
+                    continue
+                try:
+                    await asyncio.wait_for(pooled.session.send_ping(), 10.0)
+                    pooled.last_used = time.monotonic()
+                except Exception as e:
+                    logger.info(f"MCP keepalive to '{server_name}' failed: {e!r}")
+                    with suppress(ValueError):
+                        idle.remove(pooled)
+                    await pooled.close()
+
+    def stats(self) -> dict:
+        """Number of idle sessions per server and lifetime counters."""
+        return {
+            "idle": {name: len(idle) for name, idle in self._idle.items()},
+            "opened": self._opened,
+            "reconnects": self._reconnects,
+        }
+
+    async def aclose(self) -> None:
+        """Close all idle sessions and stop the keepalive task."""
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._keepalive_task
+            self._keepalive_task = None
+        for idle in self._idle.values():
+            sessions, idle[:] = list(idle), []
+            for pooled in sessions:
+                await pooled.close()
+
+
+mcp_sessions = MCPSessionPool()
+
+
+def _to_langchain(
+    name: str,
+    connection: Connection,
+    tools: list[MCPTool],
+    sessions: MCPSessionPool | None = None,
+) -> list[BaseTool]:
+    """Wrap MCP tools; the server is only contacted when a tool is called.
+
+    Calls pass through the result cache first, then the session pool.
+    """
+    sessions = sessions or mcp_sessions
+    sessions.register(name, connection)
+    return [
+        convert_mcp_tool_to_langchain_tool(
+            None,
+            tool,
+            connection=connection,
+            server_name=name,
+            tool_interceptors=[tool_cache.intercept, sessions.intercept],
         )
-        mcp_tools = await client.get_tools()
-        return mcp_tools
-    except Exception:
-        logger.warning("! MCP connection failed")
-        return []
+        for tool in tools
+    ]
+
+
+@dataclass
+class ServerDiscovery:
+    """Outcome of loading the tools of one MCP server."""
+
+    name: str
+    source: str  # "cache", "live" or "failed"
+    seconds: float
+    tools: list[BaseTool] = field(default_factory=list)
+    error: str | None = None
+
+    def __str__(self) -> str:
+        elapsed = f"{self.seconds * 1000:.0f} ms"
+        if self.source == "failed":
+            return f"{self.name}: unavailable after {elapsed} ({self.error})"
+        return f"{self.name}: {len(self.tools)} tools from {self.source} in {elapsed}"
+
+
+def _split_connection(connection: dict) -> tuple[Connection, float, dict[str, list[str]]]:
+    """Strip espagent-specific keys from a configured connection.
+
+    Returns:
+        A tuple of (connection, discovery timeout, cacheable tools)
+    """
+    connection = dict(connection)
+    connection.pop("enabled", None)
+    timeout = float(connection.pop("discovery_timeout", MCP_DISCOVERY_TIMEOUT))
+    cache_tools = connection.pop("cache_tools", {})
+    return connection, timeout, cache_tools
+
+
+async def _revalidate(
+    name: str, connection: Connection, cache: MCPToolCache, cached: dict, timeout: float
+) -> None:
+    """Refresh a server's cached schemas in the background."""
+    try:
+        version, tools = await asyncio.wait_for(discover_server(connection), timeout)
+    except Exception as e:
+        logger.info(f"MCP revalidation of '{name}' failed: {e!r}")
+        return
+    entry = cache.save(_server_key(connection), version, tools)
+    if (entry["version"], entry["hash"]) != (cached["version"], cached["hash"]):
+        logger.warning(f"MCP server '{name}' changed its tools; restart to use the new schemas")
+
+
+async def _load_server(
+    name: str, config: dict, cache: MCPToolCache, stale: list[tuple]
+) -> ServerDiscovery:
+    """Load one server's tools from the cache, or discover them live.
+
+    Servers served from the cache are appended to ``stale`` for revalidation.
+    """
+    start = time.perf_counter()
+    connection, timeout, cache_tools = _split_connection(config)
+    tool_cache.configure(name, cache_tools)
+    key = _server_key(connection)
+    cached = cache.load(key)
+    if cached is not None:
+        tools = [MCPTool.model_validate(tool) for tool in cached["tools"]]
+        stale.append((name, connection, cached, timeout))
+        source = "cache"
+    else:
+        try:
+            version, tools = await asyncio.wait_for(discover_server(connection), timeout)
+        except asyncio.TimeoutError:
+            return ServerDiscovery(
+                name, "failed", time.perf_counter() - start, error=f"timed out after {timeout:g}s"
+            )
+        except Exception as e:
+            return ServerDiscovery(name, "failed", time.perf_counter() - start, error=repr(e))
+        cache.save(key, version, tools)
+        source = "live"
+    return ServerDiscovery(
+        name, source, time.perf_counter() - start, _to_langchain(name, connection, tools)
+    )
+
+
+async def discover_servers(
+    servers: dict[str, Connection] | None = None,
+    cache: MCPToolCache | None = None,
+) -> list[ServerDiscovery]:
+    """Load the tools of all MCP servers concurrently.
+
+    Each server is bounded by its own discovery timeout and a failing server
+    does not affect the others.
+
+    Args:
+        servers: Server map (default: ``load_mcp_servers()``)
+        cache: Schema cache to use (default: ``MCP_CACHE_PATH``)
+
+    Returns:
+        One result per server, in configuration order
+    """
+    servers = load_mcp_servers() if servers is None else servers
+    cache = cache or MCPToolCache()
+    stale: list[tuple] = []
+    results = await asyncio.gather(
+        *(_load_server(name, config, cache, stale) for name, config in servers.items())
+    )
+    # Revalidate only once everything is loaded so it never competes with startup
+    for name, connection, cached, timeout in stale:
+        task = asyncio.create_task(_revalidate(name, connection, cache, cached, timeout))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    for result in results:
+        if result.source == "failed":
+            logger.warning(f"! MCP {result}")
+        else:
+            logger.info(f"MCP {result}")
+    return list(results)
+
+
+async def get_mcp_tools(
+    cache: MCPToolCache | None = None,
+    servers: dict[str, Connection] | None = None,
+) -> list:
+    """Get all MCP tools from configured servers.
+
+    Tool schemas are served from the on-disk cache when available and
+    revalidated in the background; only servers without a cache entry are
+    contacted before returning. Tools connect to their server on first use
+    and then reuse the long-lived sessions of ``mcp_sessions``.
+
+    Args:
+        cache: Schema cache to use (default: ``MCP_CACHE_PATH``)
+        servers: Server map (default: ``load_mcp_servers()``)
+
+    Returns:
+        List of tools of all reachable servers, empty if none is reachable.
+    """
+    results = await discover_servers(servers, cache)
+    return [tool for result in results for tool in result.tools]
@@ -1,15 +1,521 @@
 """Memory tools for storing and retrieving user information across sessions."""
 
+import asyncio
+import itertools
+import logging
+import math
+import os
+import threading
 import time
+import uuid
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import Any
 
 from langchain.tools import ToolRuntime, tool
+from langchain_core.embeddings import Embeddings
+from langgraph.store.base import BaseStore, Item, PutOp
 
 from espagent.utils import UserInfo
+from espagent.utils.embeddings import HashingEmbeddings, get_embeddings
+
+MEMORY_RECENCY_WEIGHT = float(os.getenv("ESPAGENT_MEMORY_RECENCY_WEIGHT", "0.2"))
+MEMORY_HALF_LIFE_DAYS = float(os.getenv("ESPAGENT_MEMORY_HALF_LIFE_DAYS", "30"))
+# Upper bound of memories scanned per recall when the store has no vector index
+MEMORY_SCAN_LIMIT = 100_000
+# Over-fetch factor so recency re-ranking can promote slightly less similar items
+MEMORY_CANDIDATE_FACTOR = 4
+# Seconds a saved memory may wait in the write-behind queue before it is flushed
+MEMORY_FLUSH_DELAY = float(os.getenv("ESPAGENT_MEMORY_FLUSH_DELAY", "2.0"))
+MEMORY_CACHE_SIZE = int(os.getenv("ESPAGENT_MEMORY_CACHE_SIZE", "256"))
+# Bounds staleness when another process writes to the same namespace
+MEMORY_CACHE_TTL = float(os.getenv("ESPAGENT_MEMORY_CACHE_TTL", "300"))
+# Per-user memory cap enforced by consolidation
+MEMORY_QUOTA = int(os.getenv("ESPAGENT_MEMORY_QUOTA", "200"))
+# Text similarity above which two memories state the same fact
+MEMORY_MERGE_SIMILARITY = float(os.getenv("ESPAGENT_MEMORY_MERGE_SIMILARITY", "0.8"))
+MEMORY_DUPLICATE_SIMILARITY = 0.95
+MEMORY_CONSOLIDATE_ON_SAVE = os.getenv("ESPAGENT_MEMORY_CONSOLIDATE_ON_SAVE", "1") == "1"
+
+logger = logging.getLogger(__name__)
+
+
+_MISSING = object()
+
+
+class MemoryCache:
+    """Read-through LRU/TTL cache of memory lookups, scoped per namespace.
+
+    Entries are keyed by store and namespace, so a write to one user's
+    namespace only invalidates that user's entries.
+
+    Args:
+        max_entries: Maximum number of cached lookups across all namespaces
+        ttl: Seconds after which an entry expires
+    """
+
+    def __init__(self, max_entries: int = MEMORY_CACHE_SIZE, ttl: float = MEMORY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+        # Stores are identified by a token that is never reused, unlike id()
+        self._stores: weakref.WeakKeyDictionary[Any, int] = weakref.WeakKeyDictionary()
+        self._tokens = itertools.count()
+        # Lookups run in worker threads (see recall_memory)
+        self._lock = threading.Lock()
+
+    def _scope(self, store: BaseStore, namespace: tuple[str, ...]) -> tuple:
+        token = self._stores.get(store)
+        if token is None:
+            token = self._stores[store] = next(self._tokens)
+        return (token, namespace)
+
+    def get(self, store: BaseStore, namespace: tuple[str, ...], key: Any) -> Any:
+        """Return a cached value, or ``_MISSING``."""
+        with self._lock:
+            entry_key = (*self._scope(store, namespace), key)
+            entry = self._entries.get(entry_key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(entry_key, None)
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(entry_key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, store: BaseStore, namespace: tuple[str, ...], key: Any, value: Any) -> None:
+        """Cache a value, evicting the least recently used entries over the cap."""
+        with self._lock:
+            entry_key = (*self._scope(store, namespace), key)
+            self._entries[entry_key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, store: BaseStore, namespace: tuple[str, ...]) -> None:
+        """Drop every cached lookup of one namespace."""
+        with self._lock:
+            scope = self._scope(store, namespace)
+            stale = [key for key in self._entries if key[:2] == scope]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.invalidations = 0
+
+    def stats(self) -> dict[str, float]:
+        """Return hit/miss counters and the current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
+
+
+memory_cache = MemoryCache()
+
+
+class _NamespaceIndex:
+    """Inverted index of the sparse memory vectors of one namespace."""
+
+    def __init__(self) -> None:
+        self.texts: dict[str, str] = {}
+        self.vectors: dict[str, dict[int, float]] = {}
+        self.postings: dict[int, dict[str, float]] = {}
+
+    def remove(self, key: str) -> None:
+        for dim in self.vectors.pop(key, {}):
+            self.postings[dim].pop(key, None)
+        self.texts.pop(key, None)
+
+    def add(self, key: str, text: str, vector: dict[int, float]) -> None:
+        self.remove(key)
+        self.texts[key] = text
+        self.vectors[key] = vector
+        for dim, value in vector.items():
+            self.postings.setdefault(dim, {})[key] = value
+
+
+class LocalMemoryIndex:
+    """In-process vector index, used when the store has no vector search.
+
+    Vectors are cached per memory key and only recomputed when the memory
+    text changes, and an inverted index over vector dimensions means a query
+    only touches memories that share features with it. Searches run in
+    worker threads (see recall_memory), so index updates and lookups hold a
+    lock; embedding runs outside of it.
+
+    Args:
+        embeddings: Embedding model used for memories and queries
+    """
+
+    def __init__(self, embeddings: Embeddings) -> None:
+        self.embeddings = embeddings
+        self._indexes: dict[tuple[str, ...], _NamespaceIndex] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _sparse(vector: list[float]) -> dict[int, float]:
+        return {i: v for i, v in enumerate(vector) if v}
+
+    def score(
+        self, namespace: tuple[str, ...], items: list[Item], query: str
+    ) -> list[tuple[float, Item]]:
+        """Score items of one namespace by cosine similarity to the query.
+
+        Args:
+            namespace: Namespace the items belong to
+            items: All current memories of the namespace
+            query: Search query
+
+        Returns:
+            (similarity, item) pairs of the items sharing features with the query
+        """
+        by_key = {item.key: item for item in items}
+        texts = {item.key: item.value.get("info", "") for item in items}
+        with self._lock:
+            index = self._indexes.setdefault(namespace, _NamespaceIndex())
+            stale = [key for key, text in texts.items() if index.texts.get(key) != text]
+
+        vectors = self.embeddings.embed_documents([texts[key] for key in stale])
+        query_vector = self._sparse(self.embeddings.embed_query(query))
+
+        with self._lock:
+            # Sync the index with the store: drop deleted memories, add new/changed ones
+            for key in index.texts.keys() - by_key.keys():
+                index.remove(key)
+            for key, vector in zip(stale, vectors, strict=True):
+                index.add(key, texts[key], self._sparse(vector))
+
+            scores: dict[str, float] = {}
+            for dim, weight in query_vector.items():
+                for key, value in index.postings.get(dim, {}).items():
+                    scores[key] = scores.get(key, 0.0) + weight * value
+        # Another search may have indexed memories this one was not given
+        return [
+            (score, by_key[key]) for key, score in scores.items() if score > 0 and key in by_key
+        ]
+
+
+_local_index: LocalMemoryIndex | None = None
+_local_index_lock = threading.Lock()
+
+
+def _get_local_index() -> LocalMemoryIndex:
+    global _local_index
+    with _local_index_lock:
+        if _local_index is None:
+            _local_index = LocalMemoryIndex(get_embeddings()[0])
+        return _local_index
+
+
+def _saved_at(item: Item) -> float:
+    return item.value.get("timestamp") or item.updated_at.timestamp()
+
+
+def _recency(item: Item, now: float, half_life_days: float = MEMORY_HALF_LIFE_DAYS) -> float:
+    """Exponential decay from 1 (just saved) towards 0."""
+    age_days = max(0.0, now - _saved_at(item)) / 86400
+    return 0.5 ** (age_days / half_life_days)
+
+
+def rank_memories(
+    scored: list[tuple[float, Item]],
+    limit: int,
+    recency_weight: float = MEMORY_RECENCY_WEIGHT,
+    half_life_days: float = MEMORY_HALF_LIFE_DAYS,
+) -> list[Item]:
+    """Rank memories by similarity blended with an exponential recency decay.
+
+    Args:
+        scored: (similarity, item) pairs
+        limit: Number of memories to return
+        recency_weight: Share of the score given to recency (0 disables it)
+        half_life_days: Age at which the recency score halves
+
+    Returns:
+        The top ``limit`` items, best first
+    """
+    now = time.time()
+
+    def combined(entry: tuple[float, Item]) -> float:
+        similarity, item = entry
+        recency = _recency(item, now, half_life_days)
+        return (1 - recency_weight) * similarity + recency_weight * recency
+
+    return [item for _, item in sorted(scored, key=combined, reverse=True)[:limit]]
+
+
+def search_memories(store, namespace: tuple[str, ...], query: str | None, limit: int) -> list[Item]:
+    """Find the memories of a namespace most relevant to a query.
+
+    Uses the store's vector index (pgvector on Postgres) when configured and
+    falls back to :class:`LocalMemoryIndex` otherwise. Results are served
+    from :data:`memory_cache` until the namespace is written to.
+
+    Args:
+        store: The LangGraph store
+        namespace: Memory namespace, (user_id, user_name)
+        query: Search query; without one the most recent memories are returned
+        limit: Maximum number of memories to return
+
+    Returns:
+        Matching items, best first
+    """
+    cached = memory_cache.get(store, namespace, (query, limit))
+    if cached is not _MISSING:
+        return cached
+
+    if not query:
+        result = store.search(namespace, limit=limit)
+    elif getattr(store, "index_config", None):
+        items = store.search(namespace, query=query, limit=limit * MEMORY_CANDIDATE_FACTOR)
+        result = rank_memories([(item.score or 0.0, item) for item in items], limit)
+    else:
+        # The full scan is shared by all queries until the namespace changes
+        items = memory_cache.get(store, namespace, "scan")
+        if items is _MISSING:
+            items = store.search(namespace, limit=MEMORY_SCAN_LIMIT)
+            memory_cache.put(store, namespace, "scan", items)
+        scored = _get_local_index().score(namespace, items, query)
+        if not scored:
+            # Nothing shares a term with the query: fall back to recency alone
+            scored = [(0.0, item) for item in items]
+        result = rank_memories(scored, limit)
+
+    memory_cache.put(store, namespace, (query, limit), result)
+    return result
+
+
+@dataclass
+class ConsolidationReport:
+    """Outcome of consolidating one memory namespace."""
+
+    namespace: tuple[str, ...]
+    scanned: int = 0
+    duplicates: int = 0
+    merged: int = 0
+    evicted: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{'/'.join(self.namespace)}: {self.scanned} memories, "
+            f"{self.duplicates} duplicates removed, {self.merged} merged, "
+            f"{self.evicted} evicted"
+        )
+
+
+async def consolidate_memories(
+    store: BaseStore,
+    namespace: tuple[str, ...],
+    *,
+    new_keys: set[str] | None = None,
+    quota: int = MEMORY_QUOTA,
+    merge_similarity: float = MEMORY_MERGE_SIMILARITY,
+) -> ConsolidationReport:
+    """Deduplicate, merge and evict the memories of one namespace.
+
+    Memories are visited newest first. One that is near-identical to a
+    newer memory is removed as a duplicate; one similar enough to be an
+    earlier version of the same fact is merged into the newer memory, which
+    keeps the newer text and counts the revision. If more than ``quota``
+    memories remain, the least valuable ones (old and rarely restated) are
+    evicted.
+
+    Args:
+        store: The LangGraph store
+        namespace: Memory namespace, (user_id, user_name)
+        new_keys: Only consider pairs involving these memories (incremental
+            run after a save); all pairs are considered when omitted
+        quota: Maximum number of memories kept in the namespace
+        merge_similarity: Text similarity from which two memories are merged
+
+    Returns:
+        Counts of what was changed
+    """
+    report = ConsolidationReport(namespace)
+    items = [
+        item
+        for item in await store.asearch(namespace, limit=MEMORY_SCAN_LIMIT)
+        if "info" in item.value
+    ]
+    report.scanned = len(items)
+    items.sort(key=_saved_at, reverse=True)
+
+    # Lexical similarity, independent of the semantic model used for recall
+    embeddings = HashingEmbeddings()
+    survivors: dict[str, dict] = {}
+    postings: dict[int, dict[str, float]] = {}
+    deleted: list[str] = []
+    updated: set[str] = set()
+
+    for item in items:
+        vector = embeddings.embed_query(item.value["info"])
+        sparse = {i: v for i, v in enumerate(vector) if v}
+        scores: dict[str, float] = {}
+        for dim, value in sparse.items():
+            for key, weight in postings.get(dim, {}).items():
+                scores[key] = scores.get(key, 0.0) + value * weight
+        best_key, best = max(scores.items(), key=lambda kv: kv[1], default=(None, 0.0))
+
+        relevant = new_keys is None or item.key in new_keys or best_key in new_keys
+        if best_key is not None and best >= merge_similarity and relevant:
+            target = survivors[best_key]
+            target["revisions"] = target.get("revisions", 1) + item.value.get("revisions", 1)
+            target["first_saved"] = min(
+                target.get("first_saved", target.get("timestamp", _saved_at(item))),
+                item.value.get("first_saved", _saved_at(item)),
+            )
+            deleted.append(item.key)
+            updated.add(best_key)
+            if best >= MEMORY_DUPLICATE_SIMILARITY:
+                report.duplicates += 1
+            else:
+                report.merged += 1
+            continue
+
+        survivors[item.key] = dict(item.value)
+        for dim, value in sparse.items():
+            postings.setdefault(dim, {})[item.key] = value
+
+    if len(survivors) > quota:
+        now = time.time()
+        by_key = {item.key: item for item in items}
+
+        def value(key: str) -> float:
+            revisions = survivors[key].get("revisions", 1)
+            return _recency(by_key[key], now) * (1 + math.log(revisions))
+
+        evicted = sorted(survivors, key=value)[: len(survivors) - quota]
+        for key in evicted:
+            del survivors[key]
+            updated.discard(key)
+        deleted.extend(evicted)
+        report.evicted = len(evicted)
+
+    ops = [PutOp(namespace, key, None) for key in deleted]
+    ops.extend(PutOp(namespace, key, survivors[key]) for key in updated)
+    if ops:
+        await store.abatch(ops)
+        memory_cache.invalidate(store, namespace)
+    return report
+
+
+async def consolidate_all(store: BaseStore) -> list[ConsolidationReport]:
+    """Consolidate every memory namespace of the store (batch maintenance).
+
+    Args:
+        store: The LangGraph store
+
+    Returns:
+        One report per namespace that holds memories
+    """
+    reports = []
+    for namespace in await store.alist_namespaces(max_depth=2, limit=100_000):
+        report = await consolidate_memories(store, namespace)
+        if report.scanned:
+            reports.append(report)
+    return reports
+
+
+def new_memory_id() -> str:
+    """Generate a unique, time-ordered memory ID."""
+    return f"mem_{time.time_ns():x}_{uuid.uuid4().hex[:8]}"
+
+
+class MemoryWriter:
+    """Write-behind queue that batches memory saves into one store operation.
+
+    Saves made during a turn are buffered and written with a single
+    ``abatch`` call when the turn ends (:meth:`flush`), after
+    ``flush_delay`` seconds at the latest, or on shutdown (:meth:`aclose`).
+
+    Args:
+        flush_delay: Seconds before buffered saves are flushed automatically
+    """
+
+    def __init__(self, flush_delay: float = MEMORY_FLUSH_DELAY) -> None:
+        self.flush_delay = flush_delay
+        self._pending: dict[BaseStore, list[PutOp]] = {}
+        self._timer: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    def enqueue(self, store: BaseStore, namespace: tuple[str, ...], key: str, value: dict) -> None:
+        """Buffer a memory write and schedule a flush.
+
+        Must be called from a running event loop.
+        """
+        self._pending.setdefault(store, []).append(PutOp(namespace, key, value))
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    def pending_count(self) -> int:
+        """Number of buffered writes."""
+        return sum(len(ops) for ops in self._pending.values())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_delay)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Write all buffered saves, one batch per store.
+
+        Failed batches stay queued so a later flush can retry them.
+        """
+        async with self._lock:
+            pending, self._pending = self._pending, {}
+            for store, ops in pending.items():
+                try:
+                    await store.abatch(ops)
+                except Exception as e:
+                    logger.warning(f"Memory flush failed ({len(ops)} writes kept): {e}")
+                    self._pending.setdefault(store, [])[:0] = ops
+                    continue
+                new_keys: dict[tuple[str, ...], set[str]] = {}
+                for op in ops:
+                    new_keys.setdefault(op.namespace, set()).add(op.key)
+                for namespace, keys in new_keys.items():
+                    memory_cache.invalidate(store, namespace)
+                    if MEMORY_CONSOLIDATE_ON_SAVE:
+                        await self._consolidate(store, namespace, keys)
+
+    @staticmethod
+    async def _consolidate(store: BaseStore, namespace: tuple[str, ...], keys: set[str]) -> None:
+        """Fold freshly saved memories into the namespace and enforce the quota."""
+        try:
+            report = await consolidate_memories(store, namespace, new_keys=keys)
+        except Exception as e:
+            logger.warning(f"Memory consolidation failed for {namespace}: {e}")
+            return
+        if report.duplicates or report.merged or report.evicted:
+            logger.info(f"Memory consolidation: {report}")
+
+    async def aclose(self) -> None:
+        """Cancel the pending timer and flush everything that is buffered."""
+        if self._timer is not None and not self._timer.done():
+            self._timer.cancel()
+        await self.flush()
+        if self._pending:
+            logger.error(f"{self.pending_count()} memory writes could not be persisted")
+
+
+memory_writer = MemoryWriter()
 
 
 @tool
-def save_memory(
+async def save_memory(
     info: str,
     runtime: ToolRuntime = None,
 ) -> str:
@@ -40,14 +546,17 @@ def save_memory(
     user_name = user_info.user_name if user_info else "unknown_user"
 
     store = runtime.store
+    if store is None:
+        return "Error: Store not configured, cannot save memory"
+
     # Create namespace: (user_id, category)
     namespace = (user_id, user_name)
 
-    # Generate memory ID (using timestamp)
-    memory_id = f"mem_{int(time.time())}"
+    memory_id = new_memory_id()
 
-    # Store to BaseStore (auto-persisted)
-    store.put(
+    # Buffered and written to the store in one batch at the end of the turn
+    memory_writer.enqueue(
+        store,
         namespace,
         memory_id,
         {
@@ -62,7 +571,7 @@ def save_memory(
 
 
 @tool
-def recall_memory(
+async def recall_memory(
     query: str | None = None,
     limit: int = 10,
     runtime: ToolRuntime = None,
@@ -72,7 +581,8 @@ def recall_memory(
     Retrieves previously saved memories, supports filtering by username.
 
     Args:
-        query: Optional search keyword (not yet implemented, reserved parameter)
+        query: Optional search text; memories are ranked by semantic
+            similarity to it, with a preference for recent ones
         limit: Maximum number of memories to return (default: 10)
 
     Returns:
@@ -81,6 +591,7 @@ def recall_memory(
     Example:
         recall_memory()  # Get all general category memories
         recall_memory(None, 5)  # Get recent 5 project memories
+        recall_memory("UART flashing problems", 3)  # Get 3 most relevant memories
     """
     state = runtime.state
     if state is None:
@@ -102,7 +613,10 @@ def recall_memory(
     namespace_prefix = (user_id, user_name)
 
     try:
-        items = store.search(namespace_prefix, limit=limit)
+        # Read-your-writes: memories saved earlier in this turn must be visible
+        await memory_writer.flush()
+        # Sync store access and ranking run off the event loop
+        items = await asyncio.to_thread(search_memories, store, namespace_prefix, query, limit)
 
         if not items:
             return f"No memories found for user '{user_name}'"
@@ -1,24 +1,595 @@
 """SSH tool for executing remote commands."""
 
+import asyncio
+import codecs
+import fnmatch
+import glob
+import hashlib
+import logging
+import os
+import re
 import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager, suppress
+from dataclasses import dataclass, field
+from pathlib import Path
 
 from langchain.tools import tool
 
+logger = logging.getLogger(__name__)
+
+SSH_CONTROL_DIR = os.getenv(
+    "ESPAGENT_SSH_CONTROL_DIR",
+    os.path.join(tempfile.gettempdir(), f"espagent-ssh-{os.getuid()}"),
+)
+SSH_IDLE_TIMEOUT = float(os.getenv("ESPAGENT_SSH_IDLE_TIMEOUT", "300"))
+SSH_MAX_SESSIONS = int(os.getenv("ESPAGENT_SSH_MAX_SESSIONS", "8"))
+SSH_CHECK_INTERVAL = float(os.getenv("ESPAGENT_SSH_CHECK_INTERVAL", "30"))
+SSH_TIMEOUT = float(os.getenv("ESPAGENT_SSH_TIMEOUT", "600"))
+SSH_OUTPUT_HEAD = int(os.getenv("ESPAGENT_SSH_OUTPUT_HEAD", "4000"))
+SSH_OUTPUT_TAIL = int(os.getenv("ESPAGENT_SSH_OUTPUT_TAIL", "8000"))
+SSH_CONFIG = os.getenv("ESPAGENT_SSH_CONFIG", os.path.expanduser("~/.ssh/config"))
+SSH_FANOUT_CONCURRENCY = int(os.getenv("ESPAGENT_SSH_FANOUT_CONCURRENCY", "8"))
+
+# Printed by the remote shell so a timed-out command can be killed remotely
+_PGID_MARKER = "__espagent_pgid__="
+_READ_SIZE = 4096
+
+
+@dataclass
+class _HostSession:
+    """Bookkeeping for one multiplexed master connection."""
+
+    semaphore: threading.BoundedSemaphore
+    last_used: float = field(default_factory=time.monotonic)
+    last_checked: float = 0.0
+    active: int = 0
+
+
+class SSHSessionPool:
+    """Per-host pool of multiplexed OpenSSH sessions.
+
+    Every host gets one OpenSSH control master (``ControlMaster=auto``) that
+    keeps the authenticated transport alive, so subsequent commands only open
+    a new channel instead of doing a full TCP + key exchange handshake.
+
+    Args:
+        control_dir: Directory holding the control sockets
+        idle_timeout: Seconds a master may stay unused before it is closed
+        max_sessions: Maximum concurrent channels per host
+        check_interval: Minimum seconds between two health checks of a master
+    """
+
+    def __init__(
+        self,
+        control_dir: str = SSH_CONTROL_DIR,
+        idle_timeout: float = SSH_IDLE_TIMEOUT,
+        max_sessions: int = SSH_MAX_SESSIONS,
+        check_interval: float = SSH_CHECK_INTERVAL,
+    ) -> None:
+        self.control_dir = Path(control_dir)
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._hosts: dict[str, _HostSession] = {}
+
+    def control_path(self, host: str) -> Path:
+        """Return the control socket path for a host.
+
+        The host name is hashed to stay below the UNIX socket path limit.
+        """
+        digest = hashlib.sha1(host.encode()).hexdigest()[:16]
+        return self.control_dir / f"{digest}.sock"
+
+    def command(self, host: str, command: str) -> list[str]:
+        """Build the ssh argv that runs ``command`` over the host's master."""
+        return [
+            "ssh",
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={self.control_path(host)}",
+            "-o",
+            f"ControlPersist={int(self.idle_timeout)}",
+            host,
+            command,
+        ]
+
+    def _control(self, host: str, operation: str) -> bool:
+        """Send a control command (``check``/``exit``) to the host's master."""
+        try:
+            result = subprocess.run(
+                ["ssh", "-o", f"ControlPath={self.control_path(host)}", "-O", operation, host],
+                capture_output=True,
+                text=True,
+                timeout=10,
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return False
+        return result.returncode == 0
+
+    def check(self, host: str) -> bool:
+        """Health-check the host's master, removing the socket if it is stale.
+
+        Returns:
+            True if a live master exists for the host
+        """
+        path = self.control_path(host)
+        if not path.exists():
+            return False
+        if self._control(host, "check"):
+            return True
+        logger.info(f"Stale SSH master for {host}, discarding")
+        path.unlink(missing_ok=True)
+        return False
+
+    def acquire(self, host: str) -> None:
+        """Reserve a channel on the host's master, blocking at the session cap."""
+        self.evict_idle()
+        with self._lock:
+            session = self._hosts.get(host)
+            if session is None:
+                self.control_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+                session = _HostSession(threading.BoundedSemaphore(self.max_sessions))
+                self._hosts[host] = session
+            # Mark as in use so a concurrent eviction does not pick it
+            session.last_used = time.monotonic()
+
+        session.semaphore.acquire()
+
+        now = time.monotonic()
+        with self._lock:
+            session.active += 1
+            session.last_used = now
+            needs_check = now - session.last_checked >= self.check_interval
+            if needs_check:
+                session.last_checked = now
+        if needs_check:
+            self.check(host)
+
+    async def aacquire(self, host: str) -> None:
+        """Async variant of :meth:`acquire` that waits in a worker thread."""
+        future = asyncio.ensure_future(asyncio.to_thread(self.acquire, host))
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The thread keeps running; give the channel back once it gets one
+            future.add_done_callback(lambda f: f.cancelled() or f.exception() or self.release(host))
+            raise
+
+    def release(self, host: str) -> None:
+        """Return a channel reserved with :meth:`acquire`."""
+        with self._lock:
+            session = self._hosts.get(host)
+            if session is None:
+                # The pool was closed while the channel was in use
+                return
+            session.active -= 1
+            session.last_used = time.monotonic()
+        session.semaphore.release()
+
+    @contextmanager
+    def session(self, host: str) -> Iterator[None]:
+        """Hold one channel on the host's master for the duration of the block."""
+        self.acquire(host)
+        try:
+            yield
+        finally:
+            self.release(host)
+
+    def evict_idle(self) -> None:
+        """Close masters that have been unused for longer than the idle timeout."""
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                host
+                for host, session in self._hosts.items()
+                if session.active == 0 and now - session.last_used > self.idle_timeout
+            ]
+            for host in idle:
+                del self._hosts[host]
+        for host in idle:
+            self._close(host)
+
+    def _close(self, host: str) -> None:
+        path = self.control_path(host)
+        if path.exists():
+            self._control(host, "exit")
+            path.unlink(missing_ok=True)
+
+    def close_all(self) -> None:
+        """Close every master owned by the pool."""
+        with self._lock:
+            hosts = list(self._hosts)
+            self._hosts.clear()
+        for host in hosts:
+            self._close(host)
+
+    def stats(self) -> dict[str, dict]:
+        """Return per-host usage counters."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                host: {"active": session.active, "idle_for": now - session.last_used}
+                for host, session in self._hosts.items()
+            }
+
+
+ssh_pool = SSHSessionPool()
+
+
+class BoundedOutput:
+    """Keep the head and the tail of a text stream, dropping the middle.
+
+    Args:
+        head_limit: Number of leading characters to keep
+        tail_limit: Number of trailing characters to keep
+    """
+
+    def __init__(self, head_limit: int = SSH_OUTPUT_HEAD, tail_limit: int = SSH_OUTPUT_TAIL):
+        self.head_limit = head_limit
+        self.tail_limit = tail_limit
+        self.total = 0
+        self._head: list[str] = []
+        self._head_size = 0
+        self._tail: deque[str] = deque()
+        self._tail_size = 0
+
+    def write(self, text: str) -> None:
+        """Append text to the buffer."""
+        self.total += len(text)
+        room = self.head_limit - self._head_size
+        if room > 0:
+            self._head.append(text[:room])
+            self._head_size += len(text[:room])
+            text = text[room:]
+        if not text or self.tail_limit <= 0:
+            return
+        self._tail.append(text)
+        self._tail_size += len(text)
+        # Drop whole chunks while the rest still covers the tail limit
+        while self._tail_size - len(self._tail[0]) >= self.tail_limit:
+            self._tail_size -= len(self._tail.popleft())
+
+    @property
+    def omitted(self) -> int:
+        """Number of characters dropped from the middle of the stream."""
+        return max(0, self.total - self._head_size - min(self._tail_size, self.tail_limit))
+
+    def getvalue(self) -> str:
+        """Return the captured text with a marker where output was dropped."""
+        head = "".join(self._head)
+        tail = "".join(self._tail)[-self.tail_limit :] if self.tail_limit > 0 else ""
+        if self.omitted:
+            return f"{head}\n... [{self.omitted} characters omitted] ...\n{tail}"
+        return head + tail
+
+
+@dataclass
+class RemoteResult:
+    """Outcome of a remote command."""
+
+    host: str
+    command: str
+    exit_code: int | None
+    stdout: str
+    stderr: str
+    duration: float
+    timed_out: bool = False
+
+    @property
+    def ok(self) -> bool:
+        """Whether the command finished with exit code 0."""
+        return self.exit_code == 0 and not self.timed_out
+
+
+async def _pump(
+    stream: asyncio.StreamReader,
+    on_line: Callable[[str], None],
+) -> None:
+    """Decode a byte stream incrementally and feed it line by line."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    while chunk := await stream.read(_READ_SIZE):
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            on_line(line + "\n")
+        # Progress bars without newlines must not grow the pending line forever
+        if len(pending) >= _READ_SIZE:
+            on_line(pending)
+            pending = ""
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        on_line(pending)
+
+
+async def _kill_remote(host: str, pgid: int, pool: SSHSessionPool) -> None:
+    """Terminate a remote process group over the host's master connection."""
+    proc = await asyncio.create_subprocess_exec(
+        *pool.command(host, f"kill -TERM -{pgid}"),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    await asyncio.wait_for(proc.wait(), timeout=10)
+
+
+async def run_remote(
+    host: str,
+    command: str,
+    *,
+    timeout: float | None = SSH_TIMEOUT,
+    on_output: Callable[[str, str], None] | None = None,
+    pool: SSHSessionPool = ssh_pool,
+    head_limit: int = SSH_OUTPUT_HEAD,
+    tail_limit: int = SSH_OUTPUT_TAIL,
+) -> RemoteResult:
+    """Run a command on a remote host without blocking the event loop.
+
+    Output is streamed to ``on_output`` as it arrives and only a bounded
+    head + tail of each stream is kept. On timeout or cancellation the remote
+    process group is terminated before the local ssh client is stopped.
+
+    Args:
+        host: The Host name from SSH configuration
+        command: The command to execute
+        timeout: Seconds before the command is aborted, or None for no limit
+        on_output: Callback receiving ``("stdout" | "stderr", line)`` chunks
+        pool: Session pool providing the multiplexed connection
+        head_limit: Leading characters kept per stream
+        tail_limit: Trailing characters kept per stream
+
+    Returns:
+        The command result with bounded stdout/stderr
+    """
+    stdout = BoundedOutput(head_limit, tail_limit)
+    stderr = BoundedOutput(head_limit, tail_limit)
+    pgid: int | None = None
+    timed_out = False
+    start = time.monotonic()
+
+    def on_stdout(line: str) -> None:
+        stdout.write(line)
+        if on_output is not None:
+            on_output("stdout", line)
+
+    def on_stderr(line: str) -> None:
+        nonlocal pgid
+        if pgid is None and line.startswith(_PGID_MARKER):
+            pgid = int(line[len(_PGID_MARKER) :].strip())
+            return
+        stderr.write(line)
+        if on_output is not None:
+            on_output("stderr", line)
+
+    await pool.aacquire(host)
+    try:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *pool.command(host, f"echo {_PGID_MARKER}$$ >&2; {command}"),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        except OSError as e:
+            return RemoteResult(host, command, None, "", str(e), time.monotonic() - start)
+
+        async def communicate() -> None:
+            await asyncio.gather(_pump(proc.stdout, on_stdout), _pump(proc.stderr, on_stderr))
+            await proc.wait()
+
+        try:
+            await asyncio.wait_for(communicate(), timeout=timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+        finally:
+            if proc.returncode is None:
+                if pgid is not None:
+                    try:
+                        await _kill_remote(host, pgid, pool)
+                    except (OSError, asyncio.TimeoutError):
+                        logger.warning(f"Could not terminate remote command on {host}")
+                # The client usually exits on its own once the remote side is gone
+                with suppress(ProcessLookupError):
+                    proc.terminate()
+                await proc.wait()
+    finally:
+        pool.release(host)
+
+    return RemoteResult(
+        host=host,
+        command=command,
+        exit_code=None if timed_out else proc.returncode,
+        stdout=stdout.getvalue(),
+        stderr=stderr.getvalue(),
+        duration=time.monotonic() - start,
+        timed_out=timed_out,
+    )
+
+
+def _echo_output(stream: str, line: str) -> None:
+    """Stream remote output to the CLI as it arrives."""
+    target = sys.stdout if stream == "stdout" else sys.stderr
+    target.write(f"   │ {line}")
+    target.flush()
+
 
 @tool
-def ssh_run(host: str, command: str) -> str:
+async def ssh_run(host: str, command: str, timeout: float = SSH_TIMEOUT) -> str:
     """Execute command on remote host using system SSH (with ~/.ssh/config).
 
     Args:
         host: The Host name from SSH configuration
         command: The command to execute
+        timeout: Seconds before the remote command is aborted
 
     Returns:
         The command execution result
     """
+    result = await run_remote(host, command, timeout=timeout, on_output=_echo_output)
+    if result.timed_out:
+        return (
+            f"SSH command timed out after {timeout:g}s and was terminated.\n"
+            f"Partial output:\n{result.stdout.strip()}"
+        )
+    if not result.ok:
+        return f"SSH command execution failed: {result.stderr.strip()}"
+    return result.stdout.strip()
+
+
+def configured_hosts(config_path: str = SSH_CONFIG) -> list[str]:
+    """List concrete host aliases declared in an OpenSSH client config.
+
+    ``Include`` directives are followed; wildcard and negated patterns are
+    skipped since they do not name a single host.
+
+    Args:
+        config_path: Path of the ssh config file
+
+    Returns:
+        Host aliases in declaration order
+    """
+    hosts: list[str] = []
+    base_dir = os.path.dirname(config_path)
     try:
-        ssh_cmd = ["ssh", host, command]
-        result = subprocess.run(ssh_cmd, capture_output=True, text=True, check=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        return f"SSH command execution failed: {e.stderr.strip()}"
+        with open(config_path, encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError:
+        return hosts
+
+    for line in lines:
+        keyword, _, value = re.sub(r"^(\S+?)\s*[=\s]\s*", r"\1 ", line.strip()).partition(" ")
+        keyword = keyword.lower()
+        if keyword == "include":
+            for pattern in value.split():
+                pattern = os.path.join(base_dir, os.path.expanduser(pattern))
+                for included in sorted(glob.glob(pattern)):
+                    hosts.extend(configured_hosts(included))
+        elif keyword == "host":
+            hosts.extend(name for name in value.split() if not any(c in name for c in "*?!"))
+    return list(dict.fromkeys(hosts))
+
+
+def resolve_hosts(hosts: list[str], config_path: str = SSH_CONFIG) -> list[str]:
+    """Expand host-group patterns (e.g. ``rig-*``) against the ssh config.
+
+    Args:
+        hosts: Host aliases and/or shell-style patterns
+        config_path: Path of the ssh config file
+
+    Returns:
+        Unique host aliases, in the order they were requested
+    """
+    resolved: list[str] = []
+    known: list[str] | None = None
+    for entry in hosts:
+        if any(c in entry for c in "*?["):
+            if known is None:
+                known = configured_hosts(config_path)
+            resolved.extend(fnmatch.filter(known, entry))
+        else:
+            resolved.append(entry)
+    return list(dict.fromkeys(resolved))
+
+
+async def run_many(
+    hosts: list[str],
+    command: str,
+    *,
+    concurrency: int = SSH_FANOUT_CONCURRENCY,
+    timeout: float | None = SSH_TIMEOUT,
+    on_result: Callable[[RemoteResult], None] | None = None,
+    pool: SSHSessionPool = ssh_pool,
+) -> list[RemoteResult]:
+    """Run the same command on several hosts with bounded concurrency.
+
+    Args:
+        hosts: Host aliases to run on
+        command: The command to execute
+        concurrency: Maximum number of hosts running at the same time
+        timeout: Per-host timeout in seconds
+        on_result: Callback invoked as each host finishes
+        pool: Session pool providing the multiplexed connections
+
+    Returns:
+        One result per host, in the order of ``hosts``
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one(host: str) -> RemoteResult:
+        async with semaphore:
+            result = await run_remote(host, command, timeout=timeout, pool=pool)
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    return list(await asyncio.gather(*(run_one(host) for host in hosts)))
+
+
+def summarize_results(results: list[RemoteResult]) -> str:
+    """Aggregate fan-out results, grouping hosts with identical outcomes.
+
+    Args:
+        results: Results returned by :func:`run_many`
+
+    Returns:
+        Compact report with per-host exit codes and de-duplicated output
+    """
+    groups: dict[tuple[str, str], list[str]] = {}
+    for result in results:
+        if result.timed_out:
+            status = "timed out"
+        else:
+            status = f"exit {result.exit_code}"
+        output = result.stdout if result.ok else (result.stderr or result.stdout)
+        groups.setdefault((status, output.strip()), []).append(result.host)
+
+    succeeded = sum(result.ok for result in results)
+    lines = [f"{len(results)} hosts: {succeeded} succeeded, {len(results) - succeeded} failed"]
+    for (status, output), group_hosts in sorted(groups.items(), key=lambda g: -len(g[1])):
+        lines.append(f"\n[{len(group_hosts)} host(s), {status}] {', '.join(group_hosts)}")
+        lines.append(output or "(no output)")
+    return "\n".join(lines)
+
+
+def _echo_result(result: RemoteResult) -> None:
+    """Report per-host completion of a fan-out run on the CLI."""
+    mark = "✓" if result.ok else "✗"
+    status = "timed out" if result.timed_out else f"exit {result.exit_code}"
+    sys.stdout.write(f"   {mark} {result.host} ({status}, {result.duration:.1f}s)\n")
+    sys.stdout.flush()
+
+
+@tool
+async def ssh_run_many(
+    hosts: list[str],
+    command: str,
+    concurrency: int = SSH_FANOUT_CONCURRENCY,
+    timeout: float = SSH_TIMEOUT,
+) -> str:
+    """Execute the same command on several remote hosts concurrently.
+
+    Args:
+        hosts: Host names from SSH configuration; shell-style patterns such
+            as "rig-*" select every matching host
+        command: The command to execute on each host
+        concurrency: Maximum number of hosts running at the same time
+        timeout: Seconds before the command is aborted on a host
+
+    Returns:
+        Aggregated results: hosts with identical output are grouped together
+    """
+    targets = resolve_hosts(hosts)
+    if not targets:
+        return f"No SSH hosts match: {', '.join(hosts)}"
+    results = await run_many(
+        targets, command, concurrency=concurrency, timeout=timeout, on_result=_echo_result
+    )
+    return summarize_results(results)
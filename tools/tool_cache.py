@@ -0,0 +1,287 @@
+"""Result cache for idempotent MCP tool calls.
+
+Read-only ESP-IDF tools (size reports, sdkconfig queries, target info) are
+expensive on the server and return the same result as long as the project
+does not change. Tools opt in per server with a list of project file globs;
+the cache key covers the tool, its arguments and a content hash of the
+matched files, so editing any of them invalidates the entry.
+
+Results are kept in an in-process LRU and, once a store is attached, in the
+shared LangGraph store so other sessions and teammates reuse them. Expired
+shared entries are deleted when read and by a periodic sweep, since entries
+of changed project files are never read again.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from langchain_mcp_adapters.interceptors import MCPToolCallRequest
+from langgraph.store.base import BaseStore, PutOp
+from mcp.types import CallToolResult
+
+logger = logging.getLogger(__name__)
+
+TOOL_CACHE_SIZE = int(os.getenv("ESPAGENT_TOOL_CACHE_SIZE", "512"))
+TOOL_CACHE_TTL = float(os.getenv("ESPAGENT_TOOL_CACHE_TTL", "86400"))
+# Seconds between sweeps of expired entries from the shared store
+TOOL_CACHE_SWEEP_INTERVAL = float(os.getenv("ESPAGENT_TOOL_CACHE_SWEEP_INTERVAL", "3600"))
+# Entries read per page while sweeping
+_SWEEP_PAGE = 100
+
+# Keeps background sweeps alive until they finish
+_background_tasks: set[asyncio.Task] = set()
+# Root the cache globs are resolved against (default: the directory the
+# console was started from)
+PROJECT_DIR = os.getenv("ESPAGENT_PROJECT_DIR")
+
+
+class FileFingerprints:
+    """Content hashes of project files, re-read only when a file changes."""
+
+    def __init__(self) -> None:
+        self._files: dict[str, tuple[int, int, str]] = {}
+
+    def _file_digest(self, path: Path) -> str:
+        stat = path.stat()
+        cached = self._files.get(str(path))
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        digest = hashlib.sha256()
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        self._files[str(path)] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+        return digest.hexdigest()
+
+    def digest(self, root: Path, patterns: list[str]) -> str | None:
+        """Hash the names and contents of all files matching ``patterns``.
+
+        Returns None if no file matches, e.g. when ``root`` is not the project.
+        """
+        digest = hashlib.sha256()
+        matched = False
+        for pattern in patterns:
+            digest.update(f"{pattern}\0".encode())
+            for path in sorted(root.glob(pattern)):
+                if path.is_file():
+                    matched = True
+                    name = path.relative_to(root).as_posix()
+                    digest.update(f"{name}\0{self._file_digest(path)}\0".encode())
+        return digest.hexdigest() if matched else None
+
+
+class ToolResultCache:
+    """Two-tier cache of MCP tool results for opted-in tools.
+
+    Args:
+        max_size: Maximum number of results kept in process
+        ttl: Seconds a result stays valid
+        project_dir: Root for file globs (default: ``PROJECT_DIR`` or the
+            working directory at call time)
+        sweep_interval: Seconds between sweeps of the shared store, 0 to
+            never sweep
+    """
+
+    NAMESPACE = "tool_cache"
+
+    def __init__(
+        self,
+        max_size: int = TOOL_CACHE_SIZE,
+        ttl: float = TOOL_CACHE_TTL,
+        project_dir: str | None = PROJECT_DIR,
+        sweep_interval: float = TOOL_CACHE_SWEEP_INTERVAL,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.project_dir = project_dir
+        self.sweep_interval = sweep_interval
+        self._last_sweep: float | None = None
+        self.store: BaseStore | None = None
+        self._rules: dict[tuple[str, str], list[str]] = {}
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._fingerprints = FileFingerprints()
+        self._stats = {
+            "local_hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "uncacheable": 0,
+            "errors": 0,
+            "expired": 0,
+        }
+
+    def configure(self, server_name: str, tools: dict[str, list[str]]) -> None:
+        """Opt tools of a server into caching.
+
+        Args:
+            server_name: MCP server name
+            tools: Tool name to the project file globs its result depends on
+        """
+        for tool_name, patterns in tools.items():
+            self._rules[(server_name, tool_name)] = list(patterns)
+
+    def attach(self, store: BaseStore | None) -> None:
+        """Use ``store`` as the shared tier."""
+        self.store = store
+
+    def key(self, server_name: str, tool_name: str, args: dict) -> str | None:
+        """Cache key of a call; reads project files, so run it off the event loop.
+
+        Returns None if the tool's globs match no files: nothing could then
+        invalidate the entry, so the call is not cached.
+        """
+        root = Path(self.project_dir or os.getcwd())
+        files = self._fingerprints.digest(root, self._rules[(server_name, tool_name)])
+        if files is None:
+            return None
+        payload = json.dumps([server_name, tool_name, args, files], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _get_local(self, key: str) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created_at, result = entry
+        if time.time() - created_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _put_local(self, key: str, created_at: float, result: dict) -> None:
+        self._entries[key] = (created_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def _get_shared(self, server_name: str, key: str) -> tuple[float, dict] | None:
+        if self.store is None:
+            return None
+        try:
+            item = await self.store.aget((self.NAMESPACE, server_name), key)
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.info(f"Tool cache read failed: {e}")
+            return None
+        if item is None:
+            return None
+        if time.time() - item.value["created_at"] > self.ttl:
+            await self._delete_shared([((self.NAMESPACE, server_name), key)])
+            return None
+        return item.value["created_at"], item.value["result"]
+
+    async def _delete_shared(self, entries: list[tuple[tuple[str, ...], str]]) -> None:
+        try:
+            await self.store.abatch([PutOp(namespace, key, None) for namespace, key in entries])
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.info(f"Tool cache delete failed: {e}")
+            return
+        self._stats["expired"] += len(entries)
+
+    async def sweep(self) -> int:
+        """Delete expired entries of every server from the shared store.
+
+        Returns:
+            Number of entries deleted
+        """
+        if self.store is None:
+            return 0
+        expired = []
+        try:
+            for namespace in await self.store.alist_namespaces(prefix=(self.NAMESPACE,)):
+                offset = 0
+                while True:
+                    items = await self.store.asearch(namespace, limit=_SWEEP_PAGE, offset=offset)
+                    expired += [
+                        (namespace, item.key)
+                        for item in items
+                        if time.time() - item.value.get("created_at", 0) > self.ttl
+                    ]
+                    if len(items) < _SWEEP_PAGE:
+                        break
+                    offset += _SWEEP_PAGE
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.info(f"Tool cache sweep failed: {e}")
+            return 0
+        if expired:
+            await self._delete_shared(expired)
+            logger.info(f"Tool cache: swept {len(expired)} expired results")
+        return len(expired)
+
+    def _maybe_sweep(self) -> None:
+        """Start a background sweep if the last one is older than the interval."""
+        now = time.monotonic()
+        if self.sweep_interval <= 0 or (
+            self._last_sweep is not None and now - self._last_sweep < self.sweep_interval
+        ):
+            return
+        self._last_sweep = now
+        task = asyncio.create_task(self.sweep())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    async def _put_shared(self, server_name: str, key: str, created_at: float, result: dict):
+        if self.store is None:
+            return
+        value = {"created_at": created_at, "result": result}
+        try:
+            # Results are looked up by key only, never embedded for search
+            await self.store.aput((self.NAMESPACE, server_name), key, value, index=False)
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.info(f"Tool cache write failed: {e}")
+            return
+        self._maybe_sweep()
+
+    async def intercept(self, request: MCPToolCallRequest, handler) -> CallToolResult:
+        """Tool call interceptor answering opted-in calls from the cache."""
+        if (request.server_name, request.name) not in self._rules:
+            return await handler(request)
+
+        key = await asyncio.to_thread(self.key, request.server_name, request.name, request.args)
+        if key is None:
+            self._stats["uncacheable"] += 1
+            return await handler(request)
+        result = self._get_local(key)
+        if result is not None:
+            self._stats["local_hits"] += 1
+            return CallToolResult.model_validate(result)
+
+        shared = await self._get_shared(request.server_name, key)
+        if shared is not None:
+            self._stats["shared_hits"] += 1
+            self._put_local(key, *shared)
+            return CallToolResult.model_validate(shared[1])
+
+        self._stats["misses"] += 1
+        response = await handler(request)
+        if not response.isError:
+            created_at = time.time()
+            dumped = response.model_dump(mode="json", exclude_none=True)
+            self._put_local(key, created_at, dumped)
+            await self._put_shared(request.server_name, key, created_at, dumped)
+        return response
+
+    def clear(self) -> None:
+        """Drop all in-process entries."""
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """Hit/miss counters, hit rate and number of in-process entries."""
+        calls = self._stats["local_hits"] + self._stats["shared_hits"] + self._stats["misses"]
+        hits = calls - self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": round(hits / calls, 3) if calls else 0.0,
+            "size": len(self._entries),
+        }
+
+
+tool_cache = ToolResultCache()
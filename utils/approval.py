@@ -0,0 +1,324 @@
+"""Approval policy: rule-based and session-scoped decisions for gated tool calls."""
+
+import json
+import logging
+import os
+import posixpath
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from fnmatch import fnmatchcase
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+APPROVAL_POLICY_PATH = Path(
+    os.getenv(
+        "ESPAGENT_APPROVAL_POLICY", os.path.expanduser("~/.config/espagent/approval_policy.json")
+    )
+)
+APPROVAL_AUDIT_PATH = Path(
+    os.getenv(
+        "ESPAGENT_APPROVAL_AUDIT", os.path.expanduser("~/.local/share/espagent/approvals.jsonl")
+    )
+)
+
+# Arguments naming the file a tool works on (deepagents filesystem tools)
+PATH_ARGS = ("file_path", "path")
+# Shell syntax that chains, substitutes or redirects commands; a command using
+# any of it never matches an allow rule
+_SHELL_META = re.compile(r"[;&|`<>\n]|\$\(")
+# Longest argument value written to the audit log
+_AUDIT_VALUE_CHARS = 200
+# Tool call ids remembered to log each rule approval once
+_AUDITED_IDS = 1024
+
+
+def _path_arg(args: dict) -> str | None:
+    for key in PATH_ARGS:
+        if isinstance(args.get(key), str):
+            return posixpath.normpath(args[key]).lstrip("/")
+    return None
+
+
+def _hosts_arg(args: dict) -> list[str] | None:
+    """Target hosts of an SSH call: ``host`` of ssh_run or ``hosts`` of ssh_run_many."""
+    if isinstance(args.get("host"), str):
+        return [args["host"]]
+    hosts = args.get("hosts")
+    if isinstance(hosts, list) and hosts and all(isinstance(host, str) for host in hosts):
+        return hosts
+    return None
+
+
+def _safe_to_allow(args: dict) -> bool:
+    """Whether an allow rule may match at all: no path escapes, no shell chaining."""
+    for key in PATH_ARGS:
+        if isinstance(args.get(key), str) and ".." in args[key].split("/"):
+            return False
+    command = args.get("command")
+    return not (isinstance(command, str) and _SHELL_META.search(command))
+
+
+@dataclass
+class ApprovalRule:
+    """An allow or deny rule for calls of a tool.
+
+    A rule matches when the tool name matches ``tool`` and every condition
+    given holds: the path argument matches one of ``paths``, the SSH host
+    one of ``hosts`` and the command one of ``commands``. All patterns are
+    shell-style globs; paths are relative to the project root. For calls on
+    several hosts, an allow rule needs every host to match and a deny rule
+    any of them.
+    """
+
+    tool: str
+    action: str
+    paths: list[str] = field(default_factory=list)
+    hosts: list[str] = field(default_factory=list)
+    commands: list[str] = field(default_factory=list)
+    reason: str = ""
+
+    def matches(self, name: str, args: dict) -> bool:
+        """Whether the rule applies to a call of ``name`` with ``args``."""
+        if not fnmatchcase(name, self.tool):
+            return False
+        if self.action == "allow" and not _safe_to_allow(args):
+            return False
+        if self.hosts:
+            hosts = _hosts_arg(args)
+            if not hosts:
+                return False
+            matched = [any(fnmatchcase(host, p) for p in self.hosts) for host in hosts]
+            if not (all(matched) if self.action == "allow" else any(matched)):
+                return False
+        conditions = (
+            (self.paths, _path_arg(args)),
+            (self.commands, args.get("command")),
+        )
+        for patterns, value in conditions:
+            if patterns and not (
+                isinstance(value, str) and any(fnmatchcase(value, p) for p in patterns)
+            ):
+                return False
+        return True
+
+    def __str__(self) -> str:
+        conditions = [
+            f"{label} {', '.join(patterns)}"
+            for label, patterns in (
+                ("paths", self.paths),
+                ("hosts", self.hosts),
+                ("commands", self.commands),
+            )
+            if patterns
+        ]
+        text = " ".join([self.action, self.tool, *conditions])
+        return f"{text} ({self.reason})" if self.reason else text
+
+
+def load_rules(path: Path = APPROVAL_POLICY_PATH) -> list[ApprovalRule]:
+    """Load approval rules from a JSON file.
+
+    The file holds a list of rules, at the top level or under ``"rules"``,
+    each with ``tool``, ``action`` ("allow" or "deny") and optionally
+    ``paths``, ``hosts``, ``commands`` and ``reason``.
+
+    Args:
+        path: Policy file
+
+    Returns:
+        The valid rules; none if the file does not exist or is invalid
+    """
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        logger.warning(f"! Invalid approval policy {path}: {e}, every call needs approval")
+        return []
+
+    entries = data.get("rules", []) if isinstance(data, dict) else data
+    rules = []
+    for entry in entries if isinstance(entries, list) else []:
+        try:
+            rule = ApprovalRule(**entry)
+        except TypeError as e:
+            logger.warning(f"! Skipping approval rule {entry}: {e}")
+            continue
+        if rule.action not in ("allow", "deny"):
+            logger.warning(f"! Skipping approval rule {entry}: unknown action")
+            continue
+        rules.append(rule)
+    return rules
+
+
+class ApprovalPolicy:
+    """Decides gated tool calls without asking when rules or earlier answers allow it.
+
+    Deny rules win over allow rules. Calls approved by an allow rule never
+    interrupt the agent (see :meth:`interrupt_on`); denied calls and calls
+    covered by an approval "for this session" are answered as soon as the
+    interrupt arrives. Everything else is left to the user. Every decision
+    is appended to a JSON lines audit log.
+
+    A session approval covers similar calls in the same thread: the same
+    directory for file tools, the same command on the same hosts for SSH,
+    any call of other tools.
+
+    Args:
+        rules: Allow and deny rules
+        audit_path: JSON lines file for decisions, None to not keep one
+    """
+
+    def __init__(
+        self,
+        rules: list[ApprovalRule] | None = None,
+        audit_path: Path | None = APPROVAL_AUDIT_PATH,
+    ) -> None:
+        self.rules = rules or []
+        self.audit_path = audit_path
+        self._grants: dict[str | None, dict[tuple, str]] = {}
+        self._audited: dict[str, None] = {}
+        self._counts: Counter = Counter()
+
+    @classmethod
+    def load(cls, path: Path = APPROVAL_POLICY_PATH) -> "ApprovalPolicy":
+        """Create a policy from the rules in ``path``."""
+        return cls(load_rules(path))
+
+    def evaluate(self, name: str, args: dict) -> ApprovalRule | None:
+        """The deciding rule for a call, None if no rule applies."""
+        matching = [rule for rule in self.rules if rule.matches(name, args)]
+        for rule in matching:
+            if rule.action == "deny":
+                return rule
+        return matching[0] if matching else None
+
+    def when(self, request) -> bool:
+        """``InterruptOnConfig.when`` predicate: interrupt unless an allow rule applies."""
+        tool_call = request.tool_call
+        rule = self.evaluate(tool_call["name"], tool_call["args"])
+        if rule is None or rule.action != "allow":
+            return True
+        # The predicate runs again when a run resumes, log each call once
+        if tool_call["id"] not in self._audited:
+            self._audited[tool_call["id"]] = None
+            if len(self._audited) > _AUDITED_IDS:
+                del self._audited[next(iter(self._audited))]
+            configurable = (getattr(request.runtime, "config", None) or {}).get("configurable", {})
+            self.record(tool_call, {"type": "approve"}, configurable.get("thread_id"), "rule", rule)
+        return False
+
+    def interrupt_on(self, configs: dict) -> dict:
+        """``HumanInTheLoopMiddleware`` configs with the allow rules applied."""
+        return {name: {**config, "when": self.when} for name, config in configs.items()}
+
+    @staticmethod
+    def _scope(name: str, args: dict) -> tuple:
+        if isinstance(args.get("command"), str):
+            return (name, tuple(sorted(_hosts_arg(args) or [])), args["command"])
+        path = _path_arg(args)
+        if path is not None:
+            return (name, posixpath.dirname(path))
+        return (name,)
+
+    @staticmethod
+    def describe_scope(request: dict) -> str:
+        """What a session approval of ``request`` would cover."""
+        name, *scope = ApprovalPolicy._scope(request["name"], request["args"])
+        if len(scope) == 2:
+            return f"{name} of '{scope[1]}' on {', '.join(scope[0]) or 'no host'}"
+        if scope:
+            return f"{name} in '{scope[0] or '.'}'"
+        return f"all {name} calls"
+
+    def grant(self, request: dict, thread_id: str | None) -> None:
+        """Approve calls similar to ``request`` for the rest of the session."""
+        scope = self._scope(request["name"], request["args"])
+        self._grants.setdefault(thread_id, {})[scope] = self.describe_scope(request)
+
+    def grants(self, thread_id: str | None) -> list[str]:
+        """Session approvals of a thread, for display."""
+        return sorted(self._grants.get(thread_id, {}).values())
+
+    def clear_grants(self, thread_id: str | None) -> int:
+        """Drop the session approvals of a thread, returning how many there were."""
+        return len(self._grants.pop(thread_id, {}))
+
+    def decide(self, request: dict, thread_id: str | None) -> dict | None:
+        """Decide an action request without the user if rules or session approvals allow.
+
+        Args:
+            request: Action request of a ``HumanInTheLoopMiddleware`` interrupt
+            thread_id: Thread the call belongs to
+
+        Returns:
+            The decision, None if the user has to answer
+        """
+        name, args = request["name"], request["args"]
+        rule = self.evaluate(name, args)
+        if rule is not None and rule.action == "deny":
+            decision = {
+                "type": "reject",
+                "message": f"Denied by approval policy: {rule.reason or rule}",
+            }
+            self.record(request, decision, thread_id, "rule", rule)
+            return decision
+        if rule is not None:
+            decision = {"type": "approve"}
+            self.record(request, decision, thread_id, "rule", rule)
+            return decision
+        if self._scope(name, args) in self._grants.get(thread_id, {}):
+            decision = {"type": "approve"}
+            self.record(request, decision, thread_id, "session")
+            return decision
+        return None
+
+    def record(
+        self,
+        request: dict,
+        decision: dict,
+        thread_id: str | None,
+        source: str,
+        rule: ApprovalRule | None = None,
+    ) -> None:
+        """Count a decision and append it to the audit log.
+
+        Args:
+            request: The tool call or action request decided on
+            decision: The decision
+            thread_id: Thread the call belongs to
+            source: "rule", "session" or "user"
+            rule: The deciding rule, if any
+        """
+        self._counts[f"{source}_{decision['type']}"] += 1
+        if self.audit_path is None:
+            return
+        args = {
+            key: value[:_AUDIT_VALUE_CHARS] if isinstance(value, str) else value
+            for key, value in request["args"].items()
+        }
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "thread_id": thread_id,
+            "tool": request["name"],
+            "args": args,
+            "decision": decision["type"],
+            "source": source,
+            "rule": str(rule) if rule else None,
+        }
+        try:
+            self.audit_path.parent.mkdir(parents=True, exist_ok=True)
+            with self.audit_path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not write approval audit log {self.audit_path}: {e}")
+
+    def stats(self) -> dict:
+        """Decisions by source and type, e.g. ``rule_approve`` or ``user_reject``."""
+        return dict(self._counts)
+
+
+approval_policy = ApprovalPolicy.load()
@@ -0,0 +1,524 @@
+"""Compact Postgres checkpointing: compressed payloads, shared tool outputs and retention."""
+
+import hashlib
+import logging
+import os
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any
+
+from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from langgraph.checkpoint.serde.encrypted import EncryptedSerializer
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# "zstd" (zlib when zstandard is not installed), "zlib" or "none"
+CHECKPOINT_COMPRESSION = os.getenv("ESPAGENT_CHECKPOINT_COMPRESSION", "zstd")
+CHECKPOINT_COMPRESS_MIN_BYTES = int(os.getenv("ESPAGENT_CHECKPOINT_COMPRESS_MIN_BYTES", "1024"))
+CHECKPOINT_BLOB_MIN_CHARS = int(os.getenv("ESPAGENT_CHECKPOINT_BLOB_MIN_CHARS", "4096"))
+CHECKPOINT_KEEP_LAST = int(os.getenv("ESPAGENT_CHECKPOINT_KEEP_LAST", "50"))
+CHECKPOINT_MAX_AGE_DAYS = float(os.getenv("ESPAGENT_CHECKPOINT_MAX_AGE_DAYS", "30"))
+
+# Marks a tool message whose content was moved to checkpoint_content_blobs
+BLOB_KEY = "espagent_blob"
+
+# Tables whose rows of an archived thread move to "<table>_archive"
+THREAD_TABLES = ("checkpoints", "checkpoint_blobs", "checkpoint_writes")
+# Columns of checkpoint_content_blobs and its archive, which this module owns
+CONTENT_BLOB_COLUMNS = "hash, codec, data, last_used"
+
+
+class PayloadCodec:
+    """Compresses serialized checkpoint payloads.
+
+    Plugs into langgraph's ``EncryptedSerializer`` as its cipher: the codec
+    name is appended to the stored type (``msgpack+zstd``), so rows written
+    without compression keep loading unchanged.
+
+    Args:
+        method: "zstd", "zlib" or "none"
+        min_bytes: Payloads smaller than this are stored as-is
+    """
+
+    def __init__(
+        self, method: str = CHECKPOINT_COMPRESSION, min_bytes: int = CHECKPOINT_COMPRESS_MIN_BYTES
+    ) -> None:
+        if method == "zstd" and zstandard is None:
+            logger.warning("zstandard not installed, compressing checkpoints with zlib")
+            method = "zlib"
+        self.method = method
+        self.min_bytes = min_bytes
+
+    def encrypt(self, plaintext: bytes) -> tuple[str, bytes]:
+        """Compress a payload, returning the codec name and the stored bytes."""
+        if self.method == "none" or len(plaintext) < self.min_bytes:
+            return "raw", plaintext
+        if self.method == "zstd":
+            return "zstd", zstandard.compress(plaintext, 3)
+        return "zlib", zlib.compress(plaintext, 6)
+
+    def decrypt(self, ciphername: str, ciphertext: bytes) -> bytes:
+        """Decompress a payload stored with the given codec."""
+        if ciphername == "zstd":
+            if zstandard is None:
+                raise RuntimeError("Checkpoint was compressed with zstd, install zstandard")
+            return zstandard.decompress(ciphertext)
+        if ciphername == "zlib":
+            return zlib.decompress(ciphertext)
+        return ciphertext
+
+
+def compressed_serializer(codec: PayloadCodec | None = None) -> EncryptedSerializer:
+    """Checkpoint serializer that compresses payloads with ``codec``."""
+    return EncryptedSerializer(codec or PayloadCodec(), JsonPlusSerializer())
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def offload_messages(value: Any, min_chars: int = CHECKPOINT_BLOB_MIN_CHARS) -> tuple[Any, dict]:
+    """Replace large tool outputs in a channel value by content-addressed references.
+
+    Args:
+        value: A channel value or pending write (a message or a list of them)
+        min_chars: Tool outputs at least this long are offloaded
+
+    Returns:
+        Tuple of (value with placeholders, {digest: content} of offloaded outputs)
+    """
+    blobs: dict[str, str] = {}
+
+    def visit(item):
+        if isinstance(item, list):
+            replaced = [visit(child) for child in item]
+            if all(new is old for new, old in zip(replaced, item, strict=True)):
+                return item
+            return replaced
+        if (
+            isinstance(item, ToolMessage)
+            and isinstance(item.content, str)
+            and len(item.content) >= min_chars
+        ):
+            digest = _digest(item.content)
+            blobs[digest] = item.content
+            return item.model_copy(
+                update={
+                    "content": f"[tool output stored as {digest[:12]}]",
+                    "additional_kwargs": {**item.additional_kwargs, BLOB_KEY: digest},
+                }
+            )
+        return item
+
+    return visit(value), blobs
+
+
+def collect_refs(value: Any) -> set[str]:
+    """Digests of the offloaded tool outputs referenced by a value."""
+    if isinstance(value, list):
+        return set().union(*(collect_refs(item) for item in value))
+    if isinstance(value, ToolMessage) and BLOB_KEY in value.additional_kwargs:
+        return {value.additional_kwargs[BLOB_KEY]}
+    return set()
+
+
+def restore_messages(value: Any, blobs: dict[str, str]) -> Any:
+    """Put offloaded tool outputs back into a value; unknown digests keep the placeholder."""
+    if isinstance(value, list):
+        return [restore_messages(item, blobs) for item in value]
+    if isinstance(value, ToolMessage) and value.additional_kwargs.get(BLOB_KEY) in blobs:
+        kwargs = dict(value.additional_kwargs)
+        digest = kwargs.pop(BLOB_KEY)
+        return value.model_copy(update={"content": blobs[digest], "additional_kwargs": kwargs})
+    return value
+
+
+@dataclass
+class PruneReport:
+    """Rows removed by one retention run."""
+
+    checkpoints: int = 0
+    writes: int = 0
+    blobs: int = 0
+    content_blobs: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.checkpoints} checkpoints, {self.writes} pending writes, "
+            f"{self.blobs} channel blobs, {self.content_blobs} tool outputs removed"
+        )
+
+
+class CompactPostgresSaver(AsyncPostgresSaver):
+    """AsyncPostgresSaver that keeps checkpoint tables small.
+
+    - Serialized channel values and writes are compressed (see ``PayloadCodec``).
+    - Tool outputs of at least ``blob_min_chars`` are stored once in
+      ``checkpoint_content_blobs`` keyed by their SHA-256, instead of inside
+      every checkpoint that carries the message history.
+    - ``apply_retention`` removes old checkpoints and what no checkpoint
+      references anymore. The base class ``prune`` is left as langgraph
+      defines it.
+    - ``archive_thread`` moves a finished thread to ``*_archive`` tables,
+      ``restore_thread`` moves it back.
+
+    Args:
+        conn: Connection or pool, as for AsyncPostgresSaver
+        pipe: Optional pipeline, as for AsyncPostgresSaver
+        serde: Serializer, compressed JSON+msgpack by default
+        blob_min_chars: Tool outputs at least this long are offloaded
+        cache_size: Offloaded outputs kept in process for loading checkpoints
+    """
+
+    def __init__(
+        self,
+        conn,
+        pipe=None,
+        serde=None,
+        blob_min_chars: int = CHECKPOINT_BLOB_MIN_CHARS,
+        cache_size: int = 256,
+    ) -> None:
+        self.codec = PayloadCodec()
+        super().__init__(conn, pipe=pipe, serde=serde or compressed_serializer(self.codec))
+        self.blob_min_chars = blob_min_chars
+        self.cache_size = cache_size
+        self._contents: OrderedDict[str, str] = OrderedDict()
+
+    async def setup(self) -> None:
+        """Create the checkpoint tables and the shared tool output table."""
+        await super().setup()
+        async with self._cursor() as cur:
+            await cur.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoint_content_blobs ("
+                "hash TEXT PRIMARY KEY, codec TEXT NOT NULL, data BYTEA NOT NULL, "
+                "last_used TIMESTAMPTZ NOT NULL)"
+            )
+            for table in (*THREAD_TABLES, "checkpoint_content_blobs"):
+                await cur.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table}_archive (LIKE {table} INCLUDING ALL)"
+                )
+                # Setup runs again when the langgraph schema changes: give the
+                # archive the columns its migrations added to the hot table
+                archived = await self._columns(cur, f"{table}_archive")
+                for name, (type_, default) in (await self._columns(cur, table)).items():
+                    if name not in archived:
+                        await cur.execute(
+                            f"ALTER TABLE {table}_archive ADD COLUMN {_quote(name)} {type_}"
+                            + (f" DEFAULT {default}" if default is not None else "")
+                        )
+
+    @staticmethod
+    async def _columns(cur, table: str) -> dict[str, tuple[str, str | None]]:
+        """Column types and defaults of a table, in column order."""
+        await cur.execute(
+            "SELECT a.attname AS name, format_type(a.atttypid, a.atttypmod) AS type, "
+            "pg_get_expr(d.adbin, d.adrelid) AS default_expr "
+            "FROM pg_attribute a LEFT JOIN pg_attrdef d "
+            "ON d.adrelid = a.attrelid AND d.adnum = a.attnum "
+            "WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped "
+            "ORDER BY a.attnum",
+            (table,),
+        )
+        return {row["name"]: (row["type"], row["default_expr"]) for row in await cur.fetchall()}
+
+    def _remember(self, blobs: dict[str, str]) -> None:
+        for digest, content in blobs.items():
+            self._contents[digest] = content
+            self._contents.move_to_end(digest)
+        while len(self._contents) > self.cache_size:
+            self._contents.popitem(last=False)
+
+    async def _store(self, blobs: dict[str, str], refs: set[str]) -> None:
+        """Insert new tool outputs and mark all referenced ones as used now."""
+        if not blobs and not refs:
+            return
+        now = datetime.now(timezone.utc)
+        new = [digest for digest in blobs if digest not in self._contents]
+        rows = []
+        for digest in new:
+            codec, data = self.codec.encrypt(blobs[digest].encode())
+            rows.append((digest, codec, data, now))
+        async with self._cursor(pipeline=True) as cur:
+            if rows:
+                await cur.executemany(
+                    "INSERT INTO checkpoint_content_blobs (hash, codec, data, last_used) "
+                    "VALUES (%s, %s, %s, %s) ON CONFLICT (hash) DO UPDATE SET last_used = %s",
+                    [(*row, now) for row in rows],
+                )
+            touched = sorted(refs - set(new))
+            if touched:
+                await cur.execute(
+                    "UPDATE checkpoint_content_blobs SET last_used = %s WHERE hash = ANY(%s)",
+                    (now, touched),
+                )
+        self._remember(blobs)
+
+    async def _fetch(self, digests: set[str]) -> dict[str, str]:
+        """Offloaded tool outputs by digest, from the process cache or the database."""
+        found = {digest: self._contents[digest] for digest in digests if digest in self._contents}
+        missing = sorted(digests - found.keys())
+        if missing:
+            async with self._cursor() as cur:
+                await cur.execute(
+                    "SELECT hash, codec, data FROM checkpoint_content_blobs WHERE hash = ANY(%s)",
+                    (missing,),
+                )
+                rows = await cur.fetchall()
+            loaded = {
+                row["hash"]: self.codec.decrypt(row["codec"], row["data"]).decode() for row in rows
+            }
+            if len(loaded) < len(missing):
+                logger.warning(f"{len(missing) - len(loaded)} offloaded tool outputs are missing")
+            self._remember(loaded)
+            found.update(loaded)
+        return found
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        """Save a checkpoint with large tool outputs offloaded."""
+        values = checkpoint["channel_values"]
+        blobs: dict[str, str] = {}
+        refs: set[str] = set()
+        updated = {}
+        for channel, value in values.items():
+            offloaded, found = offload_messages(value, self.blob_min_chars)
+            # Every output still in the state is marked as used, so retention can
+            # tell live outputs from those only older checkpoints referenced
+            refs.update(found)
+            if channel in new_versions:
+                blobs.update(found)
+                updated[channel] = offloaded
+        if refs:
+            checkpoint = {**checkpoint, "channel_values": {**values, **updated}}
+        await self._store(blobs, refs)
+        return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes,
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """Save pending writes with large tool outputs offloaded."""
+        blobs: dict[str, str] = {}
+        offloaded = []
+        for channel, value in writes:
+            value, found = offload_messages(value, self.blob_min_chars)
+            blobs.update(found)
+            offloaded.append((channel, value))
+        await self._store(blobs, set(blobs))
+        await super().aput_writes(config, offloaded, task_id, task_path)
+
+    async def _restore(self, tuples: list) -> list:
+        """Put offloaded tool outputs back into loaded checkpoint tuples."""
+        refs: set[str] = set()
+        for item in tuples:
+            refs.update(collect_refs(list(item.checkpoint["channel_values"].values())))
+            refs.update(collect_refs([value for _, _, value in item.pending_writes or []]))
+        if not refs:
+            return tuples
+
+        blobs = await self._fetch(refs)
+        restored = []
+        for item in tuples:
+            channel_values = {
+                channel: restore_messages(value, blobs)
+                for channel, value in item.checkpoint["channel_values"].items()
+            }
+            writes = [
+                (task, channel, restore_messages(value, blobs))
+                for task, channel, value in item.pending_writes or []
+            ]
+            restored.append(
+                item._replace(
+                    checkpoint={**item.checkpoint, "channel_values": channel_values},
+                    pending_writes=writes,
+                )
+            )
+        return restored
+
+    async def aget_tuple(self, config: RunnableConfig):
+        """Load a checkpoint with its offloaded tool outputs."""
+        item = await super().aget_tuple(config)
+        if item is None:
+            return None
+        [item] = await self._restore([item])
+        return item
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        """List checkpoints with their offloaded tool outputs."""
+        # The base generator holds the connection lock while yielding, so
+        # collect the page before fetching outputs in one query
+        items = [
+            item async for item in super().alist(config, filter=filter, before=before, limit=limit)
+        ]
+        for item in await self._restore(items):
+            yield item
+
+    async def _latest_refs(self, thread_id: str) -> list[str]:
+        """Tool outputs referenced by the newest checkpoints of a thread."""
+        refs: set[str] = set()
+        async for item in super().alist({"configurable": {"thread_id": thread_id}}, limit=20):
+            refs.update(collect_refs(list(item.checkpoint["channel_values"].values())))
+        return sorted(refs)
+
+    async def _move_thread(self, thread_id: str, source: str, target: str) -> int:
+        """Move all rows of a thread between the hot and archive tables.
+
+        Only the columns both tables have are copied, so rows archived before
+        a schema change get the defaults of columns added since.
+        """
+        async with self._cursor() as cur, cur.connection.transaction():
+            moved = 0
+            for table in THREAD_TABLES:
+                target_columns = await self._columns(cur, f"{table}{target}")
+                columns = ", ".join(
+                    _quote(name)
+                    for name in await self._columns(cur, f"{table}{source}")
+                    if name in target_columns
+                )
+                await cur.execute(
+                    f"WITH moved AS (DELETE FROM {table}{source} WHERE thread_id = %s "
+                    f"RETURNING *) INSERT INTO {table}{target} ({columns}) "
+                    f"SELECT {columns} FROM moved ON CONFLICT DO NOTHING",
+                    (thread_id,),
+                )
+                if table == "checkpoints":
+                    moved = cur.rowcount
+        return moved
+
+    async def archive_thread(self, thread_id: str) -> int:
+        """Move a thread to cold storage.
+
+        The tool outputs its latest checkpoints reference are copied along,
+        so the thread can be resumed after ``apply_retention`` dropped them
+        from the hot table.
+
+        Returns:
+            Number of checkpoints archived
+        """
+        refs = await self._latest_refs(thread_id)
+        moved = await self._move_thread(thread_id, "", "_archive")
+        if refs:
+            async with self._cursor() as cur:
+                await cur.execute(
+                    f"INSERT INTO checkpoint_content_blobs_archive ({CONTENT_BLOB_COLUMNS}) "
+                    f"SELECT {CONTENT_BLOB_COLUMNS} FROM checkpoint_content_blobs "
+                    "WHERE hash = ANY(%s) ON CONFLICT DO NOTHING",
+                    (refs,),
+                )
+        logger.info(f"Archived {moved} checkpoints of thread {thread_id}")
+        return moved
+
+    async def restore_thread(self, thread_id: str) -> int:
+        """Move an archived thread back so it can be resumed.
+
+        Returns:
+            Number of checkpoints restored
+        """
+        moved = await self._move_thread(thread_id, "_archive", "")
+        refs = await self._latest_refs(thread_id)
+        if refs:
+            async with self._cursor() as cur:
+                await cur.execute(
+                    f"INSERT INTO checkpoint_content_blobs ({CONTENT_BLOB_COLUMNS}) "
+                    "SELECT hash, codec, data, now() FROM checkpoint_content_blobs_archive "
+                    "WHERE hash = ANY(%s) ON CONFLICT (hash) DO UPDATE SET last_used = now()",
+                    (refs,),
+                )
+        logger.info(f"Restored {moved} checkpoints of thread {thread_id}")
+        return moved
+
+    async def apply_retention(
+        self,
+        keep_last: int = CHECKPOINT_KEEP_LAST,
+        max_age_days: float = CHECKPOINT_MAX_AGE_DAYS,
+    ) -> PruneReport:
+        """Apply the retention policy to all threads.
+
+        The newest checkpoint of every thread is always kept, so pruning
+        never loses a conversation, only its history. Archived threads are
+        left alone.
+
+        Args:
+            keep_last: Checkpoints kept per thread and namespace, 0 for no limit
+            max_age_days: Checkpoints older than this are removed, 0 for no limit
+
+        Returns:
+            Number of rows removed from each table
+        """
+        conditions = []
+        params: dict[str, Any] = {}
+        if keep_last > 0:
+            conditions.append("r.rank > %(keep_last)s")
+            params["keep_last"] = keep_last
+        if max_age_days > 0:
+            conditions.append(
+                "(r.rank > 1 AND (c.checkpoint->>'ts')::timestamptz "
+                "< now() - %(max_age_days)s * interval '1 day')"
+            )
+            params["max_age_days"] = max_age_days
+
+        report = PruneReport()
+        async with self._cursor() as cur:
+            if conditions:
+                await cur.execute(
+                    "DELETE FROM checkpoints c USING ("
+                    "SELECT thread_id, checkpoint_ns, checkpoint_id, row_number() OVER ("
+                    "PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS rank "
+                    "FROM checkpoints) r "
+                    "WHERE c.thread_id = r.thread_id AND c.checkpoint_ns = r.checkpoint_ns "
+                    f"AND c.checkpoint_id = r.checkpoint_id AND ({' OR '.join(conditions)})",
+                    params,
+                )
+                report.checkpoints = cur.rowcount
+
+            await cur.execute(
+                "DELETE FROM checkpoint_writes w WHERE NOT EXISTS ("
+                "SELECT 1 FROM checkpoints c WHERE c.thread_id = w.thread_id "
+                "AND c.checkpoint_ns = w.checkpoint_ns AND c.checkpoint_id = w.checkpoint_id)"
+            )
+            report.writes = cur.rowcount
+
+            await cur.execute(
+                "DELETE FROM checkpoint_blobs b WHERE NOT EXISTS ("
+                "SELECT 1 FROM checkpoints c WHERE c.thread_id = b.thread_id "
+                "AND c.checkpoint_ns = b.checkpoint_ns "
+                "AND c.checkpoint->'channel_versions'->>b.channel = b.version)"
+            )
+            report.blobs = cur.rowcount
+
+            # Outputs are marked as used whenever a checkpoint holding them is
+            # written, so anything unused since the oldest remaining checkpoint
+            # is unreferenced; the hour of slack covers clock skew between hosts
+            await cur.execute(
+                "DELETE FROM checkpoint_content_blobs WHERE last_used < ("
+                "SELECT COALESCE(min((checkpoint->>'ts')::timestamptz), now()) "
+                "FROM checkpoints) - interval '1 hour'"
+            )
+            report.content_blobs = cur.rowcount
+
+        self._contents.clear()
+        logger.info(f"Checkpoint retention: {report}")
+        return report
@@ -0,0 +1,162 @@
+"""Postgres connection pool: warm-up, health checks and statistics."""
+
+import asyncio
+import logging
+import os
+from contextlib import suppress
+
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+logger = logging.getLogger(__name__)
+
+DB_POOL_MIN = int(os.getenv("ESPAGENT_DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("ESPAGENT_DB_POOL_MAX", "20"))
+# Seconds to wait at startup for min connections, 0 opens them in the background
+DB_POOL_WARMUP = float(os.getenv("ESPAGENT_DB_POOL_WARMUP", "5"))
+# Seconds between health checks of idle connections, 0 disables
+DB_POOL_CHECK_INTERVAL = float(os.getenv("ESPAGENT_DB_POOL_CHECK_INTERVAL", "60"))
+# Executions of a query before psycopg prepares it on a connection; empty
+# disables prepared statements (needed behind PgBouncer in transaction mode)
+DB_PREPARE_THRESHOLD = os.getenv("ESPAGENT_DB_PREPARE_THRESHOLD", "0")
+
+
+class PoolMonitor:
+    """Keeps idle connections healthy and reports pool statistics.
+
+    Idle connections are checked every ``interval`` seconds, so a connection
+    dropped by the server or a firewall is replaced in the background
+    instead of failing the next checkpoint write.
+
+    Args:
+        interval: Seconds between health checks, 0 to disable
+    """
+
+    def __init__(self, interval: float = DB_POOL_CHECK_INTERVAL) -> None:
+        self.interval = interval
+        self.pool: AsyncConnectionPool | None = None
+        self._task: asyncio.Task | None = None
+        self._checks = 0
+        self._check_failures = 0
+        self._reconnect_failures = 0
+
+    def attach(self, pool: AsyncConnectionPool) -> None:
+        """Monitor an opened pool."""
+        self.pool = pool
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._check_loop())
+
+    async def _check_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
+
+    async def check(self) -> None:
+        """Check idle connections; broken ones are discarded and reopened."""
+        if self.pool is None:
+            return
+        self._checks += 1
+        lost = self.pool.get_stats().get("connections_lost", 0)
+        try:
+            await self.pool.check()
+        except Exception as e:
+            self._check_failures += 1
+            logger.warning(f"Database pool check failed: {e!r}")
+            return
+        replaced = self.pool.get_stats().get("connections_lost", 0) - lost
+        if replaced:
+            logger.info(f"Database pool replaced {replaced} broken connections")
+
+    def reconnect_failed(self, pool: AsyncConnectionPool) -> None:
+        """Called by the pool when it gave up reconnecting (``reconnect_failed``)."""
+        self._reconnect_failures += 1
+        logger.error(f"Database pool could not reconnect to {pool.name}")
+
+    def stats(self) -> dict:
+        """Pool size, checkout counts and wait times."""
+        if self.pool is None:
+            return {}
+        raw = self.pool.get_stats()
+        checkouts = raw.get("requests_num", 0)
+        connections = raw.get("connections_num", 0)
+        return {
+            "size": raw.get("pool_size", 0),
+            "available": raw.get("pool_available", 0),
+            "waiting": raw.get("requests_waiting", 0),
+            "checkouts": checkouts,
+            "queued": raw.get("requests_queued", 0),
+            "wait_ms_avg": round(raw.get("requests_wait_ms", 0) / checkouts, 2) if checkouts else 0,
+            "errors": raw.get("requests_errors", 0) + raw.get("connections_errors", 0),
+            "connections": connections,
+            "connect_ms_avg": (
+                round(raw.get("connections_ms", 0) / connections, 2) if connections else 0
+            ),
+            "lost": raw.get("connections_lost", 0),
+            "checks": self._checks,
+            "check_failures": self._check_failures,
+            "reconnect_failures": self._reconnect_failures,
+        }
+
+    async def aclose(self) -> None:
+        """Stop the health checks."""
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+
+pool_monitor = PoolMonitor()
+
+
+def _connection_kwargs() -> dict:
+    threshold = DB_PREPARE_THRESHOLD.strip()
+    return {
+        "autocommit": True,
+        # The checkpoint and store queries are few and repeated every step,
+        # so they are prepared once per connection and reused
+        "prepare_threshold": int(threshold) if threshold else None,
+        # TCP keepalives surface dead connections without waiting for a query
+        "keepalives": 1,
+        "keepalives_idle": 30,
+    }
+
+
+async def open_pool(
+    conninfo: str,
+    min_size: int = DB_POOL_MIN,
+    max_size: int = DB_POOL_MAX,
+    warmup: float = DB_POOL_WARMUP,
+) -> AsyncConnectionPool:
+    """Open a monitored pool and wait until its minimum connections are ready.
+
+    Keeping ``min_size`` connections open means the first checkpoint write
+    after an idle period does not pay for a new connection. If the warm-up
+    times out, startup continues and connections keep being opened in the
+    background.
+
+    Args:
+        conninfo: Postgres connection string
+        min_size: Connections kept open
+        max_size: Upper bound of connections
+        warmup: Seconds to wait for ``min_size`` connections, 0 to not wait
+
+    Returns:
+        The opened pool
+    """
+    pool = AsyncConnectionPool(
+        conninfo=conninfo,
+        min_size=min_size,
+        max_size=max_size,
+        kwargs=_connection_kwargs(),
+        name="espagent",
+        open=False,
+        reconnect_failed=pool_monitor.reconnect_failed,
+    )
+    await pool.open()
+    if min_size and warmup > 0:
+        try:
+            await pool.wait(timeout=warmup)
+        except PoolTimeout:
+            logger.warning(f"Database pool not warm after {warmup}s, continuing")
+    pool_monitor.attach(pool)
+    return pool
@@ -0,0 +1,91 @@
+"""Local embedding models for memory search."""
+
+import hashlib
+import logging
+import math
+import os
+import re
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS = os.getenv("ESPAGENT_EMBEDDINGS", "hashing")
+EMBEDDING_DIMS = int(os.getenv("ESPAGENT_EMBEDDING_DIMS", "512"))
+
+# Latin words/identifiers, and individual CJK characters (paired into bigrams)
+_WORD_RE = re.compile(r"[a-z0-9_]+(?:[.\-][a-z0-9_]+)*")
+_CJK_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase words and CJK character bigrams."""
+    text = text.lower()
+    terms = _WORD_RE.findall(text)
+    for run in _CJK_RE.findall(text):
+        terms.extend(run if len(run) == 1 else (run[i : i + 2] for i in range(len(run) - 1)))
+    return terms
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic, offline embeddings based on feature hashing.
+
+    Words, word bigrams and CJK character bigrams are hashed into a fixed
+    number of signed buckets and L2-normalized, so texts sharing terms get a
+    high cosine similarity. No model download or network access is needed,
+    which also makes results reproducible in tests.
+
+    Args:
+        dims: Number of dimensions of the produced vectors
+    """
+
+    def __init__(self, dims: int = EMBEDDING_DIMS) -> None:
+        self.dims = dims
+
+    @staticmethod
+    def _features(text: str) -> list[str]:
+        words = _WORD_RE.findall(text.lower())
+        features = tokenize(text)
+        features.extend(f"{a} {b}" for a, b in zip(words, words[1:], strict=False))
+        return features
+
+    def _embed(self, text: str) -> list[float]:
+        vector = [0.0] * self.dims
+        for feature in self._features(text):
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dims] += 1.0 if value >> 63 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector))
+        if norm:
+            vector = [v / norm for v in vector]
+        return vector
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed a list of documents."""
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed a query."""
+        return self._embed(text)
+
+
+def get_embeddings() -> tuple[Embeddings, int]:
+    """Create the embedding model selected by ``ESPAGENT_EMBEDDINGS``.
+
+    ``hashing`` (default) uses :class:`HashingEmbeddings`. ``huggingface:<model>``
+    runs a local sentence-transformers model and requires the optional
+    ``langchain-huggingface`` package; if it is missing, hashing is used.
+
+    Returns:
+        A tuple of (embeddings, dims)
+    """
+    if EMBEDDINGS.startswith("huggingface:"):
+        try:
+            from langchain_huggingface import HuggingFaceEmbeddings
+        except ImportError:
+            logger.warning("langchain-huggingface not installed, using hashing embeddings")
+        else:
+            embeddings = HuggingFaceEmbeddings(model_name=EMBEDDINGS.split(":", 1)[1])
+            return embeddings, len(embeddings.embed_query("dimension probe"))
+
+    return HashingEmbeddings(EMBEDDING_DIMS), EMBEDDING_DIMS
@@ -4,84 +4,185 @@ import json
 
 from langgraph.graph.state import Command
 
+from .approval import ApprovalPolicy, approval_policy
+from .streaming import stream_turn
+from .terminal import TerminalInput
+
+# Decisions HumanInTheLoopMiddleware accepts when a tool does not restrict them
+DECISIONS = ("approve", "edit", "reject")
+
 
 class HumanInTheLoop:
-    """Minimal HITL processor - handles user interaction and decisions only."""
+    """Minimal HITL processor - handles user interaction and decisions only.
+
+    Calls the approval policy decides are answered without asking; the rest
+    can be approved one by one or all at once.
+
+    Args:
+        terminal: Input shared with the console prompt
+        policy: Approval rules and session approvals
+    """
 
-    async def handle_interrupt(
+    def __init__(
+        self, terminal: TerminalInput | None = None, policy: ApprovalPolicy | None = None
+    ) -> None:
+        self.terminal = terminal or TerminalInput()
+        self.policy = policy or approval_policy
+
+    async def handle_interrupts(
         self,
         agent,
-        snapshot,
+        interrupts: list,
         thread_config: dict,
     ) -> bool:
-        """Handle a single interrupt event.
+        """Ask for decisions on pending interrupts and resume until none are left.
 
         Args:
             agent: LangGraph agent
-            snapshot: Agent state snapshot
+            interrupts: Interrupts reported by the stream (see ``stream_turn``)
             thread_config: Thread configuration
 
         Returns:
             True if execution was resumed, False otherwise
         """
-        if not snapshot.tasks:
-            return False
+        thread_id = thread_config["configurable"].get("thread_id")
+        resumed = False
+        while interrupts:
+            resume = {}
+            for interrupt in interrupts:
+                # HumanInTheLoopMiddleware asks for one decision per action request
+                requests = interrupt.value.get("action_requests", [])
+                configs = {
+                    config["action_name"]: config["allowed_decisions"]
+                    for config in interrupt.value.get("review_configs", [])
+                }
+                allowed = [configs.get(request["name"], DECISIONS) for request in requests]
+                decisions = [self.policy.decide(request, thread_id) for request in requests]
+                for idx, (request, decision) in enumerate(zip(requests, decisions, strict=True)):
+                    if decision is None:
+                        continue
+                    # The middleware refuses decisions the tool does not allow
+                    if decision["type"] not in allowed[idx]:
+                        decisions[idx] = None
+                        continue
+                    print(f"   🛡️  [Policy] {decision['type']} {request['name']}")
+
+                pending = [i for i, decision in enumerate(decisions) if decision is None]
+                if len(pending) > 1:
+                    batch = await self._get_batch_decision(
+                        [requests[i] for i in pending],
+                        thread_id,
+                        [d for d in DECISIONS if all(d in allowed[i] for i in pending)],
+                    )
+                    for i in pending:
+                        decisions[i] = batch
+                for idx in pending:
+                    request = requests[idx]
+                    if decisions[idx] is None:
+                        print(f"\n[Tool {idx + 1}/{len(requests)}] {request['name']}")
+                        print(f"Args: {json.dumps(request['args'], indent=2, ensure_ascii=False)}")
+                        decisions[idx] = await self._get_decision(request, thread_id, allowed[idx])
+                    self.policy.record(request, decisions[idx], thread_id, "user")
+                resume[interrupt.id] = {"decisions": decisions}
+
+            # Resume execution
+            print("\n[System]: Continuing execution...\n")
+            result = await stream_turn(agent, Command(resume=resume), thread_config)
+            interrupts = result.interrupts
+            resumed = True
+        return resumed
 
-        # Get pending tool calls for approval
-        last_msg = snapshot.values["messages"][-1]
-        if not (hasattr(last_msg, "tool_calls") and last_msg.tool_calls):
-            return False
+    async def _get_batch_decision(
+        self, requests: list[dict], thread_id: str | None, allowed: list[str]
+    ) -> dict | None:
+        """Get one decision for several pending calls.
 
-        tool_calls = last_msg.tool_calls
-        decisions = []
+        Args:
+            requests: The action requests waiting for the user
+            thread_id: Thread the calls belong to
+            allowed: Decisions every one of the calls allows
 
-        # Process each tool call individually
-        for idx, tool_call in enumerate(tool_calls, 1):
-            print(f"\n[Tool {idx}/{len(tool_calls)}] {tool_call['name']}")
-            print(f"Args: {json.dumps(tool_call['args'], indent=2, ensure_ascii=False)}")
+        Returns:
+            Decision for all of them, or None to review them one by one
+        """
+        print(f"\n{len(requests)} tool calls need approval:")
+        for idx, request in enumerate(requests, 1):
+            args = json.dumps(request["args"], ensure_ascii=False)
+            print(f"  {idx}. {request['name']} {args[:120]}")
+        options = []
+        if "approve" in allowed:
+            options += ["(y)approve all", "(s)approve all for this session"]
+        if "reject" in allowed:
+            options.append("(n)reject all")
+        options.append("(r)eview each")
+        while True:
+            choice = await self.terminal.prompt(f"\n{' / '.join(options)}: ")
+            choice = choice.strip().lower()
 
-            decision = self._get_decision(tool_call)
-            if decision:
-                decisions.append(decision)
+            if choice == "y" and "approve" in allowed:
+                return {"type": "approve"}
 
-        # Resume execution
-        if decisions:
-            print("\n[System]: Continuing execution...\n")
-            async for chunk in agent.astream(
-                Command(resume={"decisions": decisions}),
-                config=thread_config,
-                stream_mode="values",
-            ):
-                msg = chunk["messages"][-1]
-                if msg.type == "ai" and msg.content:
-                    print(f"🤖 {msg.content}", end="", flush=True)
-            return True
-
-        return False
-
-    def _get_decision(self, tool_call: dict) -> dict | None:
+            elif choice == "s" and "approve" in allowed:
+                for request in requests:
+                    self.policy.grant(request, thread_id)
+                return {"type": "approve"}
+
+            elif choice == "n" and "reject" in allowed:
+                reason = await self.terminal.prompt("Rejection reason (optional): ")
+                return {
+                    "type": "reject",
+                    "message": reason.strip() or "Rejected by administrator",
+                }
+
+            elif choice == "r":
+                return None
+
+            else:
+                print("❌ Invalid input")
+
+    async def _get_decision(
+        self,
+        tool_call: dict,
+        thread_id: str | None = None,
+        allowed: list[str] | tuple[str, ...] = DECISIONS,
+    ) -> dict | None:
         """Get user's approve/edit/reject decision.
 
         Args:
-            tool_call: The tool call dict containing name and args
+            tool_call: The tool call (action request) containing name and args
+            thread_id: Thread the call belongs to, for session approvals
+            allowed: Decisions the tool allows; only these are offered
 
         Returns:
             Decision dict or None
         """
+        options = []
+        if "approve" in allowed:
+            scope = self.policy.describe_scope(tool_call)
+            options += ["(y)approve", f"(s)approve {scope} for this session"]
+        if "edit" in allowed:
+            options.append("(e)dit")
+        if "reject" in allowed:
+            options.append("(n)reject")
         while True:
-            choice = input("\n(y)approve / (e)dit / (n)reject: ").strip().lower()
+            choice = await self.terminal.prompt(f"\n{' / '.join(options)}: ")
+            choice = choice.strip().lower()
+
+            if choice == "y" and "approve" in allowed:
+                return {"type": "approve"}
 
-            if choice == "y":
+            elif choice == "s" and "approve" in allowed:
+                self.policy.grant(tool_call, thread_id)
                 return {"type": "approve"}
 
-            elif choice == "e":
+            elif choice == "e" and "edit" in allowed:
                 print(
                     f"\nCurrent args: {json.dumps(tool_call['args'], indent=2, ensure_ascii=False)}"
                 )
-                edited_json = input("Enter edited args (JSON format): ").strip()
+                edited_json = await self.terminal.prompt("Enter edited args (JSON format): ")
 
                 try:
-                    edited_args = json.loads(edited_json)
+                    edited_args = json.loads(edited_json.strip())
                     return {
                         "type": "edit",
                         "edited_action": {"name": tool_call["name"], "args": edited_args},
@@ -90,11 +191,11 @@ class HumanInTheLoop:
                     print("❌ JSON format error, please retry")
                     continue
 
-            elif choice == "n":
-                reason = input("Rejection reason (optional): ").strip()
+            elif choice == "n" and "reject" in allowed:
+                reason = await self.terminal.prompt("Rejection reason (optional): ")
                 return {
                     "type": "reject",
-                    "message": reason or "Rejected by administrator",
+                    "message": reason.strip() or "Rejected by administrator",
                 }
 
             else:
@@ -0,0 +1,167 @@
+"""On-disk cache of deterministic LLM responses."""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Sequence
+from pathlib import Path
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+
+logger = logging.getLogger(__name__)
+
+# Empty disables the cache
+LLM_CACHE_PATH = os.getenv("ESPAGENT_LLM_CACHE", "")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("ESPAGENT_LLM_CACHE_MAX_ENTRIES", "10000"))
+LLM_CACHE_MAX_MB = float(os.getenv("ESPAGENT_LLM_CACHE_MAX_MB", "256"))
+
+
+def _dump(generations: Sequence[Generation]) -> str:
+    return json.dumps(
+        [
+            {"message": message_to_dict(g.message)}
+            if isinstance(g, ChatGeneration)
+            else {"text": g.text}
+            for g in generations
+        ],
+        ensure_ascii=False,
+    )
+
+
+def _load(payload: str) -> list[Generation]:
+    generations: list[Generation] = []
+    for item in json.loads(payload):
+        if "message" in item:
+            [message] = messages_from_dict([item["message"]])
+            generations.append(ChatGeneration(message=message))
+        else:
+            generations.append(Generation(text=item["text"]))
+    return generations
+
+
+class SQLiteLLMCache(BaseCache):
+    """LLM response cache in a local SQLite file with LRU eviction.
+
+    Entries are keyed on a hash of the serialized prompt messages and the
+    model's ``llm_string`` (model name, parameters and bound tools), so a
+    hit is only possible for an identical request. Only attach it to
+    ``temperature=0`` models, where the response is a function of the request.
+
+    Args:
+        path: SQLite database file
+        max_entries: Entries kept before the least recently used are evicted
+        max_bytes: Total payload size kept before evicting
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        max_bytes: int = int(LLM_CACHE_MAX_MB * 1024 * 1024),
+    ) -> None:
+        self.path = Path(path).expanduser()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_lru ON llm_cache (last_used)")
+        self._entries, self._bytes = self._totals()
+
+    def _totals(self) -> tuple[int, int]:
+        query = "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+        count, size = self._db.execute(query).fetchone()
+        return count, size
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode()).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> RETURN_VAL_TYPE | None:
+        """Return the cached generations of an identical request."""
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            row = self._db.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                logger.debug(f"LLM cache miss {key[:12]}")
+                return None
+            self._db.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        logger.debug(f"LLM cache hit {key[:12]}")
+        return _load(row[0])
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        """Store the generations of a request and evict if over budget."""
+        key = self._key(prompt, llm_string)
+        value = _dump(return_val)
+        size = len(value.encode())
+        with self._lock:
+            previous = self._db.execute(
+                "SELECT size FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            if previous is None:
+                self._entries += 1
+                self._bytes += size
+            else:
+                self._bytes += size - previous[0]
+            if self._entries > self.max_entries or self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Drop least recently used entries down to 90% of both budgets."""
+        keep_entries = int(self.max_entries * 0.9)
+        keep_bytes = int(self.max_bytes * 0.9)
+        rows = self._db.execute("SELECT key, size FROM llm_cache ORDER BY last_used").fetchall()
+        doomed = []
+        for key, size in rows:
+            if self._entries <= keep_entries and self._bytes <= keep_bytes:
+                break
+            doomed.append((key,))
+            self._entries -= 1
+            self._bytes -= size
+        self._db.executemany("DELETE FROM llm_cache WHERE key = ?", doomed)
+        logger.info(f"LLM cache evicted {len(doomed)} entries")
+
+    def clear(self, **kwargs) -> None:
+        """Remove all entries."""
+        with self._lock:
+            self._db.execute("DELETE FROM llm_cache")
+            self._entries, self._bytes = 0, 0
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current size."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": self._entries,
+            "bytes": self._bytes,
+        }
+
+
+def get_llm_cache() -> SQLiteLLMCache | None:
+    """Create the cache configured by ``ESPAGENT_LLM_CACHE``, or None if disabled."""
+    if not LLM_CACHE_PATH:
+        return None
+    return SQLiteLLMCache(LLM_CACHE_PATH)
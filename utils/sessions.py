@@ -0,0 +1,139 @@
+"""Conversation sessions: one checkpointer thread per console session."""
+
+import logging
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+
+from langgraph.store.base import BaseStore
+
+logger = logging.getLogger(__name__)
+
+TITLE_CHARS = 60
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@dataclass
+class Session:
+    """A conversation thread and what is shown about it in listings."""
+
+    thread_id: str
+    title: str = ""
+    created_at: str = field(default_factory=_now)
+    updated_at: str = field(default_factory=_now)
+    turns: int = 0
+    archived: bool = False
+
+    def __str__(self) -> str:
+        state = " [archived]" if self.archived else ""
+        return (
+            f"{self.thread_id}  {self.updated_at[:16].replace('T', ' ')}  "
+            f"{self.turns} turns  {self.title or '(empty)'}{state}"
+        )
+
+
+class SessionManager:
+    """Tracks a user's sessions in the store and switches between them.
+
+    Every console launch starts a new thread, so state loads, summarization
+    and checkpoint writes only deal with the current conversation; what
+    should outlive a session belongs in long-term memory. A session is
+    registered under ``("sessions", user_id)`` on its first turn.
+
+    Archiving moves the thread's checkpoints to cold storage when the
+    checkpointer supports it (``archive_thread``/``restore_thread``);
+    resuming an archived session brings them back.
+
+    Args:
+        store: The LangGraph store holding the session index
+        checkpointer: The agent's checkpointer
+        user_id: Owner of the sessions
+    """
+
+    def __init__(self, store: BaseStore, checkpointer, user_id: str) -> None:
+        self.store = store
+        self.checkpointer = checkpointer
+        self.user_id = user_id
+        self.namespace = ("sessions", user_id)
+        self.current = self.new()
+        self._listed: list[Session] = []
+
+    def new(self) -> Session:
+        """Start a new, not yet registered session and make it current."""
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.current = Session(f"{self.user_id}-{stamp}-{uuid.uuid4().hex[:4]}")
+        return self.current
+
+    @property
+    def thread_id(self) -> str:
+        """Thread of the current session."""
+        return self.current.thread_id
+
+    async def _save(self, session: Session) -> None:
+        await self.store.aput(self.namespace, session.thread_id, asdict(session), index=False)
+
+    async def record_turn(self, text: str) -> None:
+        """Register a user turn in the current session, titling it on the first one."""
+        session = self.current
+        if not session.title:
+            session.title = " ".join(text.split())[:TITLE_CHARS]
+        session.turns += 1
+        session.updated_at = _now()
+        await self._save(session)
+
+    async def list(self, limit: int = 20) -> list[Session]:
+        """Registered sessions, most recently used first.
+
+        The positions in this listing can be passed to :meth:`find`.
+        """
+        items = await self.store.asearch(self.namespace, limit=1000)
+        sessions = sorted(
+            (Session(**item.value) for item in items),
+            key=lambda session: session.updated_at,
+            reverse=True,
+        )
+        self._listed = sessions[:limit]
+        return self._listed
+
+    async def find(self, ref: str) -> Session | None:
+        """Look a session up by listing position (1-based) or thread id prefix."""
+        if ref.isdigit() and 0 < int(ref) <= len(self._listed):
+            return self._listed[int(ref) - 1]
+        matches = [
+            session for session in await self.list(1000) if session.thread_id.startswith(ref)
+        ]
+        return matches[0] if len(matches) == 1 else None
+
+    async def resume(self, ref: str) -> Session | None:
+        """Make a past session current, restoring it from cold storage if archived."""
+        session = await self.find(ref)
+        if session is None:
+            return None
+        if session.archived:
+            if hasattr(self.checkpointer, "restore_thread"):
+                await self.checkpointer.restore_thread(session.thread_id)
+            session.archived = False
+            await self._save(session)
+        self.current = session
+        logger.info(f"Resumed session {session.thread_id}")
+        return session
+
+    async def archive(self, ref: str | None = None) -> Session | None:
+        """Archive a session (the current one by default).
+
+        Archiving the current session starts a new one.
+        """
+        session = self.current if ref is None else await self.find(ref)
+        if session is None or not session.turns:
+            return None
+        if hasattr(self.checkpointer, "archive_thread"):
+            await self.checkpointer.archive_thread(session.thread_id)
+        session.archived = True
+        await self._save(session)
+        if session.thread_id == self.current.thread_id:
+            self.new()
+        logger.info(f"Archived session {session.thread_id}")
+        return session
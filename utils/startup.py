@@ -0,0 +1,51 @@
+"""Per-phase timing of the console startup."""
+
+import time
+from collections.abc import Awaitable
+from contextlib import contextmanager
+from typing import TypeVar
+
+T = TypeVar("T")
+
+
+class StartupProfile:
+    """Records when each startup phase ran, including phases that overlap.
+
+    Times are relative to the creation of the profile; the CPU time spent
+    before it (interpreter start and module imports) is reported separately.
+    """
+
+    def __init__(self) -> None:
+        self.imports = time.process_time()
+        self._start = time.perf_counter()
+        self.phases: list[tuple[str, float, float]] = []
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time the enclosed block as one phase."""
+        start = time.perf_counter() - self._start
+        try:
+            yield
+        finally:
+            self.phases.append((name, start, time.perf_counter() - self._start))
+
+    async def timed(self, name: str, awaitable: Awaitable[T]) -> T:
+        """Await ``awaitable`` as one phase, so concurrent phases can be gathered."""
+        with self.phase(name):
+            return await awaitable
+
+    @property
+    def total(self) -> float:
+        """Seconds from the creation of the profile to the end of the last phase."""
+        return max((end for _, _, end in self.phases), default=0.0)
+
+    def report(self) -> str:
+        """Breakdown with one line per phase, in start order."""
+        lines = [f"   {'imports (cpu)':<18} {'':>17} {self.imports * 1000:8.0f} ms"]
+        for name, start, end in sorted(self.phases, key=lambda phase: phase[1]):
+            lines.append(
+                f"   {name:<18} {start * 1000:6.0f} → {end * 1000:6.0f} ms "
+                f"{(end - start) * 1000:8.0f} ms"
+            )
+        lines.append(f"   {'ready after':<18} {'':>17} {self.total * 1000:8.0f} ms")
+        return "\n".join(lines)
@@ -0,0 +1,187 @@
+"""Token-level rendering of agent runs in the console."""
+
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, TextIO
+
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+
+# Graph node running the agent's model; other nodes (e.g. summarization) may
+# call models too, but their tokens are not part of the answer
+MODEL_NODE = "model"
+TOOLS_NODE = "tools"
+
+
+def _is_answer(metadata: dict) -> bool:
+    """Whether a streamed chunk belongs to the agent's answer.
+
+    Middleware also calls models inside the model node (the LLM tool
+    selector fallback, summarization); those calls are tagged with
+    ``lc_source`` and are not part of the answer.
+    """
+    return metadata.get("langgraph_node") == MODEL_NODE and not metadata.get("lc_source")
+
+
+@dataclass
+class TurnResult:
+    """What happened while streaming one run of the agent."""
+
+    interrupts: list = field(default_factory=list)
+    first_token: float | None = None
+    duration: float = 0.0
+    tool_calls: int = 0
+
+    def __str__(self) -> str:
+        first = f"{self.first_token:.2f}s" if self.first_token is not None else "-"
+        return f"first token {first}, total {self.duration:.2f}s, {self.tool_calls} tool calls"
+
+
+class TurnStats:
+    """Time-to-first-token over the turns of a session."""
+
+    def __init__(self) -> None:
+        self._first_tokens: list[float] = []
+        self.turns = 0
+
+    def record(self, result: TurnResult) -> None:
+        """Add a finished run."""
+        self.turns += 1
+        if result.first_token is not None:
+            self._first_tokens.append(result.first_token)
+
+    def stats(self) -> dict:
+        """Number of turns and time-to-first-token in milliseconds."""
+        samples = self._first_tokens
+        return {
+            "turns": self.turns,
+            "ttft_ms_p50": round(statistics.median(samples) * 1000) if samples else 0,
+            "ttft_ms_max": round(max(samples) * 1000) if samples else 0,
+        }
+
+
+turn_stats = TurnStats()
+
+
+class _Printer:
+    """Writes tokens and events, starting events on a fresh line."""
+
+    def __init__(self, out: TextIO) -> None:
+        self.out = out
+        self.in_text = False
+
+    def token(self, text: str) -> None:
+        if not self.in_text:
+            self.out.write("🤖 Agent: ")
+            self.in_text = True
+        self.out.write(text)
+        self.out.flush()
+
+    def end_text(self) -> None:
+        if self.in_text:
+            self.out.write("\n")
+            self.in_text = False
+
+    def event(self, line: str) -> None:
+        self.end_text()
+        self.out.write(f"{line}\n")
+        self.out.flush()
+
+
+async def stream_turn(agent, payload: Any, config: dict, out: TextIO | None = None) -> TurnResult:
+    """Run the agent and print model tokens and tool events as they happen.
+
+    Streams ``messages`` (token chunks) and ``updates`` (per-node deltas)
+    instead of ``values``, so the full state is never materialized per
+    step. Pending human-in-the-loop interrupts are taken from the stream,
+    so no state load is needed after the turn to find them.
+
+    Args:
+        agent: The agent graph
+        payload: Input or ``Command`` to run
+        config: Thread configuration
+        out: Where to print, stdout by default
+
+    Returns:
+        Interrupts raised by the run and its timings
+    """
+    printer = _Printer(out or sys.stdout)
+    result = TurnResult()
+    start = time.perf_counter()
+    # Answers already printed chunk by chunk
+    streamed: set[str | None] = set()
+    async for mode, chunk in agent.astream(
+        payload, config=config, stream_mode=["messages", "updates"]
+    ):
+        if mode == "messages":
+            message, metadata = chunk
+            if isinstance(message, AIMessage):
+                # Models that do not stream (and LLM cache hits) emit one
+                # complete AIMessage instead of chunks
+                complete = not isinstance(message, AIMessageChunk)
+                if complete and message.id in streamed:
+                    continue
+                if _is_answer(metadata) and message.text:
+                    if not complete:
+                        streamed.add(message.id)
+                    if result.first_token is None:
+                        result.first_token = time.perf_counter() - start
+                    printer.token(message.text)
+            elif isinstance(message, ToolMessage):
+                mark = "❌" if message.status == "error" else "✅"
+                printer.event(
+                    f"   {mark} [Tool finished]: {message.name} ({len(message.text)} chars)"
+                )
+            continue
+
+        for node, update in chunk.items():
+            if node == "__interrupt__":
+                result.interrupts.extend(update)
+                continue
+            messages = update.get("messages", []) if isinstance(update, dict) else []
+            for message in messages:
+                if isinstance(message, AIMessage) and message.tool_calls:
+                    for tool_call in message.tool_calls:
+                        result.tool_calls += 1
+                        printer.event(f"   🔧 [Calling tool]: {tool_call['name']}")
+
+    printer.end_text()
+    result.duration = time.perf_counter() - start
+    turn_stats.record(result)
+    return result
+
+
+async def close_cancelled_turn(agent, config: dict) -> int:
+    """Answer the tool calls a cancelled turn left without results.
+
+    A turn cancelled while tools run (or while an approval is pending)
+    leaves the last AI message's tool calls unanswered, and the model
+    rejects a history like that on the next turn.
+
+    Args:
+        agent: The agent graph
+        config: Thread configuration
+
+    Returns:
+        Number of tool calls marked as cancelled
+    """
+    snapshot = await agent.aget_state(config)
+    messages = snapshot.values.get("messages", [])
+    answered = {m.tool_call_id for m in messages if isinstance(m, ToolMessage)}
+    last_ai = next((m for m in reversed(messages) if isinstance(m, AIMessage)), None)
+    if last_ai is None:
+        return 0
+    cancelled = [
+        ToolMessage(
+            "Cancelled by the user",
+            tool_call_id=call["id"],
+            name=call["name"],
+            status="error",
+        )
+        for call in last_ai.tool_calls
+        if call["id"] not in answered
+    ]
+    if cancelled:
+        await agent.aupdate_state(config, {"messages": cancelled}, as_node=TOOLS_NODE)
+    return len(cancelled)
@@ -0,0 +1,205 @@
+"""Non-blocking terminal input and Ctrl+C handling for the console."""
+
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+from collections.abc import Awaitable, Callable
+from contextlib import contextmanager, suppress
+from pathlib import Path
+from typing import TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+HISTORY_FILE = os.getenv("ESPAGENT_HISTORY_FILE", str(Path.home() / ".espagent_history"))
+
+
+class InputInterruptedError(Exception):
+    """Ctrl+C was pressed while waiting for input."""
+
+
+class TurnCancelledError(Exception):
+    """The running turn was cancelled with Ctrl+C."""
+
+
+class _Interrupts:
+    """Routes SIGINT to the innermost registered callback.
+
+    ``loop.add_signal_handler`` keeps a single handler per signal, so nested
+    users (a turn that prompts for an approval) share one registration and
+    the previous Python handler is put back when the last one leaves.
+    """
+
+    def __init__(self) -> None:
+        self._callbacks: list[Callable[[], None]] = []
+        self._previous = None
+
+    def _dispatch(self) -> None:
+        if self._callbacks:
+            self._callbacks[-1]()
+
+    @contextmanager
+    def handler(self, callback: Callable[[], None]):
+        loop = asyncio.get_running_loop()
+        if not self._callbacks:
+            previous = signal.getsignal(signal.SIGINT)
+            try:
+                loop.add_signal_handler(signal.SIGINT, self._dispatch)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # No signal support (Windows, not the main thread): Ctrl+C
+                # keeps its default behavior
+                yield
+                return
+            self._previous = previous
+        self._callbacks.append(callback)
+        try:
+            yield
+        finally:
+            self._callbacks.pop()
+            if not self._callbacks:
+                loop.remove_signal_handler(signal.SIGINT)
+                signal.signal(signal.SIGINT, self._previous)
+
+
+interrupts = _Interrupts()
+
+
+async def interruptible(awaitable: Awaitable[T]) -> T:
+    """Await ``awaitable`` with Ctrl+C cancelling it instead of the console.
+
+    Args:
+        awaitable: The work to run, e.g. one agent turn
+
+    Returns:
+        The result of ``awaitable``
+
+    Raises:
+        TurnCancelledError: Ctrl+C was pressed before it finished
+    """
+    task = asyncio.ensure_future(awaitable)
+    with interrupts.handler(task.cancel):
+        try:
+            return await task
+        except InputInterruptedError:
+            raise TurnCancelledError from None
+        except asyncio.CancelledError:
+            current = asyncio.current_task()
+            # Only swallow our own cancellation, not one aimed at the caller
+            # (Task.cancelling is Python 3.11+)
+            outer = getattr(current, "cancelling", lambda: 0)()
+            if task.cancelled() and not outer:
+                raise TurnCancelledError from None
+            raise
+
+
+def _prompt_toolkit_available() -> bool:
+    try:
+        import prompt_toolkit  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class TerminalInput:
+    """Reads console input without blocking the event loop.
+
+    With ``prompt_toolkit`` installed and a terminal attached, input gets
+    line editing and a persistent history. Otherwise lines are read from
+    stdin in a daemon thread, so a pending read never holds up shutdown.
+    Either way pool health checks, MCP keepalives and background jobs keep
+    running while the user types.
+
+    Args:
+        history_file: Where the main prompt's history is kept
+    """
+
+    def __init__(self, history_file: str | None = HISTORY_FILE) -> None:
+        self.history_file = history_file
+        self.rich = sys.stdin.isatty() and _prompt_toolkit_available()
+        self._sessions: dict[bool, object] = {}
+        self._pending: asyncio.Future | None = None
+
+    def _session(self, history: bool):
+        if history not in self._sessions:
+            from prompt_toolkit import PromptSession
+            from prompt_toolkit.history import FileHistory, InMemoryHistory
+
+            store = InMemoryHistory()
+            if history and self.history_file:
+                try:
+                    store = FileHistory(self.history_file)
+                except OSError as e:
+                    logger.warning(f"Input history disabled: {e}")
+            self._sessions[history] = PromptSession(history=store)
+        return self._sessions[history]
+
+    async def prompt(self, message: str, history: bool = False) -> str:
+        """Read one line.
+
+        Args:
+            message: Prompt shown before the input
+            history: Keep the line in the persistent history (main prompt only)
+
+        Returns:
+            The line without its trailing newline
+
+        Raises:
+            EOFError: Input was closed (Ctrl+D)
+            InputInterruptedError: Ctrl+C was pressed
+        """
+        if self.rich:
+            try:
+                return await self._session(history).prompt_async(message)
+            except KeyboardInterrupt:
+                raise InputInterruptedError from None
+
+        sys.stdout.write(message)
+        sys.stdout.flush()
+        loop = asyncio.get_running_loop()
+        # A read cut short by Ctrl+C stays pending, so the line typed next is
+        # not swallowed by an orphaned thread
+        if self._pending is None or self._pending.get_loop() is not loop:
+            self._pending = self._read_line(loop)
+        interrupted = loop.create_future()
+
+        def interrupt() -> None:
+            if not interrupted.done():
+                interrupted.set_result(None)
+
+        with interrupts.handler(interrupt):
+            await asyncio.wait({self._pending, interrupted}, return_when=asyncio.FIRST_COMPLETED)
+        if not self._pending.done():
+            raise InputInterruptedError
+        pending, self._pending = self._pending, None
+        line = pending.result()
+        if not line:
+            raise EOFError
+        return line.rstrip("\n")
+
+    @staticmethod
+    def _read_line(loop: asyncio.AbstractEventLoop) -> asyncio.Future:
+        future = loop.create_future()
+
+        def settle(line: str | None, error: Exception | None) -> None:
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(line)
+
+        def read() -> None:
+            try:
+                line, error = sys.stdin.readline(), None
+            except Exception as e:
+                line, error = None, e
+            # The loop may be gone if the console exited while reading
+            with suppress(RuntimeError):
+                loop.call_soon_threadsafe(settle, line, error)
+
+        threading.Thread(target=read, name="espagent-input", daemon=True).start()
+        return future
@@ -0,0 +1,84 @@
+"""Incremental token accounting for agent message histories."""
+
+from collections.abc import Callable, Iterable
+
+from langchain_core.messages import AnyMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+# Cached message counts before the ledger is reset
+TOKEN_LEDGER_SIZE = 50_000
+
+
+def _fingerprint(message: AnyMessage) -> int:
+    """Cheap hash of what a message says, to notice edits that keep its ID.
+
+    Strings cache their hash, so hashing the same content again is free.
+    """
+    content = message.content
+    if not isinstance(content, str):
+        content = repr(content)
+    # Only AI messages have tool calls (a missing pydantic attribute is slow)
+    if message.type != "ai" or not message.tool_calls:
+        return hash(content)
+    calls = [(call["id"], call["name"], *call["args"].items()) for call in message.tool_calls]
+    try:
+        return hash((content, *calls))
+    except TypeError:
+        # Nested argument values are not hashable
+        return hash((content, repr(calls)))
+
+
+class TokenLedger:
+    """Token counts memoized per message ID and content.
+
+    Messages in the agent state keep their ID across steps, so counting a
+    history only tokenizes the messages added since the previous call. A
+    message edited in place (e.g. tool call args changed on approval) keeps
+    its ID but is counted again. The ledger is a drop-in ``token_counter``
+    for ``SummarizationMiddleware``.
+
+    Args:
+        counter: Token counter applied to single messages
+        max_entries: Cached messages before the ledger is reset
+    """
+
+    def __init__(
+        self,
+        counter: Callable[[list[AnyMessage]], int] = count_tokens_approximately,
+        max_entries: int = TOKEN_LEDGER_SIZE,
+    ) -> None:
+        self.counter = counter
+        self.max_entries = max_entries
+        self._tokens: dict[tuple, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def message_tokens(self, message: AnyMessage) -> int:
+        """Token count of one message, computed once per message ID and content."""
+        if message.id is None:
+            self.misses += 1
+            return self.counter([message])
+        key = (message.id, message.type, _fingerprint(message))
+        tokens = self._tokens.get(key)
+        if tokens is not None:
+            self.hits += 1
+            return tokens
+        self.misses += 1
+        if len(self._tokens) >= self.max_entries:
+            self._tokens.clear()
+        tokens = self._tokens[key] = self.counter([message])
+        return tokens
+
+    def count(self, messages: Iterable[AnyMessage]) -> int:
+        """Total token count of a message list."""
+        return sum(self.message_tokens(message) for message in messages)
+
+    def __call__(self, messages: Iterable[AnyMessage]) -> int:
+        return self.count(messages)
+
+    def stats(self) -> dict:
+        """Cached messages and hit/miss counters."""
+        return {"messages": len(self._tokens), "hits": self.hits, "misses": self.misses}
+
+
+token_ledger = TokenLedger()
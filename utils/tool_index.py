@@ -0,0 +1,113 @@
+"""Local ranking of tools by relevance to a query."""
+
+import math
+import re
+from collections import Counter
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.tools import BaseTool
+
+from espagent.utils.embeddings import tokenize
+
+_IDENTIFIER_SPLIT_RE = re.compile(r"[_.\-]+")
+
+
+def tool_terms(text: str) -> list[str]:
+    """Tokenize text, also splitting identifiers such as ``idf_set_target``."""
+    terms = []
+    for term in tokenize(text):
+        terms.append(term)
+        parts = [part for part in _IDENTIFIER_SPLIT_RE.split(term) if part]
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+class BM25Index:
+    """Okapi BM25 over pre-tokenized documents.
+
+    Args:
+        documents: Terms of each document
+        k1: Term frequency saturation
+        b: Length normalization
+    """
+
+    def __init__(self, documents: list[list[str]], k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self._frequencies = [Counter(terms) for terms in documents]
+        self._lengths = [len(terms) for terms in documents]
+        self._average_length = sum(self._lengths) / len(documents) if documents else 0.0
+        document_frequency = Counter(term for terms in documents for term in set(terms))
+        count = len(documents)
+        self._idf = {
+            term: math.log(1 + (count - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+    def scores(self, query: list[str]) -> list[float]:
+        """BM25 score of every document for the query terms."""
+        terms = [term for term in set(query) if term in self._idf]
+        scores = []
+        for frequencies, length in zip(self._frequencies, self._lengths, strict=True):
+            norm = self.k1 * (1 - self.b + self.b * length / (self._average_length or 1.0))
+            score = 0.0
+            for term in terms:
+                tf = frequencies.get(term)
+                if tf:
+                    score += self._idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+
+def _cosine(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b, strict=False))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def _tool_text(tool: BaseTool) -> str:
+    """Name, description and argument documentation of a tool."""
+    parts = [tool.name, tool.name, tool.description or ""]
+    for name, schema in (tool.args or {}).items():
+        parts.extend([name, schema.get("description", "")])
+    return " ".join(parts)
+
+
+class ToolIndex:
+    """Ranks tools for a query with BM25 and, optionally, embeddings.
+
+    The index is built once per tool set. With ``embeddings``, the cosine
+    similarity between query and tool text is added to the BM25 score,
+    weighted by ``embedding_weight``, which helps with paraphrases and
+    queries in another language than the tool descriptions.
+
+    Args:
+        tools: Tools to index
+        embeddings: Optional local embedding model
+        embedding_weight: Weight of the cosine similarity in the score
+    """
+
+    def __init__(
+        self,
+        tools: list[BaseTool],
+        embeddings: Embeddings | None = None,
+        embedding_weight: float = 2.0,
+    ) -> None:
+        self.names = [tool.name for tool in tools]
+        texts = [_tool_text(tool) for tool in tools]
+        self._bm25 = BM25Index([tool_terms(text) for text in texts])
+        self._embeddings = embeddings
+        self._embedding_weight = embedding_weight
+        self._vectors = embeddings.embed_documents(texts) if embeddings is not None else None
+
+    def rank(self, query: str) -> list[tuple[str, float]]:
+        """Tools with a positive score, most relevant first."""
+        scores = self._bm25.scores(tool_terms(query))
+        if self._vectors is not None:
+            query_vector = self._embeddings.embed_query(query)
+            for i, vector in enumerate(self._vectors):
+                similarity = _cosine(query_vector, vector)
+                scores[i] += self._embedding_weight * max(similarity, 0.0)
+        ranked = sorted(zip(self.names, scores, strict=True), key=lambda item: -item[1])
+        return [(name, score) for name, score in ranked if score > 0]